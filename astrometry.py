@@ -0,0 +1,132 @@
+"""
+Refine the astrometry of many images at once from matched stars.
+
+With CRVAL and the projection fixed, the projection plane coordinates of
+a star depend only on its celestial coordinates, and the CD matrix maps the
+pixel offsets from CRPIX linearly onto them::
+
+  xp = CD1_1*(x - CRPIX1) + CD1_2*(y - CRPIX2)
+  yp = CD2_1*(x - CRPIX1) + CD2_2*(y - CRPIX2)
+
+Each row is the z = a*x + b*y problem of `leastsquares2d`, plus a constant
+if CRPIX is also fit. The matched stars of all images are projected in one
+vectorized call per projection (`wcs.WCSStack.world2proj`), the normal
+equations of every image are summed with `numpy.bincount`, and all images
+are solved together.
+
+"""
+import numpy as np
+
+import leastsquares2d
+import wcs
+
+
+def solve(hdrs, x, y, lon, lat, index, fit_crpix=False, weights=None):
+    """Fit the CD matrix, and optionally CRPIX, of many images from matched
+    pixel and celestial coordinates.
+
+    Parameters
+    ----------
+    hdrs : sequence of astropy.io.fits.Header or dictionary
+        Initial FITS headers of the images; see `wcs.pix2world` for the
+        required keywords. CTYPE, CRVAL, and any LONPOLE and LATPOLE are
+        kept fixed. SIP distortion is not supported.
+    x, y : array
+        Pixel coordinates of the matched stars.
+    lon, lat : array
+        Celestial coordinates of the matched stars in degrees.
+    index : array
+        Index into `hdrs` of the image of each star.
+    fit_crpix : bool, optional
+        If True, also fit CRPIX1 and CRPIX2. Default is False, in which
+        case CRPIX is held fixed at its initial value: an error in it is
+        not corrected and is left in the residuals (a CRPIX that is off by
+        d pixels gives an rms of about d pixels), without a warning.
+    weights : array, optional
+        Weight of each star. Default is uniform weights.
+
+    Returns
+    -------
+    list
+        Updated copies of the headers, with new CD1_1, CD1_2, CD2_1, and
+        CD2_2 (and CRPIX1 and CRPIX2 if `fit_crpix`). Images whose fit is
+        singular, e.g., with too few stars (two are needed for CD, three
+        with CRPIX), are copied unchanged.
+    array
+        rms residual of the stars in pixels for each image, NaN where the
+        fit failed.
+
+    """
+    hdrs = list(hdrs)
+    nimg = len(hdrs)
+    arrays = [x, y, lon, lat, index]
+    if weights is not None:
+        arrays.append(weights)
+    arrays = [np.ravel(arr) for arr in np.broadcast_arrays(*arrays)]
+    x, y, lon, lat = (arr.astype(float) for arr in arrays[:4])
+    index = arrays[4].astype(int)
+    wt = np.ones(len(x)) if weights is None else arrays[5].astype(float)
+    if len(index) and (index.min() < 0 or index.max() >= nimg):
+        raise IndexError('header index out of range')
+
+    # Projection plane coordinates, one WCSStack per projection
+    wcs_list = [wcs.WCS(hdr) for hdr in hdrs]
+    xp, yp = np.empty(len(x)), np.empty(len(x))
+    for projection in set(w.projection for w in wcs_list):
+        members = [i for i, w in enumerate(wcs_list)
+                   if w.projection == projection]
+        local = np.full(nimg, -1)
+        local[members] = np.arange(len(members))
+        stack = wcs.WCSStack.from_headers([wcs_list[i] for i in members])
+        k = local[index] >= 0
+        xp[k], yp[k] = stack.world2proj(lon[k], lat[k], local[index[k]])
+
+    # Per-image normal equations, with the pixel offsets from the initial
+    # CRPIX as the variables
+    crpix = np.array([w.crpix for w in wcs_list]).reshape(-1, 2)
+    dx, dy = x - crpix[index, 0], y - crpix[index, 1]
+    cols = [dx, dy] + ([np.ones(len(x))] if fit_crpix else [])
+    nvar = len(cols)
+    gram = np.empty((nimg, nvar, nvar))
+    rhs = np.empty((2, nimg, nvar))
+    for p in range(nvar):
+        wp = wt * cols[p]
+        for q in range(p, nvar):
+            gram[:, p, q] = gram[:, q, p] = np.bincount(
+                index, wp * cols[q], minlength=nimg)
+        rhs[0, :, p] = np.bincount(index, wp * xp, minlength=nimg)
+        rhs[1, :, p] = np.bincount(index, wp * yp, minlength=nimg)
+    coeffs = leastsquares2d.solve_normal(np.stack([gram, gram]), rhs)
+
+    # coeffs[row, image] = (CDrow1, CDrow2[, projection plane offset])
+    cd = coeffs[:, :, :2].transpose(1, 0, 2)
+    ok = np.all(np.isfinite(coeffs), axis=(0, 2))
+    ok[ok] = np.linalg.det(cd[ok]) != 0
+    cd[~ok] = np.eye(2)
+    cdinv = np.linalg.inv(cd)
+    shift = np.zeros((nimg, 2))
+    if fit_crpix:
+        # The new CRPIX is the pixel offset where (xp, yp) = (0, 0)
+        shift[ok] = -np.einsum('nij,nj->ni', cdinv[ok], coeffs[:, ok, 2].T)
+
+    # Residuals in pixels
+    cdi = cdinv[index]
+    rx = dx - shift[index, 0] - (cdi[:, 0, 0]*xp + cdi[:, 0, 1]*yp)
+    ry = dy - shift[index, 1] - (cdi[:, 1, 0]*xp + cdi[:, 1, 1]*yp)
+    count = np.bincount(index, minlength=nimg)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rms = np.sqrt(np.bincount(index, rx*rx + ry*ry, minlength=nimg) /
+                      count)
+    rms[~ok] = np.nan
+
+    newhdrs = []
+    for i, hdr in enumerate(hdrs):
+        hdr = hdr.copy()
+        if ok[i]:
+            hdr['CD1_1'], hdr['CD1_2'] = float(cd[i, 0, 0]), float(cd[i, 0, 1])
+            hdr['CD2_1'], hdr['CD2_2'] = float(cd[i, 1, 0]), float(cd[i, 1, 1])
+            if fit_crpix:
+                hdr['CRPIX1'] = float(crpix[i, 0] + shift[i, 0])
+                hdr['CRPIX2'] = float(crpix[i, 1] + shift[i, 1])
+        newhdrs.append(hdr)
+    return newhdrs, rms
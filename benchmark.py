@@ -0,0 +1,501 @@
+"""
+Benchmarks for the hot paths in `wcs`, `leastsquares2d`, and `param`.
+
+Each benchmark times one entry point over a range of problem sizes (number
+of points, or number of values for `param`), and records the best wall
+time of several repeats, the throughput, and the peak memory allocated
+during a single call. Memory is traced in a separate call because tracing
+slows numpy down.
+
+Results can be saved as a JSON baseline, and later runs compared against
+it to flag regressions. Timings are only comparable on the same machine.
+The 'matrix' engine and single precision are benchmarked alongside the
+default engine, and their accuracy relative to it is reported. When
+`astropy` is installed, `wcs` is also compared with `astropy.wcs` for speed
+and agreement.
+
+Run as a script::
+
+  python benchmark.py                        # run all, print a report
+  python benchmark.py -b wcs.pix2world -s 100 1e6 1e8
+  python benchmark.py --save baseline.json
+  python benchmark.py --compare baseline.json
+
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import leastsquares2d
+import param
+import wcs
+
+
+# Reference header for the wcs benchmarks (about 0.43 arcsec pixels)
+HEADER = {
+    'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+    'CRPIX1': 1024.5, 'CRPIX2': 980.2,
+    'CRVAL1': 10.68, 'CRVAL2': 41.27,
+    'CD1_1': -1.2e-4, 'CD1_2': 3e-6, 'CD2_1': 2.5e-6, 'CD2_2': 1.2e-4,
+    }
+
+# Minimum total time of a timing repeat in seconds
+MINTIME = 0.2
+
+# A benchmark is flagged as a regression if it is this many times slower
+# than the baseline
+TOLERANCE = 1.25
+
+
+def _pixels(n, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.uniform(-1000, 3000, n), rng.uniform(-1000, 3000, n)
+
+
+def _setup_pix2world(n, engine='trig'):
+    w = wcs.WCS(HEADER)
+    x, y = _pixels(n)
+    return lambda: w.pix2world(x, y, engine=engine)
+
+
+def _setup_pix2world_matrix(n):
+    return _setup_pix2world(n, engine='matrix')
+
+
+def _setup_pix2world_float32(n):
+    w = wcs.WCS(HEADER)
+    x, y = (val.astype(np.float32) for val in _pixels(n))
+    return lambda: w.pix2world(x, y)
+
+
+def _setup_pix2world_header(n):
+    # Includes parsing the header on every call
+    x, y = _pixels(n)
+    return lambda: wcs.pix2world(x, y, HEADER)
+
+
+def _setup_world2pix(n, engine='trig'):
+    w = wcs.WCS(HEADER)
+    lon, lat = w.pix2world(*_pixels(n))
+    return lambda: w.world2pix(lon, lat, engine=engine)
+
+
+def _setup_world2pix_matrix(n):
+    return _setup_world2pix(n, engine='matrix')
+
+
+def _setup_world2pix_float32(n):
+    w = wcs.WCS(HEADER)
+    lon, lat = (val.astype(np.float32) for val in w.pix2world(*_pixels(n)))
+    return lambda: w.world2pix(lon, lat)
+
+
+def _setup_roundtrip(n, engine='trig'):
+    w = wcs.WCS(HEADER)
+    x, y = _pixels(n)
+    return lambda: w.world2pix(*w.pix2world(x, y, engine=engine),
+                               engine=engine)
+
+
+def _setup_roundtrip_matrix(n):
+    return _setup_roundtrip(n, engine='matrix')
+
+
+def _setup_leastsquares2d(n):
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(0, 1, n), rng.uniform(0, 1, n)
+    z = 2*x - 3*y + rng.normal(0, 0.01, n)
+    return lambda: leastsquares2d.leastsquares2d(x, y, z)
+
+
+def _setup_leastsquares2d_batch(n):
+    # n independent fits of 16 points each
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(0, 1, (n, 16)), rng.uniform(0, 1, (n, 16))
+    z = 2*x - 3*y + rng.normal(0, 0.01, (n, 16))
+    return lambda: leastsquares2d.leastsquares2d_batch(x, y, z)
+
+
+def _setup_leastsquares(n):
+    # Three weighted variables and an intercept
+    rng = np.random.RandomState(0)
+    xs = rng.uniform(0, 1, (3, n))
+    z = xs.sum(axis=0) + 1 + rng.normal(0, 0.01, n)
+    w = rng.uniform(0.5, 2, n)
+    return lambda: leastsquares2d.leastsquares(xs, z, weights=w,
+                                               intercept=True)
+
+
+def _param_values(n):
+    rng = np.random.RandomState(0)
+    return [(float(val), '{:.4f}') for val in rng.uniform(0, 1, n)]
+
+
+def _setup_param_init(n):
+    vals = _param_values(n)
+    return lambda: param.Param(vals)
+
+
+def _setup_param_str(n):
+    p = param.Param(_param_values(n))
+    return lambda: str(p)
+
+
+def _setup_paramtable_init(n):
+    vals = _param_values(n)
+    return lambda: param.ParamTable(vals)
+
+
+def _setup_paramtable_strings(n):
+    table = param.ParamTable(_param_values(n))
+    return table.strings
+
+
+# Benchmark name -> (setup function, default sizes). A setup function takes
+# a problem size and returns the function to time.
+BENCHMARKS = [
+    ('wcs.pix2world', _setup_pix2world, [10**k for k in range(2, 7)]),
+    ('wcs.pix2world[header]', _setup_pix2world_header,
+     [10**k for k in range(2, 7)]),
+    ('wcs.pix2world[matrix]', _setup_pix2world_matrix,
+     [10**k for k in range(2, 7)]),
+    ('wcs.pix2world[float32]', _setup_pix2world_float32,
+     [10**k for k in range(2, 7)]),
+    ('wcs.world2pix', _setup_world2pix, [10**k for k in range(2, 7)]),
+    ('wcs.world2pix[matrix]', _setup_world2pix_matrix,
+     [10**k for k in range(2, 7)]),
+    ('wcs.world2pix[float32]', _setup_world2pix_float32,
+     [10**k for k in range(2, 7)]),
+    ('wcs.roundtrip', _setup_roundtrip, [10**k for k in range(2, 7)]),
+    ('wcs.roundtrip[matrix]', _setup_roundtrip_matrix,
+     [10**k for k in range(2, 7)]),
+    ('leastsquares2d', _setup_leastsquares2d, [10**k for k in range(2, 7)]),
+    ('leastsquares2d_batch', _setup_leastsquares2d_batch,
+     [10**k for k in range(2, 6)]),
+    ('leastsquares', _setup_leastsquares, [10**k for k in range(2, 7)]),
+    ('param.Param', _setup_param_init, [10**k for k in range(0, 4)]),
+    ('param.Param.__str__', _setup_param_str, [10**k for k in range(0, 4)]),
+    ('param.ParamTable', _setup_paramtable_init,
+     [10**k for k in range(0, 6)]),
+    ('param.ParamTable.strings', _setup_paramtable_strings,
+     [10**k for k in range(0, 6)]),
+    ]
+
+
+def _astropy_wcs():
+    """An `astropy.wcs.WCS` for `HEADER`, or None if astropy is not
+    installed.
+
+    """
+    try:
+        from astropy.io import fits
+        from astropy.wcs import WCS
+    except ImportError:
+        return None
+    return WCS(fits.Header(HEADER))
+
+
+def _setup_astropy_pix2world(n):
+    w = _astropy_wcs()
+    x, y = _pixels(n)
+    return lambda: w.wcs_pix2world(x, y, 1)
+
+
+def _setup_astropy_world2pix(n):
+    w = _astropy_wcs()
+    lon, lat = w.wcs_pix2world(*(_pixels(n) + (1,)))
+    return lambda: w.wcs_world2pix(lon, lat, 1)
+
+
+ASTROPY_BENCHMARKS = [
+    ('astropy.wcs.pix2world', _setup_astropy_pix2world,
+     [10**k for k in range(2, 7)]),
+    ('astropy.wcs.world2pix', _setup_astropy_world2pix,
+     [10**k for k in range(2, 7)]),
+    ]
+
+
+def time_call(func, repeat=3, mintime=None):
+    """Best time of `repeat` timings of a function.
+
+    Each timing calls the function enough times to take at least `mintime`
+    seconds (default `MINTIME`), so that short calls are not dominated by
+    timer resolution.
+
+    Returns
+    -------
+    float
+        Best time per call in seconds.
+
+    """
+    if mintime is None:
+        mintime = MINTIME
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= mintime:
+            break
+        number *= max(2, min(10, int(mintime/max(elapsed, 1e-9)) + 1))
+
+    best = elapsed/number
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - t0)/number)
+    return best
+
+
+def peak_memory(func):
+    """Peak memory in bytes allocated during a single call of a function,
+    as traced by `tracemalloc` (numpy reports its array allocations).
+
+    """
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run(names=None, sizes=None, repeat=3, astropy=True):
+    """Run benchmarks.
+
+    Parameters
+    ----------
+    names : list, optional
+        Names of the benchmarks to run (see `BENCHMARKS`). Default is all.
+    sizes : list, optional
+        Problem sizes overriding the default sizes of the coordinate
+        transform benchmarks (`wcs` and `astropy.wcs`), or of all of the
+        benchmarks in `names` if it is given. Otherwise, the other
+        benchmarks keep their default sizes, which are scaled to their cost
+        (e.g., at most 1000 values for `param.Param`).
+    repeat : int, optional
+        Number of timings of each call; the best is kept. Default is 3.
+    astropy : bool, optional
+        If True (default) and astropy is installed, also run the
+        `astropy.wcs` benchmarks and measure the agreement with `wcs`.
+
+    Returns
+    -------
+    list
+        A dictionary for each benchmark and size, with keys 'name', 'size',
+        'time' (seconds per call), 'throughput' (size per second), and
+        'peak' (bytes).
+
+    """
+    benchmarks = list(BENCHMARKS)
+    if astropy and _astropy_wcs() is not None:
+        benchmarks += ASTROPY_BENCHMARKS
+    if names is not None:
+        known = [b[0] for b in benchmarks]
+        for name in names:
+            if name not in known:
+                raise ValueError('Unknown benchmark: {:s}'.format(name))
+        benchmarks = [b for b in benchmarks if b[0] in names]
+
+    results = []
+    for name, setup, default_sizes in benchmarks:
+        if sizes is not None and (names is not None or 'wcs.' in name):
+            default_sizes = sizes
+        for size in default_sizes:
+            size = int(size)
+            func = setup(size)
+            t = time_call(func, repeat=repeat)
+            results.append({
+                'name': name, 'size': size, 'time': t,
+                'throughput': size/t, 'peak': peak_memory(func),
+                })
+    return results
+
+
+def astropy_agreement(n=10**5):
+    """Maximum differences between `wcs` and `astropy.wcs`.
+
+    Returns
+    -------
+    dict or None
+        'pix2world' is the largest angular separation in arcseconds between
+        the celestial coordinates of `n` random pixels, and 'world2pix' is
+        the largest distance in pixels between the pixel coordinates of the
+        resulting celestial coordinates. None if astropy is not installed.
+
+    """
+    aw = _astropy_wcs()
+    if aw is None:
+        return None
+    w = wcs.WCS(HEADER)
+    x, y = _pixels(n)
+    lon1, lat1 = w.pix2world(x, y)
+    lon2, lat2 = aw.wcs_pix2world(x, y, 1)
+    sep = wcs._angular_error(lon1, lat1, lon2, lat2)
+    x1, y1 = w.world2pix(lon2, lat2)
+    x2, y2 = aw.wcs_world2pix(lon2, lat2, 1)
+    return {
+        'pix2world': np.max(sep) * 3600,
+        'world2pix': np.max(np.hypot(x1 - x2, y1 - y2)),
+        }
+
+
+def engine_accuracy(n=10**5):
+    """Accuracy of the 'matrix' engine and of single precision relative to
+    the default double precision 'trig' engine.
+
+    Returns
+    -------
+    dict
+        'matrix' is the largest angular separation in arcseconds between
+        the celestial coordinates of `n` random pixels from the two
+        engines, and 'float32' the same for single precision. 'roundtrip'
+        and 'roundtrip[matrix]' are the largest distances in pixels between
+        the pixels and their pix2world/world2pix round trips with each
+        engine.
+
+    """
+    w = wcs.WCS(HEADER)
+    x, y = _pixels(n)
+    lon, lat = w.pix2world(x, y)
+    mlon, mlat = w.pix2world(x, y, engine='matrix')
+    slon, slat = w.pix2world(x, y, dtype=np.float32)
+    result = {
+        'matrix': np.max(wcs._angular_error(lon, lat, mlon, mlat)) * 3600,
+        'float32': np.max(wcs._angular_error(lon, lat, slon, slat)) * 3600,
+        }
+    for engine, key in (('trig', 'roundtrip'),
+                        ('matrix', 'roundtrip[matrix]')):
+        x2, y2 = w.world2pix(*w.pix2world(x, y, engine=engine),
+                             engine=engine)
+        result[key] = np.max(np.hypot(x2 - x, y2 - y))
+    return result
+
+
+def save(results, filename):
+    """Save benchmark results as a JSON baseline."""
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+def load(filename):
+    """Load a JSON baseline saved by `save`."""
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=None):
+    """Compare benchmark results with a baseline.
+
+    Parameters
+    ----------
+    results, baseline : list
+        Benchmark results from `run` (or `load`).
+    tolerance : float, optional
+        Results slower than the baseline by more than this factor are
+        regressions. Default is `TOLERANCE`.
+
+    Returns
+    -------
+    list
+        A (result, ratio) pair for each result with a baseline, where
+        `ratio` is the time relative to the baseline time.
+    list
+        The (result, ratio) pairs that are regressions.
+
+    """
+    if tolerance is None:
+        tolerance = TOLERANCE
+    base = dict(((r['name'], r['size']), r['time']) for r in baseline)
+    ratios = [(r, r['time']/base[(r['name'], r['size'])])
+              for r in results if (r['name'], r['size']) in base]
+    regressions = [(r, ratio) for r, ratio in ratios if ratio > tolerance]
+    return ratios, regressions
+
+
+def report(results, ratios=None, tolerance=None):
+    """Format benchmark results as a table.
+
+    If `ratios` from `compare` are given, the time relative to the baseline
+    is included and regressions are marked with '!'.
+
+    """
+    if tolerance is None:
+        tolerance = TOLERANCE
+    ratios = dict((id(r), ratio) for r, ratio in (ratios or []))
+    fmt = '{:<24s} {:>10s} {:>12s} {:>12s} {:>10s} {:>9s}'
+    lines = [fmt.format('benchmark', 'size', 'time [s]', 'rate [1/s]',
+                        'peak [MB]', 'baseline')]
+    for r in results:
+        ratio = ratios.get(id(r))
+        ratio = '' if ratio is None else '{:.2f}x{:s}'.format(
+            ratio, '!' if ratio > tolerance else ' ')
+        lines.append(fmt.format(
+            r['name'], '{:d}'.format(r['size']), '{:.3e}'.format(r['time']),
+            '{:.3e}'.format(r['throughput']),
+            '{:.1f}'.format(r['peak']/2.0**20), ratio))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the wcs, leastsquares2d, and param modules.')
+    parser.add_argument('-b', '--benchmark', nargs='+', dest='names',
+                        help='benchmarks to run (default all): ' +
+                        ', '.join(b[0] for b in BENCHMARKS))
+    parser.add_argument('-s', '--sizes', nargs='+', type=float,
+                        help='problem sizes of the wcs transform benchmarks, '
+                        'or of all benchmarks given with -b (default '
+                        'depends on benchmark)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='timings per call (default 3)')
+    parser.add_argument('--no-astropy', dest='astropy', action='store_false',
+                        help='skip the astropy.wcs comparison')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='slowdown factor flagged as a regression '
+                        '(default {:.2f})'.format(TOLERANCE))
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.sizes, args.repeat, args.astropy)
+    ratios, regressions = None, []
+    if args.compare:
+        ratios, regressions = compare(results, load(args.compare),
+                                      args.tolerance)
+    print(report(results, ratios, args.tolerance))
+
+    accuracy = engine_accuracy()
+    print('\nmatrix - trig: pix2world {:.2e} arcsec; round trip {:.2e} pix '
+          '(matrix), {:.2e} pix (trig)'.format(accuracy['matrix'],
+                                              accuracy['roundtrip[matrix]'],
+                                              accuracy['roundtrip']))
+    print('float32 - float64: pix2world {:.2e} arcsec'.format(
+        accuracy['float32']))
+
+    if args.astropy:
+        agreement = astropy_agreement()
+        if agreement is not None:
+            print('\nwcs - astropy.wcs: pix2world {:.2e} arcsec, '
+                  'world2pix {:.2e} pix'.format(agreement['pix2world'],
+                                                agreement['world2pix']))
+
+    if args.save:
+        save(results, args.save)
+    if regressions:
+        print('\n{:d} regression(s)'.format(len(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
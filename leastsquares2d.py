@@ -1,6 +1,13 @@
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 
 
+# Default number of points summed at a time by `Accumulator2d.update` and
+# `leastsquares`
+CHUNKSIZE = 2**20
+
+
 def leastsquares2d(x, y, z):
     """Use 2d least squares minimization to find the best-fit a and b for
     zi = a*xi + b*yi.
@@ -48,20 +55,645 @@ def leastsquares2d(x, y, z):
       a*sx + b*sxy = sxz
       a*sxy + b*sy = syz
 
-    Therefore, ::
+    Therefore, by Cramer's rule, ::
 
-      a = (sxz - sxy*syz/sy) / (sx - sxy**2/sy)
-      b = (sxz - a*sx) / sxy
+      a = (sxz*sy - sxy*syz) / (sx*sy - sxy**2)
+      b = (sx*syz - sxy*sxz) / (sx*sy - sxy**2)
+
+    which, unlike eliminating a first, does not divide by ``sxy`` and so
+    also holds for uncorrelated x and y (``sxy == 0``).
 
     """
-    i = x != y
-    if np.sum(i) == 0:
+    x, y, z = (np.ravel(arr) for arr in np.broadcast_arrays(x, y, z))
+    sx, sxy, sy, sxz, syz, count = _sums(x, y, z)
+    if count == 0:
         return np.nan
 
-    sx, sxy, sxz = np.sum(x[i]**2), np.sum(x[i]*y[i]), np.sum(x[i]*z[i])
-    sy,      syz = np.sum(y[i]**2),                    np.sum(y[i]*z[i])
+    a, b = _solve(sx, sxy, sy, sxz, syz)
+
+    return a[()], b[()]
 
-    a = (sxz - sxy*syz/sy) / (sx - sxy**2/sy)
-    b = (sxz - a*sx) / sxy
 
+def _sums(x, y, z):
+    """Normal-equation sums sx, sxy, sy, sxz, and syz (see
+    `leastsquares2d`) and the number of points used, along the last axis.
+    Points where x == y are ignored.
+
+    The sums are `numpy.einsum` reductions, which do not allocate the
+    elementwise products; points are only copied if some x == y.
+
+    """
+    x, y, z = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                  np.asarray(y, dtype=float),
+                                  np.asarray(z, dtype=float))
+    i = x != y
+    count = np.count_nonzero(i, axis=-1)
+    if not np.all(i):
+        x, y = np.where(i, x, 0.0), np.where(i, y, 0.0)
+
+    sx, sxy, sxz = (np.einsum('...i,...i->...', x, x),
+                    np.einsum('...i,...i->...', x, y),
+                    np.einsum('...i,...i->...', x, z))
+    sy,      syz = (np.einsum('...i,...i->...', y, y),
+                    np.einsum('...i,...i->...', y, z))
+    return sx, sxy, sy, sxz, syz, count
+
+
+def _solve(sx, sxy, sy, sxz, syz):
+    """Solve the normal equations of `leastsquares2d` for a and b,
+
+      a*sx + b*sxy = sxz
+      a*sxy + b*sy = syz
+
+    by Cramer's rule. The sums may be arrays; a and b are NaN where the
+    equations are singular.
+
+    """
+    sx, sxy, sy, sxz, syz = (np.asarray(s, dtype=float)
+                             for s in (sx, sxy, sy, sxz, syz))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = sx*sy - sxy*sxy
+        a = (sxz*sy - sxy*syz) / det
+        b = (sx*syz - sxy*sxz) / det
+    bad = det == 0
+    if np.any(bad):
+        a, b = np.where(bad, np.nan, a), np.where(bad, np.nan, b)
     return a, b
+
+
+def leastsquares2d_batch(x, y, z, axis=-1):
+    """Batched version of `leastsquares2d` for many independent fits.
+
+    Each fit is along `axis`, and all other axes index the fits, e.g., a
+    (ntime, ny, nx) cube with ``axis=0`` gives one fit per pixel. As in
+    `leastsquares2d`, points where x == y are ignored.
+
+    Parameters
+    ----------
+    x, y : array
+        Input x and y values.
+    z : array
+        z values for all pairs of x and y. `x`, `y`, and `z` are
+        broadcast against each other.
+    axis : int, optional
+        Axis along which to fit. Default is the last axis.
+
+    Returns
+    -------
+    tuple
+        Arrays of the best-fit ``a`` and ``b`` parameters, with the shape
+        of the broadcast input without `axis`. Fits are NaN where all x ==
+        y or where the normal equations are otherwise singular.
+
+    Notes
+    -----
+    The five normal-equation sums (see `leastsquares2d`) are computed as
+    `numpy.einsum` reductions, which do not allocate the elementwise
+    products, and the equations are solved for all fits at once by
+    Cramer's rule, as in `leastsquares2d`.
+
+    """
+    x, y, z = np.broadcast_arrays(x, y, z)
+    x, y, z = (np.moveaxis(arr, axis, -1) for arr in (x, y, z))
+    a, b = _solve(*_sums(x, y, z)[:5])
+    return a[()], b[()]
+
+
+class Accumulator2d(object):
+
+    """Streaming accumulator for the `leastsquares2d` fit.
+
+    Only the normal-equation sums are kept, so a fit over any number of
+    points takes a single pass in constant memory: update the accumulator
+    chunk by chunk (e.g., from a generator or a memory-mapped file) and
+    solve at the end. Accumulators of disjoint parts of the data can be
+    merged, e.g., after summing the parts in separate worker processes;
+    they are small and picklable.
+
+    Parameters
+    ----------
+    x, y, z : array, optional
+        Initial data, passed to `update`.
+
+    Attributes
+    ----------
+    sx, sxy, sy, sxz, syz : float
+        Sums of x**2, x*y, y**2, x*z, and y*z over the points used.
+    count : int
+        Number of points used. As in `leastsquares2d`, points where x == y
+        are ignored.
+
+    Methods
+    -------
+    update(x, y, z)
+        Add points to the sums.
+    merge(other)
+        Add the sums of another accumulator.
+    solve()
+        The best-fit a and b for all points so far.
+    from_chunks(chunks)
+        Class method. Accumulate an iterable of (x, y, z) chunks.
+
+    """
+
+    def __init__(self, x=None, y=None, z=None):
+        self.sx = self.sxy = self.sy = self.sxz = self.syz = 0.0
+        self.count = 0
+        if x is not None:
+            self.update(x, y, z)
+
+    def update(self, x, y, z, chunksize=None):
+        """Add points to the sums.
+
+        Parameters
+        ----------
+        x, y, z : array
+            Input x, y, and z values, broadcast against each other and
+            flattened.
+        chunksize : int, optional
+            Number of points summed at a time, which bounds the temporary
+            memory for large (e.g., memory-mapped) inputs. Default is
+            `CHUNKSIZE`.
+
+        Returns
+        -------
+        Accumulator2d
+            The accumulator itself.
+
+        """
+        if chunksize is None:
+            chunksize = CHUNKSIZE
+        x, y, z = (arr.reshape(-1) for arr in np.broadcast_arrays(x, y, z))
+        for j in range(0, len(x), chunksize):
+            k = j + chunksize
+            sums = _sums(x[j:k], y[j:k], z[j:k])
+            self.sx += sums[0]
+            self.sxy += sums[1]
+            self.sy += sums[2]
+            self.sxz += sums[3]
+            self.syz += sums[4]
+            self.count += int(sums[5])
+        return self
+
+    def merge(self, other):
+        """Add the sums of another `Accumulator2d`, e.g., one from a worker
+        process. Returns the accumulator itself.
+
+        """
+        self.sx += other.sx
+        self.sxy += other.sxy
+        self.sy += other.sy
+        self.sxz += other.sxz
+        self.syz += other.syz
+        self.count += other.count
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return Accumulator2d().merge(self).merge(other)
+
+    def solve(self):
+        """The best-fit a and b for all points so far.
+
+        Returns
+        -------
+        tuple
+            The best-fit ``a`` and ``b`` parameters, NaN if no points were
+            used or the normal equations are singular.
+
+        """
+        a, b = _solve(self.sx, self.sxy, self.sy, self.sxz, self.syz)
+        return float(a), float(b)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Accumulate an iterable of (x, y, z) chunks.
+
+        Examples
+        --------
+        Fit the columns of a large binary file in a single pass:
+
+        >>> data = np.memmap('points.dat', dtype=float).reshape(-1, 3)
+        >>> chunks = (data[i:i+10**6].T for i in range(0, len(data), 10**6))
+        >>> a, b = Accumulator2d.from_chunks(chunks).solve()
+
+        """
+        acc = cls()
+        for x, y, z in chunks:
+            acc.update(x, y, z)
+        return acc
+
+
+def _window_sums(p, rows, cols):
+    """Sums of `p` over the windows [rows[0][i], rows[1][i]) x [cols[0][j],
+    cols[1][j]) of its last two axes, from a summed-area table.
+
+    """
+    sat = np.zeros(p.shape[:-2] + (p.shape[-2] + 1, p.shape[-1] + 1))
+    np.cumsum(p, axis=-2, out=sat[..., 1:, 1:])
+    np.cumsum(sat[..., 1:, 1:], axis=-1, out=sat[..., 1:, 1:])
+    (r0, r1), (c0, c1) = rows, cols
+    return (sat[..., r1[:, None], c1] - sat[..., r0[:, None], c1] -
+            sat[..., r1[:, None], c0] + sat[..., r0[:, None], c0])
+
+
+def leastsquares2d_local(x, y, z, size):
+    """Local `leastsquares2d` fits in a sliding window at every pixel of an
+    image.
+
+    Parameters
+    ----------
+    x, y : array
+        Input x and y images. Leading axes, if any, index a stack of
+        images that are fit independently.
+    z : array
+        z values for all pairs of x and y. `x`, `y`, and `z` are
+        broadcast against each other.
+    size : int or tuple
+        Window size, or (ny, nx) window sizes, in pixels. The window of
+        pixel (i, j) starts at (i - ny//2, j - nx//2), so odd sizes are
+        centered; windows are truncated at the edges of the image.
+
+    Returns
+    -------
+    tuple
+        Images of the best-fit ``a`` and ``b`` parameters, with the shape
+        of the broadcast input. As in `leastsquares2d`, points where x ==
+        y are ignored, as are points with non-finite values; fits are NaN
+        where fewer than two points remain or the normal equations are
+        singular.
+
+    Notes
+    -----
+    The summed-area table (integral image) of each of x**2, x*y, y**2,
+    x*z, and y*z is built once, after which the sums over any window take
+    four lookups. The run time is therefore independent of the window
+    size, versus proportional to the window area for direct sums.
+
+    The window sums are differences of cumulative sums over the whole
+    image, so their absolute rounding errors scale with the image totals
+    rather than the window totals. This is normally negligible in double
+    precision, but very small windows in large images with a wide dynamic
+    range may lose some digits.
+
+    """
+    x, y, z = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                  np.asarray(y, dtype=float),
+                                  np.asarray(z, dtype=float))
+    wy, wx = (size, size) if np.ndim(size) == 0 else size
+    ny, nx = x.shape[-2:]
+    start = np.arange(ny) - wy//2
+    rows = np.clip(start, 0, ny), np.clip(start + wy, 0, ny)
+    start = np.arange(nx) - wx//2
+    cols = np.clip(start, 0, nx), np.clip(start + wx, 0, nx)
+
+    # Ignored points are zeroed; a single NaN would otherwise spread
+    # through the summed-area tables
+    i = (x != y) & np.isfinite(x) & np.isfinite(y) & np.isfinite(z)
+    x, y, z = np.where(i, x, 0.0), np.where(i, y, 0.0), np.where(i, z, 0.0)
+
+    sums = [_window_sums(p, rows, cols)
+            for p in (x*x, x*y, y*y, x*z, y*z)]
+    a, b = _solve(*sums)
+
+    # A fit needs at least two points, but the rounding errors of the
+    # tables would otherwise give finite nonsense for single points
+    few = _window_sums(i.astype(float), rows, cols) < 2
+    a[few], b[few] = np.nan, np.nan
+    return a[()], b[()]
+
+
+def solve_normal(matrix, rhs, rtol=None):
+    """Solve symmetric normal equations by Cholesky factorization after
+    scaling the matrix to a unit diagonal.
+
+    Parameters
+    ----------
+    matrix : array
+        (n, n) symmetric matrix of the normal equations, or a (..., n, n)
+        stack of them.
+    rhs : array
+        (n,) right-hand side, or a (..., n) stack matching `matrix`.
+    rtol : float, optional
+        Smallest eigenvalue of the scaled matrix for a system to count as
+        positive definite. Default is the number of unknowns times the
+        float epsilon.
+
+    Returns
+    -------
+    array
+        Solution with the shape of `rhs`. It is NaN for systems that are
+        not positive definite to within `rtol`.
+
+    """
+    matrix = np.array(matrix, dtype=float)
+    rhs = np.asarray(rhs, dtype=float)
+    nvar = rhs.shape[-1]
+    if rtol is None:
+        rtol = nvar * np.finfo(float).eps
+    if nvar == 0:
+        return np.full(rhs.shape, np.nan)
+    diag = np.diagonal(matrix, axis1=-2, axis2=-1)
+    ok = np.all(diag > 0, axis=-1)
+    scale = 1/np.sqrt(np.where(diag > 0, diag, 1.0))
+    matrix *= scale[..., :, None] * scale[..., None, :]
+
+    # Singular systems are swapped for the identity so that the stack can
+    # be factored in one call, and their solutions replaced with NaN
+    eye = np.eye(nvar)
+    matrix[~ok] = eye
+    ok &= np.linalg.eigvalsh(matrix).min(axis=-1) > rtol
+    matrix[~ok] = eye
+    lower = np.linalg.cholesky(matrix)
+    u = np.linalg.solve(lower, (rhs * scale)[..., None])
+    solution = np.linalg.solve(np.swapaxes(lower, -1, -2), u)[..., 0] * scale
+    solution[~ok] = np.nan
+    return solution
+
+
+def leastsquares(xs, z, weights=None, intercept=False, chunksize=None):
+    """Weighted linear least squares fit of z = sum(a_k*x_k) (+ c) for
+    any number of variables.
+
+    `leastsquares2d` remains the fast path for two variables without
+    weights or intercept; unlike it, this function uses every point.
+
+    Parameters
+    ----------
+    xs : sequence of arrays or array
+        The variables x_k, one array per variable (or the rows of a 2d
+        array).
+    z : array
+        z values for each point.
+    weights : array, optional
+        Weight of each point, e.g., 1/sigma**2. Default is uniform
+        weights.
+    intercept : bool, optional
+        If True, also fit a constant term c. Default is False.
+    chunksize : int, optional
+        Number of points processed at a time. Default is `CHUNKSIZE`.
+
+    Returns
+    -------
+    array
+        The best-fit coefficients a_k, followed by c if `intercept` is
+        True. All are NaN if the fit is singular (e.g., a variable is
+        constant or a linear combination of the others).
+
+    Notes
+    -----
+    The design matrix A = [x_1, ..., x_k, 1, z] is built a chunk of points
+    at a time, and the weighted Gram matrix A.T*W*A, which holds both the
+    normal matrix and the right-hand side, is accumulated with one matrix
+    product per chunk. The normal equations are then scaled to a unit
+    diagonal and solved by Cholesky factorization, which fails for
+    (numerically) singular systems instead of returning large, meaningless
+    coefficients.
+
+    """
+    if chunksize is None:
+        chunksize = CHUNKSIZE
+    xs = [np.asarray(x, dtype=float) for x in xs]
+    arrays = xs + [np.asarray(z, dtype=float)]
+    if weights is not None:
+        arrays.append(np.asarray(weights, dtype=float))
+    arrays = [arr.reshape(-1) for arr in np.broadcast_arrays(*arrays)]
+    w = arrays.pop() if weights is not None else None
+    npts, nvar = len(arrays[-1]), len(xs) + bool(intercept)
+
+    # Columns: variables, intercept, z
+    block = np.empty((min(chunksize, npts), nvar + 1))
+    wblock = np.empty_like(block) if w is not None else None
+    if intercept:
+        block[:, nvar-1] = 1.0
+    gram = np.zeros((nvar + 1, nvar + 1))
+    for j in range(0, npts, chunksize):
+        n = min(chunksize, npts - j)
+        b = block[:n]
+        for col, x in enumerate(xs):
+            b[:, col] = x[j:j+n]
+        b[:, -1] = arrays[-1][j:j+n]
+        if w is None:
+            gram += b.T.dot(b)
+        else:
+            np.multiply(b, w[j:j+n, None], out=wblock[:n])
+            gram += wblock[:n].T.dot(b)
+
+    return solve_normal(gram[:-1, :-1], gram[:-1, -1])
+
+
+def leastsquares2d_cov(x, y, z, method='bootstrap', nboot=1000, seed=None,
+                       workers=None):
+    """`leastsquares2d` fit with a resampling estimate of the covariance of
+    a and b.
+
+    Parameters
+    ----------
+    x, y, z : array
+        See `leastsquares2d`; the arrays are flattened. Points where x ==
+        y are ignored.
+    method : {'bootstrap', 'jackknife'}, optional
+        Resampling method. Default is 'bootstrap'.
+    nboot : int, optional
+        Number of bootstrap replicates. Default is 1000.
+    seed : int or numpy.random.SeedSequence, optional
+        Seed for the bootstrap resampling. The replicates depend only on
+        the seed and the data, not on `workers`.
+    workers : int, optional
+        Number of threads to split the bootstrap replicates across.
+        Default is None (no threads).
+
+    Returns
+    -------
+    a, b : float
+        The best-fit parameters for all points.
+    cov : array
+        2x2 covariance matrix of (a, b). Bootstrap replicates with singular
+        normal equations are left out.
+
+    Notes
+    -----
+    The fit depends on the data only through the sums of the per-point
+    products p_i = (xi**2, xi*yi, yi**2, xi*zi, yi*zi). A bootstrap
+    replicate draws each point c_i times, so its sums are c.dot(P). A
+    block of replicates is therefore a single matrix product of their
+    counts with P, and the normal equations of all replicates are solved
+    at once. The jackknife sums are the totals minus each p_i in turn.
+
+    """
+    x, y, z = (arr.reshape(-1) for arr in
+               np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float),
+                                   np.asarray(z, dtype=float)))
+    i = x != y
+    if not np.all(i):
+        x, y, z = x[i], y[i], z[i]
+    npts = len(x)
+    if npts == 0:
+        return np.nan, np.nan, np.full((2, 2), np.nan)
+    products = np.stack([x*x, x*y, y*y, x*z, y*z], axis=1)
+    totals = products.sum(axis=0)
+    a, b = (float(val) for val in _solve(*totals))
+
+    if method == 'jackknife':
+        ab = np.array(_solve(*(totals - products).T)).T
+        ab = ab[np.all(np.isfinite(ab), axis=1)]
+        dev = ab - ab.mean(axis=0)
+        cov = dev.T.dot(dev) * (npts - 1) / npts
+    elif method == 'bootstrap':
+        # Blocks of replicates whose counts fill about CHUNKSIZE values,
+        # each with its own random stream
+        nblock = max(1, min(nboot, CHUNKSIZE // max(npts, 1)))
+        starts = range(0, nboot, nblock)
+        seqs = np.random.SeedSequence(seed).spawn(len(starts))
+
+        def run(args):
+            start, seq = args
+            n = min(nblock, nboot - start)
+            # Counts of npts draws with replacement for each replicate, by
+            # a single bincount of the draws offset by replicate
+            draws = np.random.default_rng(seq).integers(0, npts, (n, npts))
+            draws += (np.arange(n) * npts)[:, None]
+            counts = np.bincount(draws.reshape(-1), minlength=n*npts)
+            counts = counts.reshape(n, npts)
+            return np.array(_solve(*counts.astype(float).dot(products).T)).T
+
+        if workers and workers > 1 and len(starts) > 1:
+            pool = ThreadPool(workers)
+            try:
+                ab = pool.map(run, zip(starts, seqs))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            ab = [run(args) for args in zip(starts, seqs)]
+        ab = np.concatenate(ab)
+        ab = ab[np.all(np.isfinite(ab), axis=1)]
+        if len(ab) > 1:
+            cov = np.cov(ab, rowvar=False)
+        else:
+            cov = np.full((2, 2), np.nan)
+    else:
+        raise ValueError('Unknown method: {:s}'.format(method))
+
+    return a, b, cov
+
+
+# `leastsquares2d_clip` recomputes the normal-equation sums from the kept
+# points once the rounding error bound of its incrementally updated sums
+# exceeds this many times that of computing them directly
+CLIP_RESUM = 4.0
+
+
+def _abs_sums(x, y, z):
+    """Sums of the absolute values of the terms of the normal-equation
+    sums sx, sxy, sy, sxz, and syz. Unlike `_sums`, points where x == y are
+    not excluded.
+
+    """
+    x, y, z = np.abs(x), np.abs(y), np.abs(z)
+    return np.array([x.dot(x), x.dot(y), y.dot(y), x.dot(z), y.dot(z)])
+
+
+def leastsquares2d_clip(x, y, z, nsigma=3.0, maxiter=10):
+    """Iterative sigma-clipped `leastsquares2d` fit.
+
+    Each iteration fits the points currently kept, and then keeps the
+    points whose residuals from that fit are within `nsigma` times the
+    rms residual of the kept points. Rejected points may be readmitted
+    later. Iteration stops when the kept points no longer change or after
+    `maxiter` iterations.
+
+    Parameters
+    ----------
+    x, y, z : array
+        See `leastsquares2d`. Points where x == y or with non-finite values
+        are never used.
+    nsigma : float, optional
+        Clipping threshold in units of the rms residual. Default is 3.
+    maxiter : int, optional
+        Maximum number of clipping iterations. Default is 10.
+
+    Returns
+    -------
+    a, b : float
+        The best-fit parameters for the final kept points.
+    keep : array
+        Boolean array, True for the points used in the final fit, with the
+        broadcast shape of the input.
+
+    Notes
+    -----
+    The sums of the newly rejected points are subtracted from the
+    normal-equation sums and those of the readmitted points added, so
+    updating the fit costs time proportional to the number of points that
+    changed. The rounding error of a sum is bounded by the float epsilon
+    times the sum of the absolute values of all of the terms that went
+    into it, including those since subtracted, versus only the terms of
+    the kept points for a direct sum. Both are tracked, and the sums are
+    recomputed from the kept points only when the first exceeds
+    `CLIP_RESUM` times the second, e.g., after subtracting a large outlier
+    or most of the points. The final fit is therefore as accurate as
+    `leastsquares2d` on the kept points to within that factor. The
+    residuals are evaluated for all points every iteration, in one fused
+    pass over preallocated buffers.
+
+    """
+    x, y, z = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                  np.asarray(y, dtype=float),
+                                  np.asarray(z, dtype=float))
+    shape = x.shape
+    x, y, z = x.reshape(-1), y.reshape(-1), z.reshape(-1)
+    valid = (x != y) & np.isfinite(x) & np.isfinite(y) & np.isfinite(z)
+    keep = valid.copy()
+    sums = np.array(_sums(x[keep], y[keep], z[keep])[:5])
+    count = np.count_nonzero(keep)
+    r, s = np.empty(len(x)), np.empty(len(x))
+    new = np.empty(len(x), dtype=bool)
+
+    # Sums of the absolute values of the terms of the kept points (the
+    # error bound of a direct sum), and of all of the terms that went into
+    # the updated sums
+    kept = _abs_sums(x[keep], y[keep], z[keep])
+    bound = kept.copy()
+
+    for iteration in range(maxiter + 1):
+        if np.any(bound > CLIP_RESUM * kept):
+            xk, yk, zk = x[keep], y[keep], z[keep]
+            sums = np.array(_sums(xk, yk, zk)[:5])
+            kept = _abs_sums(xk, yk, zk)
+            bound = kept.copy()
+        a, b = (float(val) for val in _solve(*sums))
+        if count < 3 or not np.isfinite(a):
+            break
+
+        # r = z - a*x - b*y
+        np.multiply(x, a, out=r)
+        np.multiply(y, b, out=s)
+        np.add(r, s, out=r)
+        np.subtract(z, r, out=r)
+        s.fill(0.0)  # Invalid points have NaN residuals
+        np.copyto(s, r, where=keep)
+        sigma = np.sqrt(s.dot(s) / (count - 2))
+        if iteration == maxiter:
+            break
+
+        np.abs(r, out=s)
+        np.less_equal(s, nsigma*sigma, out=new)
+        np.logical_and(new, valid, out=new)
+        drop = np.flatnonzero(keep & ~new)
+        add = np.flatnonzero(new & ~keep)
+        if not len(drop) and not len(add):
+            break
+        sums -= _sums(x[drop], y[drop], z[drop])[:5]
+        sums += _sums(x[add], y[add], z[add])[:5]
+        dropped = _abs_sums(x[drop], y[drop], z[drop])
+        added = _abs_sums(x[add], y[add], z[add])
+        kept += added - dropped
+        bound += added + dropped
+        count += len(add) - len(drop)
+        keep, new = new, keep
+
+    return a, b, keep.reshape(shape)
@@ -11,6 +11,14 @@ strings, lists of lists, etc.), as well as class properties, so I've
 decided to save it.
 
 """
+from array import array
+
+try:
+    basestring
+except NameError:  # Python 3
+    basestring = str
+
+
 class Param(object):
 
     """Class that bundles a format string with a value.
@@ -116,6 +124,8 @@ class Param(object):
 
     """
 
+    __slots__ = ('_val', '_fmt', 'delim')
+
     def __init__(self, val, fmt=None, delim=None):
         fmt0 = fmt
         val_list, fmt_list = get_vals_fmts(val)
@@ -175,6 +185,275 @@ class Param(object):
         self._fmt = fmt
 
 
+def _append_indices(column, indices):
+    """Append string indices to an array of them, widening it from bytes to
+    ints if needed, and return the array.
+
+    """
+    if column.typecode == 'B' and indices and max(indices) > 255:
+        column = array('i', column)
+    column.extend(indices)
+    return column
+
+
+# Typecodes of the typed value columns of `ParamTable`, by value type. bool
+# is a subclass of int but is looked up by exact type, so it is not stored
+# as an integer.
+_TYPECODES = {int: 'q', float: 'd'}
+_TYPES = dict((code, typ) for typ, code in _TYPECODES.items())
+
+# Number of parameters added to the columns of a `ParamTable` at a time by
+# `ParamTable.extend`
+_ROWS_PER_EXTEND = 4096
+
+
+class ParamTable(object):
+
+    """Columnar storage for many `Param` values.
+
+    Holding every parameter as a `Param` instance costs an object, a format
+    list, and a delimiter per parameter. `ParamTable` instead keeps the
+    values of all parameters in one flat column, with the format string of
+    each value and the delimiter of each parameter stored as indices into
+    tables of unique strings (so each distinct string is stored once).
+    While all values are ints, or all are floats, the column is a typed
+    `array.array` of 8-byte items; it falls back to a list of objects
+    once other values (e.g., strings, None, or a mix of ints and floats)
+    are added. The string indices take one byte each while there are at
+    most 256 unique strings, and the offsets of the parameters' values in
+    the column are only stored once some parameter has other than one
+    value. A table of single float values thus takes 10 bytes per
+    parameter, versus about 90 for `Param` instances and their float
+    objects. `Param` instances are only created when the table is indexed.
+
+    Parameters
+    ----------
+    vals : iterable, optional
+        Initial parameters, each in any form accepted by `Param`. Default
+        is an empty table.
+    fmt : str or list, optional
+        Format string (or list of format strings) overriding those in
+        `vals`, as for `Param`.
+    delim : str, optional
+        Delimiter of each parameter. Default is ",".
+
+    Attributes
+    ----------
+    fmts : list
+        Unique format strings. The format of each value is stored as an
+        index into this list; index 0 is None (no format).
+    delims : list
+        Unique delimiters, indexed like `fmts`.
+
+    Methods
+    -------
+    append(val, fmt=None, delim=None)
+        Add a parameter.
+    extend(vals, fmt=None, delim=None)
+        Add many parameters.
+    from_params(params)
+        Class method. Table of existing `Param` instances.
+    strings()
+        Formatted string of each parameter.
+
+    Examples
+    --------
+    >>> t = ParamTable([(3.14159, '{:.2f}'), (1, 2), 'abc'], delim=' ')
+    >>> len(t)
+    3
+    >>> t[0].val, t[0].fmt, str(t[0])
+    (3.14159, '{:.2f}', '3.14')
+    >>> t.strings()
+    ['3.14', '1 2', 'abc']
+    >>> t[1:].strings()
+    ['1 2', 'abc']
+
+    """
+
+    __slots__ = ('_vals', '_fmt_idx', '_offsets', '_delim_idx',
+                 'fmts', 'delims', '_fmt_map', '_delim_map')
+
+    def __init__(self, vals=(), fmt=None, delim=None):
+        self._vals = array('d')
+        self._fmt_idx = array('B')
+        self._offsets = None  # One value per parameter
+        self._delim_idx = array('B')
+        self.fmts, self._fmt_map = [None], {None: 0}
+        self.delims, self._delim_map = [None], {None: 0}
+        self.extend(vals, fmt=fmt, delim=delim)
+
+    def __len__(self):
+        return len(self._delim_idx)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            table = ParamTable()
+            table._append_rows([self._lists(i)
+                                for i in range(*index.indices(len(self)))])
+            return table
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('ParamTable index out of range')
+        val_list, fmt_list, delim = self._lists(index)
+        p = Param.__new__(Param)
+        if not val_list:
+            p._val, p._fmt = None, None
+        elif len(val_list) == 1:
+            p._val, p._fmt = val_list[0], fmt_list[0]
+        else:
+            p._val, p._fmt = val_list, fmt_list
+        p.delim = delim
+        return p
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return 'ParamTable({:d} parameters)'.format(len(self))
+
+    def _intern(self, table, index_map, s):
+        """Index of the string `s` in `table`, adding it if new."""
+        try:
+            return index_map[s]
+        except KeyError:
+            index_map[s] = len(table)
+            table.append(s)
+            return index_map[s]
+
+    def _bounds(self, i):
+        """Start and stop of the values of parameter `i` in the column."""
+        if self._offsets is None:
+            return i, i + 1
+        return self._offsets[i], self._offsets[i+1]
+
+    def _lists(self, i):
+        """Values, formats, and delimiter of parameter `i`."""
+        start, stop = self._bounds(i)
+        fmts = self.fmts
+        return (list(self._vals[start:stop]),
+                [fmts[k] for k in self._fmt_idx[start:stop]],
+                self.delims[self._delim_idx[i]])
+
+    def _extend_vals(self, val_list):
+        """Add values to the column, converting it to a list if they do
+        not fit its typecode.
+
+        """
+        vals = self._vals
+        if isinstance(vals, array):
+            types = set(type(val) for val in val_list)
+            if not vals and len(types) == 1:
+                typecode = _TYPECODES.get(types.pop())
+                vals = [] if typecode is None else array(typecode)
+            elif types and types != set([_TYPES[vals.typecode]]):
+                vals = vals.tolist()
+            if isinstance(vals, array):
+                try:
+                    vals.extend(val_list)
+                except OverflowError:  # int beyond 64 bits
+                    vals = vals.tolist()
+        if isinstance(vals, list):
+            vals.extend(val_list)
+        self._vals = vals
+
+    def _append_rows(self, rows):
+        """Add parameters given as (val_list, fmt_list, delim) tuples.
+
+        The columns are extended once for all of the rows.
+
+        """
+        counts = [len(row[0]) for row in rows]
+        if self._offsets is None and any(count != 1 for count in counts):
+            self._offsets = array('l', range(len(self._vals) + 1))
+        self._extend_vals([val for row in rows for val in row[0]])
+        intern, fmts, fmt_map = self._intern, self.fmts, self._fmt_map
+        self._fmt_idx = _append_indices(
+            self._fmt_idx,
+            [intern(fmts, fmt_map, fmt) for row in rows for fmt in row[1]])
+        if self._offsets is not None:
+            offsets = self._offsets
+            stop = offsets[-1]
+            for count in counts:
+                stop += count
+                offsets.append(stop)
+        delims, delim_map = self.delims, self._delim_map
+        self._delim_idx = _append_indices(
+            self._delim_idx,
+            [intern(delims, delim_map, row[2]) for row in rows])
+
+    def _row(self, val, fmt, delim):
+        """(val_list, fmt_list, delim) of a parameter; see `append`."""
+        val_list, fmt_list = get_vals_fmts(val)
+        if fmt is not None:
+            if islistlike(fmt):
+                fmt_list = list(fmt)
+            else:
+                fmt_list = [fmt] * len(val_list)
+            if len(fmt_list) != len(val_list):
+                raise ValueError('Expected {:d} formats, got {:d}'.format(
+                    len(val_list), len(fmt_list)))
+        return val_list, fmt_list, ',' if delim is None else delim
+
+    def append(self, val, fmt=None, delim=None):
+        """Add a parameter; see `Param` for the arguments."""
+        self._append_rows([self._row(val, fmt, delim)])
+
+    def extend(self, vals, fmt=None, delim=None):
+        """Add a parameter for each item of `vals`; see `Param` for the
+        arguments.
+
+        """
+        rows = []
+        for val in vals:
+            rows.append(self._row(val, fmt, delim))
+            if len(rows) == _ROWS_PER_EXTEND:
+                self._append_rows(rows)
+                rows = []
+        if rows:
+            self._append_rows(rows)
+
+    @classmethod
+    def from_params(cls, params):
+        """Table of the values, formats, and delimiters of `Param`
+        instances.
+
+        """
+        table = cls()
+        table._append_rows([([p.val], [p.fmt], p.delim)
+                            if not islistlike(p.val) else
+                            (list(p.val), list(p.fmt), p.delim)
+                            for p in params])
+        return table
+
+    def strings(self):
+        """Formatted string of each parameter, as `str` of the `Param`.
+
+        Returns
+        -------
+        list
+
+        """
+        formatters = [str] + [fmt.format for fmt in self.fmts[1:]]
+        vals, fmt_idx, offsets = self._vals, self._fmt_idx, self._offsets
+        delims, delim_idx = self.delims, self._delim_idx
+        if offsets is None:  # One value per parameter
+            return [formatters[k](val) for val, k in zip(vals, fmt_idx)]
+        strings = []
+        for i in range(len(delim_idx)):
+            start, stop = offsets[i], offsets[i+1]
+            if stop - start == 1:
+                strings.append(formatters[fmt_idx[start]](vals[start]))
+            elif stop == start:
+                strings.append('None')
+            else:
+                strings.append(delims[delim_idx[i]].join(
+                    [formatters[fmt_idx[j]](vals[j])
+                     for j in range(start, stop)]))
+        return strings
+
+
 def isstring(obj):
     """True if the object is a string."""
     return isinstance(obj, basestring)
@@ -198,7 +477,7 @@ def get_vals_fmts(val):
 
     Parameters
     ----------
-    val : None, bool, int, float, str, list, or tuple
+    val : None, bool, int, float, str, list, tuple, iterable, or array
         Valid forms of `val` are,
 
         - x
@@ -207,7 +486,8 @@ def get_vals_fmts(val):
         - [(x1, fmt1), (x2, fmt2), ...]
 
         where `x` is None, bool, int, float, or str. `fmt` is a format
-        string (starts with '{', ends with '}', and contains ':').
+        string (starts with '{', ends with '}', and contains ':'). The
+        sequences may also be generators or other iterables, or arrays.
 
     Returns
     -------
@@ -219,43 +499,52 @@ def get_vals_fmts(val):
         - [x1, x2, ...], [None, None, ...]
         - [x1, x2, ...], [fmt1, fmt2, ...]
 
-        `val_list` is never empty, and `fmt_list` is always the same length
-        as `val_list`.
+        `fmt_list` is always the same length as `val_list`. Both are
+        empty if `val` is empty or a falsy value other than None, False,
+        or 0.
+
+    Notes
+    -----
+    Sequences are read in a single pass, in time linear in their length.
+    Arrays are first converted to lists with their `tolist` method, so that
+    their elements are Python scalars. A (value, format) pair can only be
+    recognized at the end of a sequence (a trailing format string applies to
+    the value before it), so only the last two items are held back.
 
     """
-    val_list, fmt_list = [], []
-    val0 = val
-    while val0:
-        if islistlike(val0):
-            if len(val0) == 2 and isfmtstr(val0[1]):  # (val, fmt)
-                val, fmt = val0
-                val_list.append(val)
-                fmt_list.append(fmt)
-                break
-
-            else:  # (..., val_i, ...) or [..., (val_i, fmt_i), ...]
-                val = val0[0]
-                if islistlike(val):  # (val_i, fmt_i)
-                    val, fmt = val
-                    val_list.append(val)
-                    fmt_list.append(fmt)
-                else:  # val_i; no format
-                    val_list.append(val)
-                    fmt_list.append(None)
-
-                if len(val0) == 1:
-                    break
-                else:
-                    val0 = val0[1:]
-
-        else:  # val; no format
-            val_list.append(val0)
-            fmt_list.append(None)
-            break
+    if not islistlike(val):
+        if val or val in [None, False]:
+            return [val], [None]
+        return [], []
 
+    if hasattr(val, 'tolist'):  # Array: iterate over Python scalars/lists
+        val = val.tolist()
+        if not islistlike(val):  # 0d array
+            return [val], [None]
+
+    val_list, fmt_list = [], []
+    pending = []  # The last two items, not yet added
+    for item in val:
+        if len(pending) == 2:
+            head = pending.pop(0)
+            if islistlike(head):  # (val_i, fmt_i)
+                head, fmt = head
+            else:  # val_i; no format
+                fmt = None
+            val_list.append(head)
+            fmt_list.append(fmt)
+        pending.append(item)
+
+    if len(pending) == 2 and isfmtstr(pending[1]):  # (..., val, fmt)
+        val_list.append(pending[0])
+        fmt_list.append(pending[1])
     else:
-        if val0 in [None, False]:
-            val_list.append(val0)
-            fmt_list.append(None)
+        for item in pending:
+            if islistlike(item):  # (val_i, fmt_i)
+                item, fmt = item
+            else:  # val_i; no format
+                fmt = None
+            val_list.append(item)
+            fmt_list.append(fmt)
 
     return val_list, fmt_list
@@ -0,0 +1,349 @@
+"""
+Resample images from one celestial projection onto another.
+
+The pixel mapping between the output and input images is computed with
+`wcs.pix2pix` one output tile at a time, so memory use is bounded by the
+tile size rather than the image size. Where the mapping over a tile is
+close enough to affine (e.g., when the two tangent points are close
+together), the affine approximation is used instead of the exact
+transformation.
+
+"""
+import numpy as np
+
+import wcs
+
+
+def affine_map(rows, cols, hdr_out, hdr_in, tol=0.01):
+    """Affine approximation of the pixel mapping from the output image to
+    the input image over a rectangular section of the output image.
+
+    The affine transformation is fit to the exact mapping at the corners,
+    edge midpoints, and center of the section, and then checked against the
+    exact mapping at the points halfway between neighboring fit points
+    (including the centers of the four quadrants).
+
+    Parameters
+    ----------
+    rows, cols : tuple
+        (start, stop) array indices of the section along the first (y) and
+        second (x) axes of the output image. Array index i corresponds to
+        pixel coordinate i + 1 (FITS convention).
+    hdr_out, hdr_in : astropy.io.fits.Header, dictionary, or wcs.WCS
+        FITS headers or precomputed `wcs.WCS` instances of the output and
+        input images.
+    tol : float, optional
+        Maximum allowed error of the approximation in input pixels. Default
+        is 0.01.
+
+    Returns
+    -------
+    array or None
+        2x3 matrix ``A`` such that ``(x_in, y_in) = A.dot((x_out, y_out,
+        1))``, or None if the approximation is not accurate enough.
+
+    """
+    (r0, r1), (c0, c1) = rows, cols
+    xlim, ylim = (c0 + 1.0, c1 + 0.0), (r0 + 1.0, r1 + 0.0)
+
+    # Fit on a 3x3 grid spanning the section
+    xfit, yfit = np.meshgrid(np.linspace(xlim[0], xlim[1], 3),
+                             np.linspace(ylim[0], ylim[1], 3))
+    xfit, yfit = xfit.ravel(), yfit.ravel()
+    xin, yin = wcs.pix2pix(xfit, yfit, hdr_out, hdr_in)
+    design = np.column_stack([xfit, yfit, np.ones_like(xfit)])
+    A = np.linalg.lstsq(design, np.column_stack([xin, yin]), rcond=None)[0].T
+
+    # Check on the 5x5 grid at quarter steps, less the fit points (even
+    # steps in both directions)
+    i, j = np.meshgrid(np.arange(5), np.arange(5))
+    k = (i % 2 == 1) | (j % 2 == 1)
+    xchk = xlim[0] + (xlim[1] - xlim[0])*i[k]/4.0
+    ychk = ylim[0] + (ylim[1] - ylim[0])*j[k]/4.0
+    xin, yin = wcs.pix2pix(xchk, ychk, hdr_out, hdr_in)
+    xaff = A[0, 0]*xchk + A[0, 1]*ychk + A[0, 2]
+    yaff = A[1, 0]*xchk + A[1, 1]*ychk + A[1, 2]
+    if np.hypot(xin - xaff, yin - yaff).max() > tol:
+        return None
+    return A
+
+
+def map_tile(rows, cols, hdr_out, hdr_in, tol=0.01):
+    """Input pixel coordinates of every pixel in a section of the output
+    image.
+
+    Parameters
+    ----------
+    rows, cols : tuple
+        (start, stop) array indices of the section along the first (y) and
+        second (x) axes of the output image.
+    hdr_out, hdr_in : astropy.io.fits.Header, dictionary, or wcs.WCS
+        FITS headers or precomputed `wcs.WCS` instances of the output and
+        input images.
+    tol : float, optional
+        Maximum allowed error in input pixels for using the affine fast
+        path; see `affine_map`. Use 0 to always use the exact mapping.
+        Default is 0.01.
+
+    Returns
+    -------
+    x, y : array
+        2d arrays of x and y pixel coordinates in the input image.
+    area : float or array
+        Area of each output pixel in input pixels (the determinant of the
+        Jacobian of the mapping).
+
+    """
+    (r0, r1), (c0, c1) = rows, cols
+    xout = np.arange(c0, c1) + 1.0
+    yout = np.arange(r0, r1) + 1.0
+
+    A = affine_map(rows, cols, hdr_out, hdr_in, tol=tol) if tol > 0 else None
+    if A is not None:
+        x = A[0, 0]*xout[None, :] + (A[0, 1]*yout + A[0, 2])[:, None]
+        y = A[1, 0]*xout[None, :] + (A[1, 1]*yout + A[1, 2])[:, None]
+        area = abs(A[0, 0]*A[1, 1] - A[0, 1]*A[1, 0])
+        return x, y, area
+
+    x, y = wcs.pix2pix(xout[None, :], yout[:, None], hdr_out, hdr_in)
+    x, y = np.atleast_2d(x), np.atleast_2d(y)
+    if x.shape[0] > 1 and x.shape[1] > 1:
+        dxdy, dxdx = np.gradient(x)
+        dydy, dydx = np.gradient(y)
+        area = np.abs(dxdx*dydy - dxdy*dydx)
+    else:
+        area = abs(np.linalg.det(wcs._get_wcs(hdr_out).cd) /
+                   np.linalg.det(wcs._get_wcs(hdr_in).cd))
+    return x, y, area
+
+
+def sample_nearest(data, x, y, fill=np.nan):
+    """Sample an image at the nearest pixel to each point.
+
+    Parameters
+    ----------
+    data : array
+        2d input image.
+    x, y : array
+        x and y pixel coordinates of the points in the input image (FITS
+        convention; the center of ``data[0, 0]`` is at (1, 1)).
+    fill : float, optional
+        Value for points outside of the image. Default is NaN.
+
+    Returns
+    -------
+    array
+        Sampled values with the shape of `x` and `y`.
+
+    """
+    ny, nx = data.shape
+    # Comparisons with NaN are False, so non-finite points are outside and
+    # never cast to int
+    inside = (x >= 0.5) & (x < nx + 0.5) & (y >= 0.5) & (y < ny + 0.5)
+    i = np.floor(x[inside] - 0.5).astype(int)
+    j = np.floor(y[inside] - 0.5).astype(int)
+    result = np.full(inside.shape, fill, dtype=float)
+    result[inside] = data[j, i]
+    return result
+
+
+def sample_bilinear(data, x, y, fill=np.nan):
+    """Bilinearly interpolate an image at each point. Values between the
+    centers of the edge pixels and the edge of the image are extrapolated
+    as constant.
+
+    Parameters
+    ----------
+    data : array
+        2d input image.
+    x, y : array
+        x and y pixel coordinates of the points in the input image (FITS
+        convention; the center of ``data[0, 0]`` is at (1, 1)).
+    fill : float, optional
+        Value for points outside of the image. Default is NaN.
+
+    Returns
+    -------
+    array
+        Sampled values with the shape of `x` and `y`.
+
+    """
+    ny, nx = data.shape
+    inside = (x >= 0.5) & (x < nx + 0.5) & (y >= 0.5) & (y < ny + 0.5)
+
+    # Extend the edge pixels out to the edge of the image
+    x = np.clip(x[inside] - 1, 0, nx - 1)
+    y = np.clip(y[inside] - 1, 0, ny - 1)
+    i = np.minimum(np.floor(x).astype(int), max(nx - 2, 0))
+    j = np.minimum(np.floor(y).astype(int), max(ny - 2, 0))
+    i1, j1 = np.minimum(i + 1, nx - 1), np.minimum(j + 1, ny - 1)
+    tx, ty = x - i, y - j
+    result = np.full(inside.shape, fill, dtype=float)
+    result[inside] = ((data[j, i]*(1 - tx) + data[j, i1]*tx)*(1 - ty) +
+                      (data[j1, i]*(1 - tx) + data[j1, i1]*tx)*ty)
+    return result
+
+
+_SAMPLERS = {
+    'nearest': sample_nearest,
+    'bilinear': sample_bilinear,
+    }
+
+
+def flux_tile(data, rows, cols, hdr_out, hdr_in, x, y, area, fill=np.nan,
+              chunksize=2**20):
+    """Flux-conserving resampling of an image onto a section of the output
+    image.
+
+    Each input pixel is divided into n x n subpixels that carry equal
+    shares of its value, and every subpixel is added to the output pixel
+    that contains its center. The flux of every input pixel is therefore
+    accumulated into its footprint in the output image. n is chosen so that
+    each output pixel receives about four subpixels along each axis, or 1
+    when the output pixels are more than four times as large as the input
+    pixels.
+
+    Parameters
+    ----------
+    data : array
+        2d input image.
+    rows, cols : tuple
+        (start, stop) array indices of the section along the first (y) and
+        second (x) axes of the output image.
+    hdr_out, hdr_in : astropy.io.fits.Header, dictionary, or wcs.WCS
+        FITS headers or precomputed `wcs.WCS` instances of the output and
+        input images.
+    x, y, area : array
+        Input pixel coordinates and areas of the output pixels in the
+        section; see `map_tile`.
+    fill : float, optional
+        Value for output pixels whose centers fall outside of the input
+        image. Default is NaN.
+    chunksize : int, optional
+        Maximum number of subpixels transformed at a time. Default is
+        2**20.
+
+    Returns
+    -------
+    array
+        Summed input values in each output pixel of the section.
+
+    """
+    (r0, r1), (c0, c1) = rows, cols
+    ny, nx = data.shape
+    outside = ~((x >= 0.5) & (x < nx + 0.5) & (y >= 0.5) & (y < ny + 0.5))
+    if outside.all():
+        return np.full(outside.shape, fill, dtype=float)
+    n = max(1, int(np.ceil(4/np.sqrt(np.min(area)) - 1e-6)))
+    offsets = (np.arange(n) + 0.5)/n - 0.5
+
+    # Input pixels (0-based indices) that can fall into the section, padded
+    # by the size of an output pixel
+    pad = np.sqrt(np.max(area)) + 1
+    i0 = max(int(np.floor(np.nanmin(x) - 1 - pad)), 0)
+    i1 = min(int(np.ceil(np.nanmax(x) - 1 + pad)) + 1, nx)
+    j0 = max(int(np.floor(np.nanmin(y) - 1 - pad)), 0)
+    j1 = min(int(np.ceil(np.nanmax(y) - 1 + pad)) + 1, ny)
+
+    shape = (r1 - r0, c1 - c0)
+    total = np.zeros(shape[0]*shape[1])
+    step = max(chunksize // (max(i1 - i0, 1)*n*n), 1)
+    i = np.arange(i0, i1) + 1.0
+    for ja in range(j0, j1, step):
+        jb = min(ja + step, j1)
+        j = np.arange(ja, jb) + 1.0
+        xin = (i[None, :, None, None] + offsets[None, None, None, :] +
+               np.zeros((len(j), 1, n, 1)))
+        yin = (j[:, None, None, None] + offsets[None, None, :, None] +
+               np.zeros((1, len(i), 1, n)))
+        xout, yout = wcs.pix2pix(xin.ravel(), yin.ravel(), hdr_in, hdr_out)
+        c = np.floor(xout - 0.5) - c0
+        r = np.floor(yout - 0.5) - r0
+        k = (c >= 0) & (c < shape[1]) & (r >= 0) & (r < shape[0])
+        values = np.repeat(data[ja:jb, i0:i1].ravel(), n*n) / (n*n)
+        total += np.bincount((r[k]*shape[1] + c[k]).astype(int),
+                             weights=values[k], minlength=len(total))
+
+    total = total.reshape(shape)
+    total[outside] = fill
+    return total
+
+
+def iter_reproject(data, hdr_in, hdr_out, shape_out, method='bilinear',
+                   tilesize=512, tol=0.01, fill=np.nan):
+    """Resample an image onto a different projection one output tile at a
+    time.
+
+    Parameters
+    ----------
+    data : array
+        2d input image. May be memory-mapped; only the pixels needed for
+        each tile are read.
+    hdr_in, hdr_out : astropy.io.fits.Header, dictionary, or wcs.WCS
+        FITS headers or precomputed `wcs.WCS` instances of the input and
+        output images.
+    shape_out : tuple
+        Shape of the output image, (ny, nx).
+    method : {'nearest', 'bilinear', 'flux'}, optional
+        Resampling method. 'flux' conserves flux rather than surface
+        brightness: the flux of every input pixel is added to the output
+        pixels in its footprint; see `flux_tile`. Default is 'bilinear'.
+    tilesize : int, optional
+        Size of the (square) output tiles in pixels. Default is 512.
+    tol : float, optional
+        Maximum error in input pixels for the affine fast path; see
+        `map_tile`. Default is 0.01.
+    fill : float, optional
+        Value for output pixels that fall outside of the input image.
+        Default is NaN.
+
+    Yields
+    ------
+    tuple
+        (rows, cols, tile) for each output tile, where `rows` and `cols`
+        are slices of the output image.
+
+    """
+    if method != 'flux' and method not in _SAMPLERS:
+        raise ValueError('Unknown method: {:s}'.format(method))
+    w_in, w_out = wcs._get_wcs(hdr_in), wcs._get_wcs(hdr_out)
+
+    ny, nx = shape_out
+    for r0 in range(0, ny, tilesize):
+        r1 = min(r0 + tilesize, ny)
+        for c0 in range(0, nx, tilesize):
+            c1 = min(c0 + tilesize, nx)
+            x, y, area = map_tile((r0, r1), (c0, c1), w_out, w_in, tol=tol)
+            if method == 'flux':
+                tile = flux_tile(data, (r0, r1), (c0, c1), w_out, w_in, x, y,
+                                 area, fill=fill)
+            else:
+                tile = _SAMPLERS[method](data, x, y, fill=fill)
+            yield slice(r0, r1), slice(c0, c1), tile
+
+
+def reproject(data, hdr_in, hdr_out, shape_out, method='bilinear',
+              tilesize=512, tol=0.01, fill=np.nan, out=None):
+    """Resample an image onto a different projection.
+
+    Parameters
+    ----------
+    data, hdr_in, hdr_out, shape_out, method, tilesize, tol, fill
+        See `iter_reproject`.
+    out : array, optional
+        Array in which to store the output image, e.g., a memory-mapped
+        file. If None (default), a new array is allocated.
+
+    Returns
+    -------
+    array
+        The output image.
+
+    """
+    if out is None:
+        out = np.empty(shape_out)
+    for rows, cols, tile in iter_reproject(data, hdr_in, hdr_out, shape_out,
+                                           method=method, tilesize=tilesize,
+                                           tol=tol, fill=fill):
+        out[rows, cols] = tile
+    return out
@@ -0,0 +1,328 @@
+"""
+Spatial index of image footprints on the sky.
+
+Each footprint is bounded by a spherical cap, and the caps are registered
+in the cells of a cube tessellation of the unit sphere (each face of a cube
+is divided into nside x nside cells, and a point belongs to the cell its
+unit vector projects into). Finding the images that contain a batch of
+positions is then a matter of looking up each position's cell, testing the
+caps registered in that cell, and confirming the few remaining candidates
+with an exact `wcs.WCSStack.world2pix` (or `wcs.WCS.world2pix` for images
+with SIP distortion).
+
+"""
+import numpy as np
+
+import wcs
+
+
+def lonlat2vec(lon, lat):
+    """Unit vectors for celestial longitude and latitude in degrees.
+
+    Returns an array with a trailing axis of length 3.
+
+    """
+    lon = np.asarray(lon, dtype=float) * wcs.D2R
+    lat = np.asarray(lat, dtype=float) * wcs.D2R
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat*np.cos(lon), cos_lat*np.sin(lon), np.sin(lat)],
+                    axis=-1)
+
+
+def vec2cell(vec, nside):
+    """Cube tessellation cell index of each unit vector.
+
+    Parameters
+    ----------
+    vec : array
+        Unit vectors with a trailing axis of length 3.
+    nside : int
+        Number of cells along each edge of a cube face.
+
+    Returns
+    -------
+    array
+        Cell indices, from 0 to ``6*nside**2 - 1``.
+
+    """
+    vec = np.asarray(vec, dtype=float)
+    axis = np.argmax(np.abs(vec), axis=-1)
+    major = np.take_along_axis(vec, axis[..., None], axis=-1)[..., 0]
+    face = 2*axis + (major < 0)
+    u = np.take_along_axis(vec, ((axis + 1) % 3)[..., None], axis=-1)[..., 0]
+    v = np.take_along_axis(vec, ((axis + 2) % 3)[..., None], axis=-1)[..., 0]
+    iu = np.clip(((u/np.abs(major) + 1)/2*nside).astype(int), 0, nside-1)
+    iv = np.clip(((v/np.abs(major) + 1)/2*nside).astype(int), 0, nside-1)
+    return (face*nside + iu)*nside + iv
+
+
+def _cell_caps(nside):
+    """Center unit vectors and bounding radii (radians) of all cells."""
+    edges = np.linspace(-1, 1, nside + 1)
+    mids = (edges[:-1] + edges[1:])/2
+    centers, radii = [], []
+    for face in range(6):
+        axis, sign = face // 2, -1.0 if face % 2 else 1.0
+
+        def face2vec(u, v):
+            vec = np.empty(np.broadcast(u, v).shape + (3,))
+            vec[..., axis] = sign
+            vec[..., (axis + 1) % 3] = u
+            vec[..., (axis + 2) % 3] = v
+            return vec/np.sqrt((vec**2).sum(axis=-1))[..., None]
+
+        center = face2vec(mids[:, None], mids[None, :])
+        radius = np.zeros((nside, nside))
+        for du in (0, 1):
+            for dv in (0, 1):
+                corner = face2vec(edges[du:nside+du, None],
+                                  edges[None, dv:nside+dv])
+                cos = np.clip((center*corner).sum(axis=-1), -1, 1)
+                radius = np.maximum(radius, np.arccos(cos))
+        centers.append(center.reshape(-1, 3))
+        radii.append(radius.ravel())
+    return np.concatenate(centers), np.concatenate(radii)
+
+
+def footprint_cap(hdr, shape, nsample=4):
+    """Spherical cap bounding the footprint of an image.
+
+    Parameters
+    ----------
+    hdr : astropy.io.fits.Header, dictionary, or wcs.WCS
+        A FITS header or a precomputed `wcs.WCS` instance.
+    shape : tuple
+        Shape of the image, (ny, nx).
+    nsample : int, optional
+        Number of points sampled along each edge of the image, in addition
+        to the corners. Default is 4.
+
+    Returns
+    -------
+    center : array
+        Unit vector of the center of the image.
+    radius : float
+        Angular radius of the cap in radians.
+
+    """
+    ny, nx = shape
+    t = np.linspace(0, 1, nsample + 2)
+    xs, ys = 0.5 + nx*t, 0.5 + ny*t
+    x = np.r_[xs, np.full_like(ys, nx + 0.5), xs, np.full_like(ys, 0.5)]
+    y = np.r_[np.full_like(xs, 0.5), ys, np.full_like(xs, ny + 0.5), ys]
+    center = lonlat2vec(*wcs.pix2world((nx + 1)/2.0, (ny + 1)/2.0, hdr))
+    edge = lonlat2vec(*wcs.pix2world(x, y, hdr))
+    cos = np.clip(edge.dot(center), -1, 1)
+    return center, np.arccos(cos.min())
+
+
+# Number of fine cells along each edge of a coarse cell when building the
+# index
+_SUBDIV = 8
+
+
+def _overlaps(center1, radius1, center2, radius2):
+    """True where two sets of spherical caps overlap. Centers are unit
+    vectors with a trailing axis of length 3 and radii are in radians; the
+    centers are combined with a dot product when they are 2d and
+    elementwise otherwise.
+
+    """
+    if center1.ndim == 2 and np.ndim(radius1) == 2:
+        cos = center1.dot(center2.T)
+    else:
+        cos = (center1*center2).sum(axis=-1)
+
+    # angle <= radius1 + radius2, without an arccos per pair
+    cos_sum = (np.cos(radius1)*np.cos(radius2) -
+               np.sin(radius1)*np.sin(radius2))
+    return (cos >= cos_sum) | (radius1 + radius2 >= np.pi)
+
+
+class FootprintIndex(object):
+
+    """Index of image footprints for finding the images that contain given
+    celestial positions.
+
+    Parameters
+    ----------
+    hdrs : sequence of astropy.io.fits.Header or dictionary
+        FITS headers of the images. See `wcs.pix2world` for the required
+        keywords. Images with SIP distortion are supported, but since
+        `wcs.WCSStack` is not, their candidates are confirmed one image at
+        a time, which is slower when there are many of them.
+    shapes : sequence of tuples, optional
+        Shapes (ny, nx) of the images. Default is to use NAXIS2 and NAXIS1
+        from the headers.
+    nside : int, optional
+        Number of tessellation cells along each edge of a cube face.
+        Default is chosen so that the cells are about the size of the
+        median footprint. Values above 8 are rounded up to a multiple of 8.
+
+    Attributes
+    ----------
+    shapes : array
+        (n, 2) array of image shapes.
+    centers : array
+        (n, 3) array of the unit vectors of the footprint centers.
+    radii : array
+        Angular radii of the caps bounding the footprints in radians.
+    nside : int
+        Number of tessellation cells along each edge of a cube face.
+
+    Methods
+    -------
+    candidates(lon, lat)
+        Find the (position, image) pairs that pass the bounding cap test.
+    query(lon, lat)
+        Find all (position, image) pairs such that the image contains the
+        position.
+
+    """
+
+    def __init__(self, hdrs, shapes=None, nside=None):
+        wcs_list = [wcs.WCS(hdr) for hdr in hdrs]
+        if shapes is None:
+            shapes = [(hdr['NAXIS2'], hdr['NAXIS1']) for hdr in hdrs]
+        self.shapes = np.array(shapes, dtype=int).reshape(-1, 2)
+
+        caps = [footprint_cap(w, shape)
+                for w, shape in zip(wcs_list, self.shapes)]
+        self.centers = np.array([cap[0] for cap in caps]).reshape(-1, 3)
+        self.radii = np.array([cap[1] for cap in caps])
+
+        # One WCSStack per projection for the exact confirmation, except
+        # for the images with SIP distortion, which are confirmed with their
+        # own WCS
+        self._sip = np.array([w.sip is not None for w in wcs_list], dtype=bool)
+        self._sip_wcs = {i: wcs_list[i] for i in np.flatnonzero(self._sip)}
+        self._stacks = {}
+        for projection in set(w.projection for w in wcs_list
+                              if w.sip is None):
+            members = np.array([i for i, w in enumerate(wcs_list)
+                                if w.projection == projection and
+                                w.sip is None])
+            stack = wcs.WCSStack.from_headers([wcs_list[i] for i in members])
+            self._stacks[projection] = (members, stack)
+        self._projection = np.array([w.projection for w in wcs_list])
+        self._local = np.empty(len(wcs_list), dtype=int)
+        for members, stack in self._stacks.values():
+            self._local[members] = np.arange(len(members))
+
+        if nside is None:
+            size = 2*np.median(self.radii) if len(self.radii) else np.pi/2
+            nside = int(np.clip(np.ceil(np.pi/2/size), 1, 512))
+        if nside > _SUBDIV:
+            nside = -(-nside // _SUBDIV) * _SUBDIV
+        self.nside = nside
+        self._build_cells()
+
+    def _build_cells(self, chunksize=1024):
+        """Register each cap in all cells it overlaps, stored in compressed
+        sparse row form (cell -> footprints).
+
+        Caps are first matched against a coarse tessellation with
+        ``_SUBDIV**2`` times fewer cells, and then only against the fine
+        cells inside the matching coarse cells.
+
+        """
+        nside, k = self.nside, min(_SUBDIV, self.nside)
+        ncoarse = nside // k
+        coarse_centers, coarse_radii = _cell_caps(ncoarse)
+        fine_centers, fine_radii = _cell_caps(nside)
+
+        caps, coarse = [], []
+        for i in range(0, len(self.centers), chunksize):
+            overlap = _overlaps(self.centers[i:i+chunksize],
+                                self.radii[i:i+chunksize, None],
+                                coarse_centers, coarse_radii[None, :])
+            cap, cell = np.nonzero(overlap)
+            caps.append(cap + i)
+            coarse.append(cell)
+        caps = np.concatenate(caps) if caps else np.empty(0, int)
+        coarse = np.concatenate(coarse) if coarse else np.empty(0, int)
+
+        # Fine cells in each coarse cell
+        face, cu, cv = (coarse // ncoarse**2, coarse // ncoarse % ncoarse,
+                        coarse % ncoarse)
+        a, b = np.divmod(np.arange(k*k), k)
+        iu = cu[:, None]*k + a[None, :]
+        iv = cv[:, None]*k + b[None, :]
+        fine = ((face[:, None]*nside + iu)*nside + iv).ravel()
+        caps = np.repeat(caps, k*k)
+        keep = _overlaps(self.centers[caps], self.radii[caps],
+                         fine_centers[fine], fine_radii[fine])
+        caps, fine = caps[keep], fine[keep]
+
+        order = np.argsort(fine, kind='mergesort')
+        counts = np.bincount(fine, minlength=len(fine_centers))
+        self._indptr = np.r_[0, np.cumsum(counts)]
+        self._indices = caps[order]
+
+    def candidates(self, lon, lat):
+        """All (position, image) pairs that pass the cap test.
+
+        Parameters
+        ----------
+        lon, lat : array
+            Celestial longitude and latitude of the positions in degrees.
+
+        Returns
+        -------
+        tuple
+            Arrays of position indices and image indices.
+
+        """
+        vec = lonlat2vec(np.ravel(lon), np.ravel(lat))
+        cell = vec2cell(vec, self.nside)
+        starts, counts = self._indptr[cell], np.diff(self._indptr)[cell]
+        ipos = np.repeat(np.arange(len(cell)), counts)
+        offsets = (np.arange(counts.sum()) -
+                   np.repeat(np.cumsum(counts) - counts, counts))
+        ifp = self._indices[np.repeat(starts, counts) + offsets]
+        cos = (vec[ipos]*self.centers[ifp]).sum(axis=-1)
+        keep = cos >= np.cos(self.radii[ifp])
+        return ipos[keep], ifp[keep]
+
+    def query(self, lon, lat, chunksize=65536):
+        """Find the images that contain each position.
+
+        Parameters
+        ----------
+        lon, lat : array
+            Celestial longitude and latitude of the positions in degrees.
+        chunksize : int, optional
+            Number of positions queried at a time, which bounds the memory
+            used for candidate pairs. Default is 65536.
+
+        Returns
+        -------
+        ipos, iimg : array
+            Indices of the positions and of the images containing them; a
+            position contained in several images appears once per image.
+        x, y : array
+            Pixel coordinates of each position in the corresponding image.
+
+        """
+        lon, lat = np.ravel(lon), np.ravel(lat)
+        results = [self._query(lon[i:i+chunksize], lat[i:i+chunksize], i)
+                   for i in range(0, len(lon), chunksize)]
+        if not results:
+            return (np.empty(0, int), np.empty(0, int), np.empty(0),
+                    np.empty(0))
+        return tuple(np.concatenate(r) for r in zip(*results))
+
+    def _query(self, lon, lat, offset):
+        ipos, ifp = self.candidates(lon, lat)
+        x, y = np.empty(len(ipos)), np.empty(len(ipos))
+        for projection, (members, stack) in self._stacks.items():
+            k = (self._projection[ifp] == projection) & ~self._sip[ifp]
+            x[k], y[k] = stack.world2pix(lon[ipos[k]], lat[ipos[k]],
+                                         self._local[ifp[k]])
+        for i in np.unique(ifp[self._sip[ifp]]):
+            k = ifp == i
+            x[k], y[k] = self._sip_wcs[i].world2pix(lon[ipos[k]],
+                                                    lat[ipos[k]])
+        ny, nx = self.shapes[ifp, 0], self.shapes[ifp, 1]
+        inside = (x >= 0.5) & (x < nx + 0.5) & (y >= 0.5) & (y < ny + 0.5)
+        return ipos[inside] + offset, ifp[inside], x[inside], y[inside]
@@ -0,0 +1,107 @@
+import numpy as np
+
+import astrometry
+import wcs
+
+
+def _headers():
+    hdrs = []
+    for i, (proj, crval1, crval2) in enumerate([('TAN', 10.68, 41.27),
+                                                ('SIN', 255.0, -30.0),
+                                                ('ZEA', 120.0, 89.5)]):
+        theta = 0.3 * i
+        c, s = 2.8e-4 * np.cos(theta), 2.8e-4 * np.sin(theta)
+        hdrs.append({
+            'CTYPE1': 'RA---' + proj, 'CTYPE2': 'DEC--' + proj,
+            'CRPIX1': 512.5 + 10*i, 'CRPIX2': 500.5 - 7*i,
+            'CRVAL1': crval1, 'CRVAL2': crval2,
+            'CD1_1': -c, 'CD1_2': s, 'CD2_1': s, 'CD2_2': c,
+            })
+    return hdrs
+
+
+def _stars(hdrs, n=200, seed=0):
+    rng = np.random.RandomState(seed)
+    index = np.repeat(np.arange(len(hdrs)), n)
+    x, y = rng.uniform(1, 1024, (2, len(index)))
+    lon, lat = np.empty(len(x)), np.empty(len(x))
+    for i, hdr in enumerate(hdrs):
+        k = index == i
+        lon[k], lat[k] = wcs.pix2world(x[k], y[k], hdr)
+    return x, y, lon, lat, index
+
+
+def _perturb(hdrs, crpix_offset=0.0, seed=1):
+    rng = np.random.RandomState(seed)
+    out = []
+    for hdr in hdrs:
+        hdr = dict(hdr)
+        for key in ('CD1_1', 'CD1_2', 'CD2_1', 'CD2_2'):
+            hdr[key] += rng.normal(0, 3e-6)
+        hdr['CRPIX1'] += crpix_offset
+        hdr['CRPIX2'] -= crpix_offset
+        out.append(hdr)
+    return out
+
+
+def _assert_recovered(new, true, crpix=True):
+    for hdr1, hdr2 in zip(new, true):
+        for key in ('CD1_1', 'CD1_2', 'CD2_1', 'CD2_2'):
+            np.testing.assert_allclose(hdr1[key], hdr2[key], rtol=0,
+                                       atol=1e-12)
+        if crpix:
+            for key in ('CRPIX1', 'CRPIX2'):
+                np.testing.assert_allclose(hdr1[key], hdr2[key], rtol=0,
+                                           atol=1e-6)
+
+
+def test_solve_fit_crpix():
+    true = _headers()
+    x, y, lon, lat, index = _stars(true)
+    start = _perturb(true, crpix_offset=3.0)
+    new, rms = astrometry.solve(start, x, y, lon, lat, index,
+                                fit_crpix=True)
+    _assert_recovered(new, true)
+    assert rms.max() < 1e-6
+
+
+def test_solve_fixed_crpix():
+    true = _headers()
+    x, y, lon, lat, index = _stars(true)
+    new, rms = astrometry.solve(_perturb(true), x, y, lon, lat, index)
+    _assert_recovered(new, true)
+    assert rms.max() < 1e-6
+
+    # CRPIX is held fixed: an offset in it is left in the residuals
+    start = _perturb(true, crpix_offset=3.0)
+    new, rms = astrometry.solve(start, x, y, lon, lat, index)
+    for hdr1, hdr2 in zip(new, start):
+        assert (hdr1['CRPIX1'], hdr1['CRPIX2']) == (hdr2['CRPIX1'],
+                                                    hdr2['CRPIX2'])
+    assert (rms > 1).all()
+
+
+def test_solve_weights():
+    true = _headers()
+    x, y, lon, lat, index = _stars(true)
+    start = _perturb(true, crpix_offset=3.0)
+
+    # Uniform weights of any scale give the unweighted solution
+    new1, rms1 = astrometry.solve(start, x, y, lon, lat, index,
+                                  fit_crpix=True)
+    new2, rms2 = astrometry.solve(start, x, y, lon, lat, index,
+                                  fit_crpix=True, weights=2.5)
+    for hdr1, hdr2 in zip(new1, new2):
+        for key in ('CD1_1', 'CD1_2', 'CD2_1', 'CD2_2'):
+            np.testing.assert_allclose(hdr1[key], hdr2[key], atol=1e-15)
+        for key in ('CRPIX1', 'CRPIX2'):
+            np.testing.assert_allclose(hdr1[key], hdr2[key], atol=1e-9)
+
+    # Zero-weight outliers are ignored by the fit
+    rng = np.random.RandomState(2)
+    bad = rng.rand(len(x)) < 0.1
+    xbad = np.where(bad, x + rng.normal(0, 50, len(x)), x)
+    weights = np.where(bad, 0.0, 1.0)
+    new, rms = astrometry.solve(start, xbad, y, lon, lat, index,
+                                fit_crpix=True, weights=weights)
+    _assert_recovered(new, true)
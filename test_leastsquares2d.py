@@ -0,0 +1,133 @@
+import numpy as np
+
+import leastsquares2d
+
+
+def test_leastsquares2d_2d_input():
+    x, y = np.meshgrid(np.arange(5.0), 1.3*np.arange(4.0) + 0.1)
+    z = 2*x + 3*y
+    a, b = leastsquares2d.leastsquares2d(x, y, z)
+    np.testing.assert_allclose([a, b], [2, 3])
+
+
+def test_leastsquares2d_uncorrelated():
+    x = np.array([1.0, -1.0, 1.0, -1.0])
+    y = np.array([1.5, 1.5, -1.5, -1.5])  # sum(x*y) == 0
+    z = 2*x + 3*y
+    a, b = leastsquares2d.leastsquares2d(x, y, z)
+    np.testing.assert_allclose([a, b], [2, 3])
+    np.testing.assert_allclose(leastsquares2d.leastsquares([x, y], z),
+                               [2, 3])
+
+
+def test_leastsquares2d_clip_nonfinite():
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(0, 1, (2, 200))
+    z = 2*x + 3*y + rng.normal(0, 0.01, 200)
+    z[5] += 10  # outlier
+    z[7] = np.nan
+    x[9] = np.inf
+    a, b, keep = leastsquares2d.leastsquares2d_clip(x, y, z)
+    np.testing.assert_allclose([a, b], [2, 3], atol=0.01)
+    assert not keep[[5, 7, 9]].any()
+    assert keep.sum() > 190
+
+
+def test_leastsquares2d_clip_matches_direct_fit():
+    rng = np.random.RandomState(1)
+    x, y = rng.uniform(0, 1, (2, 1000))
+    z = 2*x + 3*y + rng.normal(0, 0.01, 1000)
+    z[3] = 1e12  # Subtracting its sums would lose most of the digits
+    a, b, keep = leastsquares2d.leastsquares2d_clip(x, y, z)
+    assert not keep[3]
+    np.testing.assert_allclose(
+        [a, b], leastsquares2d.leastsquares2d(x[keep], y[keep], z[keep]),
+        rtol=1e-12)
+
+
+def test_leastsquares2d_local_matches_window_fits():
+    rng = np.random.RandomState(2)
+    x, y = rng.uniform(-1, 1, (2, 20, 17))
+    z = 2*x + 3*y + rng.normal(0, 0.1, x.shape)
+    z[4, 6] = np.nan
+    x[10, 0] = y[10, 0]  # Ignored point on the edge
+    for size in (3, (5, 4), (2, 3)):
+        a, b = leastsquares2d.leastsquares2d_local(x, y, z, size)
+        wy, wx = (size, size) if np.ndim(size) == 0 else size
+        for i in range(x.shape[0]):
+            for j in range(x.shape[1]):
+                # Windows are truncated at the edges
+                rows = slice(max(i - wy//2, 0), max(i - wy//2 + wy, 0))
+                cols = slice(max(j - wx//2, 0), max(j - wx//2 + wx, 0))
+                xw, yw, zw = x[rows, cols], y[rows, cols], z[rows, cols]
+                k = np.isfinite(zw) & (xw != yw)
+                if k.sum() < 2:
+                    assert np.isnan(a[i, j]) and np.isnan(b[i, j])
+                    continue
+                expected = leastsquares2d.leastsquares2d(xw[k], yw[k], zw[k])
+                np.testing.assert_allclose([a[i, j], b[i, j]], expected,
+                                           rtol=1e-8, atol=1e-10)
+
+    # Single-pixel windows have too few points
+    a, b = leastsquares2d.leastsquares2d_local(x, y, z, 1)
+    assert np.isnan(a).all() and np.isnan(b).all()
+
+
+def test_leastsquares2d_cov_matches_lstsq():
+    rng = np.random.RandomState(3)
+    n = 500
+    x, y = rng.uniform(-1, 1, (2, n))
+    z = 2*x + 3*y + rng.normal(0, 0.1, n)
+
+    # Residual covariance of the ordinary least squares fit
+    design = np.column_stack([x, y])
+    coeffs, rss = np.linalg.lstsq(design, z, rcond=None)[:2]
+    expected = rss[0] / (n - 2) * np.linalg.inv(design.T.dot(design))
+
+    for method in ('bootstrap', 'jackknife'):
+        a, b, cov = leastsquares2d.leastsquares2d_cov(
+            x, y, z, method=method, nboot=2000, seed=4)
+        np.testing.assert_allclose([a, b], coeffs, rtol=1e-12)
+        # Within 15% of the standard deviations of a and b
+        scale = np.sqrt(np.outer(np.diag(expected), np.diag(expected)))
+        np.testing.assert_allclose(cov / scale, expected / scale, rtol=0,
+                                   atol=0.15)
+
+    # The bootstrap replicates do not depend on the threads
+    cov1 = leastsquares2d.leastsquares2d_cov(x, y, z, nboot=2000, seed=4)[2]
+    cov2 = leastsquares2d.leastsquares2d_cov(x, y, z, nboot=2000, seed=4,
+                                             workers=4)[2]
+    np.testing.assert_array_equal(cov1, cov2)
+
+
+def test_leastsquares2d_clip_resums_only_on_cancellation(monkeypatch):
+    rng = np.random.RandomState(5)
+    n = 10000
+    x, y = rng.uniform(0, 1, (2, n))
+    z = 2*x + 3*y + rng.normal(0, 0.01, n)
+    z[:20] += rng.uniform(0.1, 0.2, 20)  # Mild outliers
+
+    full = []
+    sums = leastsquares2d._sums
+
+    def counted_sums(x, y, z):
+        if np.size(x) > n // 2:
+            full.append(np.size(x))
+        return sums(x, y, z)
+
+    monkeypatch.setattr(leastsquares2d, '_sums', counted_sums)
+    a, b, keep = leastsquares2d.leastsquares2d_clip(x, y, z)
+    assert len(full) == 1  # Only the initial sums
+    assert not keep[:20].any()
+    np.testing.assert_allclose(
+        [a, b], leastsquares2d.leastsquares2d(x[keep], y[keep], z[keep]),
+        rtol=1e-12)
+
+    # A huge outlier cancels most of the digits, forcing a recomputation
+    z[20] = 1e12
+    del full[:]
+    a, b, keep = leastsquares2d.leastsquares2d_clip(x, y, z)
+    assert len(full) == 2
+    np.testing.assert_allclose(
+        [a, b], leastsquares2d.leastsquares2d(x[keep], y[keep], z[keep]),
+        rtol=1e-12)
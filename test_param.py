@@ -0,0 +1,55 @@
+from array import array
+
+import numpy as np
+
+import param
+
+
+def _values():
+    rng = np.random.RandomState(0)
+    floats = rng.normal(0, 1e3, 50).tolist()
+    ints = rng.randint(-10**6, 10**6, 50).tolist()
+    return {
+        'floats': floats,
+        'ints': ints,
+        'formatted': [(x, '{:.3f}') for x in floats],
+        'multivalued': [(x, y) for x, y in zip(floats, ints)],
+        'mixed': (floats[:10] + ints[:10] + ['abc', None, True, False, 0,
+                                             2**70, (1.5, '{:.1e}'), [],
+                                             np.arange(3.0), (7, 8, 9)]),
+        }
+
+
+def test_paramtable_strings_match_param():
+    for name, vals in _values().items():
+        for delim in (None, ' ; '):
+            expected = [str(param.Param(val, delim=delim)) for val in vals]
+            table = param.ParamTable(vals, delim=delim)
+            assert table.strings() == expected, name
+            assert [str(p) for p in table] == expected, name
+            assert table[3:17:2].strings() == expected[3:17:2], name
+            params = [param.Param(val, delim=delim) for val in vals]
+            assert param.ParamTable.from_params(params).strings() == expected
+
+
+def test_paramtable_typed_storage():
+    vals = _values()
+    assert param.ParamTable(vals['floats'])._vals.typecode == 'd'
+    assert param.ParamTable(vals['formatted'])._vals.typecode == 'd'
+    assert param.ParamTable(vals['ints'])._vals.typecode == 'q'
+    for name in ('multivalued', 'mixed'):
+        assert isinstance(param.ParamTable(vals[name])._vals, list)
+
+    # Falls back to a list, keeping the types of the stored values
+    table = param.ParamTable(vals['ints'])
+    table.append(1.5)
+    table.append(2**70)
+    assert isinstance(table._vals, list)
+    assert table.strings()[-3:] == [str(vals['ints'][-1]), '1.5',
+                                    str(2**70)]
+    assert isinstance(table[0].val, int)
+
+    # Many unique formats widen the format indices
+    table = param.ParamTable([(1.0, '{:.%df}' % i) for i in range(300)])
+    assert isinstance(table._fmt_idx, array)
+    assert table.strings()[299] == '{:.299f}'.format(1.0)
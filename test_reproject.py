@@ -0,0 +1,69 @@
+import warnings
+
+import numpy as np
+
+import reproject
+import wcs
+
+
+HEADER = {
+    'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+    'CRPIX1': 256.5, 'CRPIX2': 240.2,
+    'CRVAL1': 10.68, 'CRVAL2': 41.27,
+    'CD1_1': -1.2e-4, 'CD1_2': 3e-6, 'CD2_1': 2.5e-6, 'CD2_2': 1.2e-4,
+    }
+
+
+def _rotated_header():
+    hdr = dict(HEADER)
+    hdr['CRVAL1'] += 0.01
+    hdr['CD1_2'] = 1e-5
+    return hdr
+
+
+def test_affine_map_tol():
+    hdr_in = _rotated_header()
+    A = reproject.affine_map((0, 512), (0, 512), HEADER, hdr_in, tol=0.01)
+    assert A is not None
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(1, 512, (2, 100))
+    xin, yin = wcs.pix2pix(x, y, HEADER, hdr_in)
+    xaff, yaff = A.dot([x, y, np.ones_like(x)])
+    assert np.hypot(xaff - xin, yaff - yin).max() < 0.01
+    assert reproject.affine_map((0, 512), (0, 512), HEADER, hdr_in,
+                                tol=1e-9) is None
+
+
+def test_sample_nearest_nonfinite():
+    data = np.arange(12.0).reshape(3, 4)
+    x = np.array([1.0, 4.49, 4.5, np.nan, np.inf, 0.5, 0.49])
+    y = np.array([1.0, 3.0, 1.0, 1.0, 1.0, np.nan, 1.0])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        result = reproject.sample_nearest(data, x, y, fill=-1)
+    np.testing.assert_array_equal(result, [0, 11, -1, -1, -1, -1, -1])
+
+
+def _scaled_header(shape, scale):
+    # Same footprint as an image of `shape` with the pixels of HEADER, with
+    # pixels `scale` times as large
+    ny, nx = shape
+    hdr = dict(HEADER, CRPIX1=(nx/scale + 1)/2.0, CRPIX2=(ny/scale + 1)/2.0)
+    for key in ('CD1_1', 'CD1_2', 'CD2_1', 'CD2_2'):
+        hdr[key] = HEADER[key]*scale
+    return hdr
+
+
+def test_reproject_flux_conserved():
+    shape = (64, 64)
+    hdr_in = _scaled_header(shape, 1)
+    point = np.zeros(shape)
+    point[20, 30] = 1.0
+    uniform = np.ones(shape)
+    for scale in (8, 0.25):  # Down- and upsampling
+        hdr_out = _scaled_header(shape, scale)
+        shape_out = (int(64/scale), int(64/scale))
+        for data in (point, uniform):
+            out = reproject.reproject(data, hdr_in, hdr_out, shape_out,
+                                      method='flux', tilesize=16)
+            np.testing.assert_allclose(out.sum(), data.sum(), rtol=1e-12)
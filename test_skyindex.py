@@ -0,0 +1,40 @@
+import numpy as np
+
+import skyindex
+import wcs
+
+
+HEADER = {
+    'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+    'NAXIS1': 512, 'NAXIS2': 480,
+    'CRPIX1': 256.5, 'CRPIX2': 240.5,
+    'CRVAL1': 10.68, 'CRVAL2': 41.27,
+    'CD1_1': -1.2e-4, 'CD1_2': 0.0, 'CD2_1': 0.0, 'CD2_2': 1.2e-4,
+    }
+
+
+def _sip_header():
+    hdr = dict(HEADER, CTYPE1='RA---TAN-SIP', CTYPE2='DEC--TAN-SIP')
+    hdr['CRVAL1'] += 0.03
+    hdr.update(A_ORDER=2, A_2_0=2e-4, A_1_1=-1e-4, A_0_2=5e-5,
+               B_ORDER=2, B_2_0=-5e-5, B_1_1=1e-4, B_0_2=1.5e-4)
+    return hdr
+
+
+def test_footprint_index_sip():
+    hdrs = [HEADER, _sip_header()]
+    index = skyindex.FootprintIndex(hdrs)
+    rng = np.random.RandomState(0)
+    lon = rng.uniform(10.60, 10.80, 5000)
+    lat = rng.uniform(41.22, 41.32, 5000)
+    ipos, iimg, x, y = index.query(lon, lat)
+    for i, hdr in enumerate(hdrs):
+        xi, yi = wcs.world2pix(lon, lat, hdr)
+        inside = ((xi >= 0.5) & (xi < hdr['NAXIS1'] + 0.5) &
+                  (yi >= 0.5) & (yi < hdr['NAXIS2'] + 0.5))
+        assert inside.any()
+        np.testing.assert_array_equal(np.sort(ipos[iimg == i]),
+                                      np.flatnonzero(inside))
+        k = np.argsort(ipos[iimg == i])
+        np.testing.assert_allclose(x[iimg == i][k], xi[inside])
+        np.testing.assert_allclose(y[iimg == i][k], yi[inside])
@@ -0,0 +1,334 @@
+import warnings
+
+import numpy as np
+
+import wcs
+
+
+def _tan_header(crval1, crval2):
+    return {
+        'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+        'CRPIX1': 2048.5, 'CRPIX2': 2048.5,
+        'CRVAL1': crval1, 'CRVAL2': crval2,
+        'CD1_1': -2.4e-4, 'CD1_2': 0.0, 'CD2_1': 0.0, 'CD2_2': 2.4e-4,
+        }
+
+
+def test_pix2world_float32_pole():
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(1, 4096, (2, 100000)).astype(np.float32)
+    for crval2 in (89.99, -89.99):
+        hdr = _tan_header(255.0, crval2)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            lon32, lat32 = wcs.pix2world(x, y, hdr)
+        lon, lat = wcs.pix2world(x.astype(float), y.astype(float), hdr)
+        err = wcs._angular_error(lon, lat, lon32.astype(float),
+                                 lat32.astype(float))
+        assert err.max() < 1e-5
+
+
+def test_pix2world_float32_error_bound():
+    # Within 1e-6 times the offset from CRVAL plus half a unit in the last
+    # place, over the whole sky
+    rng = np.random.RandomState(1)
+    x, y = rng.uniform(1, 4096, (2, 20000)).astype(np.float32)
+    for crval1 in np.arange(7.3, 360, 30):
+        for crval2 in np.r_[np.arange(-85, 90, 10), -89.99, 89.99]:
+            hdr = _tan_header(crval1, crval2)
+            result32 = wcs.pix2world(x, y, hdr)
+            result = wcs.pix2world(x.astype(float), y.astype(float), hdr)
+            for val32, val, crval in zip(result32, result, (crval1, crval2)):
+                ulp = np.spacing(np.abs(val).astype(np.float32))
+                bound = 0.5*ulp + 1e-6*np.abs(val - crval)
+                assert (np.abs(val32 - val) <= bound).all()
+
+
+def test_world2pix_float32_error_bound():
+    # Within 1e-6 times the distance from CRPIX plus half a unit in the last
+    # place, over the whole sky
+    rng = np.random.RandomState(1)
+    x, y = rng.uniform(1, 4096, (2, 20000))
+    for crval1 in np.arange(7.3, 360, 30):
+        for crval2 in np.r_[np.arange(-85, 90, 10), -89.99, 89.99]:
+            hdr = _tan_header(crval1, crval2)
+            hdr.update(CRPIX1=2048.3711, CRPIX2=2047.6173)
+            lon, lat = (val.astype(np.float32)
+                        for val in wcs.pix2world(x, y, hdr))
+            result32 = wcs.world2pix(lon, lat, hdr)
+            result = wcs.world2pix(lon.astype(float), lat.astype(float), hdr)
+            dist = np.hypot(result[0] - hdr['CRPIX1'],
+                            result[1] - hdr['CRPIX2'])
+            for val32, val in zip(result32, result):
+                ulp = np.spacing(np.abs(val).astype(np.float32))
+                bound = 0.5*ulp + 1e-6*dist
+                assert (np.abs(val32 - val) <= bound).all()
+
+
+def test_world_map_maxerr():
+    hdr = _tan_header(255.0, 30.0)
+    hdr.update(CRPIX1=450.5, CRPIX2=350.5, CD1_1=-2e-2, CD2_2=2e-2)
+    x, y = np.arange(1, 901.0), np.arange(1, 701.0)
+    lon, lat = wcs.pix2world(x[None, :], y[:, None], hdr)
+    for maxerr in (1e-3, 1e-5):  # Refines some of the cells
+        mlon, mlat = wcs.world_map((700, 900), hdr, maxerr=maxerr)
+        assert wcs._angular_error(lon, lat, mlon, mlat).max() <= maxerr
+
+
+def test_profile_stages_and_headers():
+    hdr1 = _tan_header(255.0, 30.0)
+    hdr2 = dict(hdr1, CRPIX1=100.5)  # Same CRVAL
+    x = np.ones(10000)
+    with wcs.profile() as prof:
+        wcs.pix2world(x, x, hdr1)
+        wcs.pix2world(x, x, hdr2)
+    totals = prof.totals(by_header=True)
+    assert len(set(header for stage, header in totals)) == 2
+    for stage in ('pix2proj', 'proj2natsph', 'natsph2celsph'):
+        calls, points, seconds, nbytes = prof.totals()[stage]
+        assert points == 20000 and nbytes == 2 * 20000 * 8
+
+
+def _projection_header(projection, crval1=30.0, crval2=40.0, scale=0.05):
+    return {
+        'CTYPE1': 'RA---' + projection, 'CTYPE2': 'DEC--' + projection,
+        'CRPIX1': 512.5, 'CRPIX2': 480.5,
+        'CRVAL1': crval1, 'CRVAL2': crval2,
+        'CD1_1': -scale*np.cos(0.2), 'CD1_2': scale*np.sin(0.2),
+        'CD2_1': scale*np.sin(0.2), 'CD2_2': scale*np.cos(0.2),
+        }
+
+
+def _assert_lon_close(lon1, lon2, atol):
+    np.testing.assert_allclose((lon1 - lon2 + 180) % 360 - 180, 0, rtol=0,
+                               atol=atol)
+
+
+def test_pix2world_roundtrip_projections():
+    rng = np.random.RandomState(2)
+    x, y = rng.uniform(1, 1024, (2, 10000))
+    for projection in wcs._PROJECTIONS:
+        for crval2 in (-60.0, 0.0, 40.0, 89.0):
+            hdr = _projection_header(projection, crval2=crval2)
+            lon, lat = wcs.pix2world(x, y, hdr)
+            assert np.isfinite(lon).all() and np.isfinite(lat).all()
+            x2, y2 = wcs.world2pix(lon, lat, hdr)
+            np.testing.assert_allclose(x2, x, rtol=0, atol=1e-7)
+            np.testing.assert_allclose(y2, y, rtol=0, atol=1e-7)
+
+
+def test_projections_calabretta_greisen():
+    # The projection equations of Calabretta & Greisen (2002) in degrees:
+    # R_theta of each zenithal projection with Eqs. 12 and 13, and the
+    # equations of CAR and AIT
+    phi = np.array([-150.0, -60.0, 0.0, 45.0, 170.0])
+    theta = np.array([20.0, 35.0, 60.0, 75.0, 88.0])
+    p, t = phi * wcs.D2R, theta * wcs.D2R
+    r = {
+        'TAN': wcs.R2D / np.tan(t),
+        'SIN': wcs.R2D * np.cos(t),
+        'ARC': 90 - theta,
+        'ZEA': wcs.R2D * np.sqrt(2*(1 - np.sin(t))),
+        'STG': 2*wcs.R2D * np.tan((np.pi/2 - t)/2),
+        }
+    expected = dict((proj, (r[proj]*np.sin(p), -r[proj]*np.cos(p)))
+                    for proj in r)
+    expected['CAR'] = (phi, theta)
+    gamma = wcs.R2D * np.sqrt(2/(1 + np.cos(t)*np.cos(p/2)))
+    expected['AIT'] = (2*gamma*np.cos(t)*np.sin(p/2), gamma*np.sin(t))
+    for projection, (xp, yp) in expected.items():
+        hdr = _projection_header(projection)
+        result = wcs.natsph2proj(phi, theta, hdr)
+        np.testing.assert_allclose(result, (xp, yp), rtol=0, atol=1e-10)
+        result = wcs.proj2natsph(xp, yp, hdr)
+        np.testing.assert_allclose(result, (phi, theta), rtol=0, atol=1e-9)
+
+    # Eqs. 2 and 5, with the default LONPOLE of 180 degrees of zenithal
+    # projections
+    lon_0, lat_0, phi_p = 30.0*wcs.D2R, 40.0*wcs.D2R, np.pi
+    lon = lon_0 + np.arctan2(
+        -np.cos(t)*np.sin(p - phi_p),
+        np.sin(t)*np.cos(lat_0) - np.cos(t)*np.sin(lat_0)*np.cos(p - phi_p))
+    lat = np.arcsin(np.sin(t)*np.sin(lat_0) +
+                    np.cos(t)*np.cos(lat_0)*np.cos(p - phi_p))
+    hdr = _projection_header('TAN')
+    lon2, lat2 = wcs.natsph2celsph(phi, theta, hdr)
+    _assert_lon_close(lon2, lon*wcs.R2D, atol=1e-10)
+    np.testing.assert_allclose(lat2, lat*wcs.R2D, rtol=0, atol=1e-10)
+    phi2, theta2 = wcs.celsph2natsph(lon*wcs.R2D, lat*wcs.R2D, hdr)
+    _assert_lon_close(phi2, phi, atol=1e-9)
+    np.testing.assert_allclose(theta2, theta, rtol=0, atol=1e-9)
+
+
+def test_lonpole_latpole():
+    # For CAR, theta_0 = 0, and the default LONPOLE is 0 for CRVAL2 >= 0.
+    # The native pole is then at celestial latitude 90 - CRVAL2 or
+    # CRVAL2 - 90 (Eq. 8 of Calabretta & Greisen 2002), selected by LATPOLE.
+    # Eq. 8 only has solutions for |cos(LONPOLE)| >= sin(CRVAL2).
+    for lonpole in (None, 0.0, 30.0, -40.0):
+        for latpole in (None, 90.0, -90.0):
+            hdr = _projection_header('CAR')
+            if lonpole is not None:
+                hdr['LONPOLE'] = lonpole
+            if latpole is not None:
+                hdr['LATPOLE'] = latpole
+            w = wcs.WCS(hdr)
+
+            # The reference point is at CRVAL, and the celestial pole is at
+            # native longitude LONPOLE and native latitude lat_p
+            lon, lat = wcs.natsph2celsph(0.0, 0.0, hdr)
+            np.testing.assert_allclose((lon, lat), (30.0, 40.0), atol=1e-10)
+            phi, theta = wcs.celsph2natsph(0.0, 90.0, hdr)
+            _assert_lon_close(phi, 0.0 if lonpole is None else lonpole,
+                              atol=1e-9)
+            np.testing.assert_allclose(theta, w.lat_p * wcs.R2D, atol=1e-9)
+            if lonpole in (None, 0.0):
+                expected = 50.0 if latpole in (None, 90.0) else -50.0
+                np.testing.assert_allclose(w.lat_p * wcs.R2D, expected,
+                                           atol=1e-10)
+
+    # Arrays of reference points and poles
+    lon_p, lat_p, phi_p = wcs._native_pole(
+        np.radians([30.0, 30.0, 100.0]), np.radians([40.0, 40.0, -20.0]),
+        0.0, lat_pole=np.radians([90.0, -90.0, -90.0]))
+    np.testing.assert_allclose(np.degrees(lat_p), [50.0, -50.0, -70.0],
+                               atol=1e-10)
+    np.testing.assert_allclose(phi_p, [0.0, 0.0, np.pi])
+
+
+def _sip_header():
+    hdr = _tan_header(10.68, 41.27)
+    hdr.update(CTYPE1='RA---TAN-SIP', CTYPE2='DEC--TAN-SIP',
+               CRPIX1=256.5, CRPIX2=240.5,
+               A_ORDER=3, A_2_0=2e-5, A_1_1=-1e-5, A_0_2=5e-6, A_3_0=1e-8,
+               B_ORDER=3, B_2_0=-5e-6, B_1_1=1e-5, B_0_2=1.5e-5, B_0_3=-2e-8)
+    return hdr
+
+
+def test_sip_roundtrip():
+    hdr = _sip_header()
+    sip = wcs.SIP.from_header(hdr)
+    rng = np.random.RandomState(3)
+    u, v = rng.uniform(-256, 256, (2, 10000))
+    U, V = sip.distort(u, v)
+    assert np.abs(U - u).max() > 1  # Not negligible
+    u2, v2 = sip.undistort(U, V)
+    np.testing.assert_allclose(u2, u, rtol=0, atol=1e-8)
+    np.testing.assert_allclose(v2, v, rtol=0, atol=1e-8)
+
+    # The matrix engine keeps the rotation well below the SIP tolerance
+    x, y = u + hdr['CRPIX1'], v + hdr['CRPIX2']
+    lon, lat = wcs.pix2world(x, y, hdr, engine='matrix')
+    x2, y2 = wcs.world2pix(lon, lat, hdr, engine='matrix')
+    np.testing.assert_allclose(x2, x, rtol=0, atol=1e-8)
+    np.testing.assert_allclose(y2, y, rtol=0, atol=1e-8)
+
+
+def test_sip_undistort_not_converged():
+    sip = wcs.SIP.from_header(_sip_header())
+    U = np.array([0.0, 1.0, 50.0, 400.0, 800.0])
+    V = np.array([0.0, -1.0, 30.0, -300.0, 600.0])
+    u, v = sip.undistort(U, V)
+    assert np.isfinite(u).all() and np.isfinite(v).all()
+
+    # Points that do not converge within maxiter Newton steps are NaN, and
+    # the others are unaffected
+    sip.maxiter = 2
+    u2, v2 = sip.undistort(U, V)
+    bad = np.isnan(u2)
+    assert bad.any() and not bad.all()
+    np.testing.assert_array_equal(np.isnan(v2), bad)
+    np.testing.assert_allclose(u2[~bad], u[~bad], rtol=0, atol=1e-8)
+    np.testing.assert_allclose(v2[~bad], v[~bad], rtol=0, atol=1e-8)
+
+
+def test_wcs_stack_matches_wcs():
+    rng = np.random.RandomState(4)
+    for projection in ('TAN', 'AIT'):
+        hdrs = []
+        for i in range(5):
+            hdr = _projection_header(projection, crval1=rng.uniform(0, 360),
+                                     crval2=rng.uniform(-80, 80),
+                                     scale=rng.uniform(1e-4, 1e-2))
+            hdr['CRPIX1'] += rng.uniform(-50, 50)
+            if i == 3 and projection == 'AIT':
+                hdr['LATPOLE'] = -90.0
+            hdrs.append(hdr)
+        stack = wcs.WCSStack.from_headers(hdrs)
+        index = rng.randint(0, len(hdrs), 10000)
+        x, y = rng.uniform(1, 1024, (2, len(index)))
+        lon, lat = stack.pix2world(x, y, index)
+        x2, y2 = stack.world2pix(lon, lat, index)
+        xp, yp = stack.world2proj(lon, lat, index)
+        for i, hdr in enumerate(hdrs):
+            k = index == i
+            expected = wcs.pix2world(x[k], y[k], hdr)
+            _assert_lon_close(lon[k], expected[0], atol=1e-10)
+            np.testing.assert_allclose(lat[k], expected[1], rtol=0,
+                                       atol=1e-10)
+            expected = wcs.world2pix(lon[k], lat[k], hdr)
+            np.testing.assert_allclose((x2[k], y2[k]), expected, rtol=0,
+                                       atol=1e-8)
+            expected = wcs.celsph2natsph(lon[k], lat[k], hdr)
+            expected = wcs.natsph2proj(expected[0], expected[1], hdr)
+            np.testing.assert_allclose((xp[k], yp[k]), expected, rtol=0,
+                                       atol=1e-10)
+
+
+def test_pix2pix_matches_world2pix():
+    rng = np.random.RandomState(5)
+    x, y = rng.uniform(1, 512, (2, 10000))
+    hdr1 = _sip_header()
+    hdr2 = dict(_tan_header(10.70, 41.25), CRPIX1=300.5, CRPIX2=200.5,
+                CD1_1=-1.8e-4, CD1_2=4e-5, CD2_1=4e-5, CD2_2=1.8e-4)
+    for h1, h2 in ((hdr1, hdr2), (hdr2, hdr1), (hdr1, hdr1)):
+        # The matrix engine keeps the rotation accurate to ~1e-10 pixels
+        lon, lat = wcs.pix2world(x, y, h1, engine='matrix')
+        expected = wcs.world2pix(lon, lat, h2, engine='matrix')
+        result = wcs.pix2pix(x, y, h1, h2, engine='matrix')
+        np.testing.assert_allclose(result, expected, rtol=0, atol=1e-9)
+        out = (np.empty(len(x)), np.empty(len(x)))
+        assert wcs.pix2pix(x, y, h1, h2, out=out, blocksize=1000,
+                           engine='matrix') is out
+        np.testing.assert_allclose(out, expected, rtol=0, atol=1e-9)
+
+
+def test_streaming_matches_whole_array(tmp_path):
+    hdr = _tan_header(255.0, 30.0)
+    rng = np.random.RandomState(6)
+    x, y = rng.uniform(1, 4096, (2, 10007))
+    lon, lat = wcs.pix2world(x, y, hdr)
+    x2, y2 = wcs.world2pix(lon, lat, hdr)
+    for chunksize in (1000, 333, 20000):  # 333 does not divide 10007
+        chunks = list(wcs.iter_pix2world(wcs.iter_chunks(x, y, chunksize),
+                                         hdr, blocksize=100))
+        assert len(chunks) == -(-len(x) // chunksize)
+        np.testing.assert_array_equal(np.concatenate([c[0] for c in chunks]),
+                                      lon)
+        np.testing.assert_array_equal(np.concatenate([c[1] for c in chunks]),
+                                      lat)
+        chunks = list(wcs.iter_world2pix(wcs.iter_chunks(lon, lat, chunksize),
+                                         hdr))
+        np.testing.assert_array_equal(np.concatenate([c[0] for c in chunks]),
+                                      x2)
+        np.testing.assert_array_equal(np.concatenate([c[1] for c in chunks]),
+                                      y2)
+
+    # Column files, .npy and raw binary
+    files = dict((name, str(tmp_path / name))
+                 for name in ('x.npy', 'y.npy', 'lon.npy', 'lat.npy',
+                              'x.bin', 'y.bin'))
+    np.save(files['x.npy'], x)
+    np.save(files['y.npy'], y)
+    result = wcs.pix2world_file(files['x.npy'], files['y.npy'],
+                                files['lon.npy'], files['lat.npy'], hdr,
+                                chunksize=333)
+    np.testing.assert_array_equal(result, (lon, lat))
+    np.testing.assert_array_equal(np.load(files['lon.npy']), lon)
+    np.testing.assert_array_equal(np.load(files['lat.npy']), lat)
+    result = wcs.world2pix_file(files['lon.npy'], files['lat.npy'],
+                                files['x.bin'], files['y.bin'], hdr,
+                                chunksize=333)
+    np.testing.assert_array_equal(result, (x2, y2))
+    np.testing.assert_array_equal(np.fromfile(files['x.bin']), x2)
+    np.testing.assert_array_equal(np.fromfile(files['y.bin']), y2)
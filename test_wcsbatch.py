@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+
+import wcs
+import wcsbatch
+
+
+HEADER = {
+    'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+    'CRPIX1': 256.5, 'CRPIX2': 240.5,
+    'CRVAL1': 10.68, 'CRVAL2': 41.27,
+    'CD1_1': -1.2e-4, 'CD1_2': 0.0, 'CD2_1': 0.0, 'CD2_2': 1.2e-4,
+    }
+
+
+def test_world2pix_default_columns(tmp_path):
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(1, 512, (2, 100))
+    lon, lat = wcs.pix2world(x, y, HEADER)
+    infile = str(tmp_path / 'cat.csv')
+    np.savetxt(infile, np.column_stack([np.arange(100), lon, lat]),
+               delimiter=',', header='id,lon,lat', comments='',
+               fmt=['%d', '%.12f', '%.12f'])
+    hdrfile = str(tmp_path / 'hdr.json')
+    with open(hdrfile, 'w') as f:
+        json.dump(HEADER, f)
+
+    # No -c: lon and lat are the input columns of world2pix
+    assert wcsbatch.main(['-d', 'world2pix', '-H', hdrfile, '-w', '1',
+                          infile]) == 0
+    out = np.genfromtxt(str(tmp_path / 'cat_wcs.csv'), delimiter=',',
+                        names=True)
+    assert out.dtype.names == ('id', 'lon', 'lat', 'x', 'y')
+    np.testing.assert_allclose(out['x'], x, atol=1e-5)
+    np.testing.assert_allclose(out['y'], y, atol=1e-5)
+
+
+def test_integer_input_float_output(tmp_path):
+    x, y = np.meshgrid(np.arange(1, 21), np.arange(1, 11))
+    data = np.column_stack([x.ravel(), y.ravel()]).astype(np.int32)
+    lon, lat = wcs.pix2world(data[:, 0].astype(float),
+                             data[:, 1].astype(float), HEADER)
+
+    infile, outfile = str(tmp_path / 'cat.npy'), str(tmp_path / 'out.npy')
+    np.save(infile, data)
+    wcsbatch.transform_file(infile, outfile, HEADER, columns=(0, 1),
+                            chunksize=7)
+    out = np.load(outfile)
+    assert out.dtype == np.float64
+    np.testing.assert_array_equal(out[:, :2], data)
+    np.testing.assert_allclose(out[:, 2], lon, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(out[:, 3], lat, rtol=0, atol=1e-12)
+
+    infile, outfile = str(tmp_path / 'cat.bin'), str(tmp_path / 'out.bin')
+    data.tofile(infile)
+    wcsbatch.transform_file(infile, outfile, HEADER, columns=(0, 1),
+                            ncols=2, dtype=np.int32, chunksize=7)
+    out = np.fromfile(outfile).reshape(-1, 4)
+    np.testing.assert_array_equal(out[:, :2], data)
+    np.testing.assert_allclose(out[:, 2], lon, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(out[:, 3], lat, rtol=0, atol=1e-12)
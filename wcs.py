@@ -1,3 +1,9 @@
+import contextlib
+import threading
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 
 
@@ -6,48 +12,1543 @@ def parse_ctype(ctype_str):
     CTYPEi keyword.
 
     """
-    elements = ctype_str.split('-')
+    elements = [element for element in ctype_str.split('-') if element]
+    if len(elements) > 2 and elements[-1] == 'SIP':
+        elements = elements[:-1]  # Distortion code; see `SIP`
     coordsys, projection = elements[0], elements[-1]
     return coordsys, projection
 
 
-def pix2proj(x, y, hdr):
-    """Convert pixel coordinates into projection plane coordinates
-    according to Eq. 3 in Greisen & Calabretta (2002).
+# Degrees <-> radians
+D2R = np.pi/180
+R2D = 180/np.pi
+
+# Default number of points processed per block by the fused transforms. The
+# scratch arrays for a block should comfortably fit in cache.
+BLOCKSIZE = 4096
+
+
+# The projection kernels and the spherical rotations below all work in
+# radians and in place: the input arrays `a` and `b` are overwritten with the
+# results, and `s1`, `s2`, ... are scratch arrays of the same shape. This
+# keeps the fused transforms in `WCS` free of temporary allocations.
+
+def _zenithal_x2s(a, b, s1):
+    """Native longitude phi (in `a`) and radius R (in `s1`) of zenithal
+    projection plane coordinates (a, b). `b` is overwritten.
+
+    """
+    np.hypot(a, b, out=s1)  # (C&G02 eq.15/pg.1085/pdf.9)
+    np.negative(b, out=b)
+    np.arctan2(a, b, out=a)  # (C&G02 eq.14/pg.1085/pdf.9)
+
+
+def _zenithal_s2x(a, b, s1):
+    """Zenithal projection plane coordinates (xp, yp) from native longitude
+    phi (in `a`) and radius R (in `s1`). `b` is overwritten.
+
+    """
+    np.cos(a, out=b)
+    np.multiply(b, s1, out=b)
+    np.negative(b, out=b)  # (C&G02 eq.13/pg.1085/pdf.9)
+    np.sin(a, out=a)
+    np.multiply(a, s1, out=a)  # (C&G02 eq.12/pg.1085/pdf.9)
+
+
+def _tan_x2s(a, b, s1, s2):
+    """TAN projection plane coordinates (a, b) to native spherical
+    coordinates (phi, theta).
+
+    """
+    _zenithal_x2s(a, b, s1)
+    np.arctan2(1.0, s1, out=b)  # (C&G02 eq.55/pg.1088/pdf.12)
+    return a, b
+
+
+def _tan_s2x(a, b, s1, s2):
+    """Native spherical coordinates (phi, theta) to TAN projection plane
+    coordinates (xp, yp).
+
+    """
+    np.tan(b, out=s1)
+    np.reciprocal(s1, out=s1)  # (C&G02 eq.54/pg.1088/pdf.12)
+    _zenithal_s2x(a, b, s1)
+    return a, b
+
+
+def _sin_x2s(a, b, s1, s2):
+    """SIN (orthographic) projection plane coordinates (a, b) to native
+    spherical coordinates (phi, theta). Points beyond R = 1 are NaN.
+
+    """
+    _zenithal_x2s(a, b, s1)
+    # theta = arccos(R), as an arctan2 to keep the precision near R = 0
+    np.multiply(s1, s1, out=b)
+    np.subtract(1.0, b, out=b)
+    with np.errstate(invalid='ignore'):
+        np.sqrt(b, out=b)
+    np.arctan2(b, s1, out=b)  # (C&G02 sec.5.1.5)
+    return a, b
+
+
+def _sin_s2x(a, b, s1, s2):
+    """Native spherical coordinates (phi, theta) to SIN projection plane
+    coordinates (xp, yp).
+
+    """
+    np.cos(b, out=s1)  # (C&G02 sec.5.1.5)
+    _zenithal_s2x(a, b, s1)
+    return a, b
+
+
+def _arc_x2s(a, b, s1, s2):
+    """ARC (zenithal equidistant) projection plane coordinates (a, b) to
+    native spherical coordinates (phi, theta).
+
+    """
+    _zenithal_x2s(a, b, s1)
+    np.subtract(np.pi/2, s1, out=b)  # (C&G02 sec.5.1.6)
+    return a, b
+
+
+def _arc_s2x(a, b, s1, s2):
+    """Native spherical coordinates (phi, theta) to ARC projection plane
+    coordinates (xp, yp).
+
+    """
+    np.subtract(np.pi/2, b, out=s1)  # (C&G02 sec.5.1.6)
+    _zenithal_s2x(a, b, s1)
+    return a, b
+
+
+def _zea_x2s(a, b, s1, s2):
+    """ZEA (zenithal equal area) projection plane coordinates (a, b) to
+    native spherical coordinates (phi, theta). Points beyond R = 2 are NaN.
+
+    """
+    _zenithal_x2s(a, b, s1)
+    np.multiply(s1, 0.5, out=b)
+    with np.errstate(invalid='ignore'):
+        np.arcsin(b, out=b)
+    np.multiply(b, -2.0, out=b)
+    np.add(b, np.pi/2, out=b)  # (C&G02 sec.5.1.8)
+    return a, b
+
+
+def _zea_s2x(a, b, s1, s2):
+    """Native spherical coordinates (phi, theta) to ZEA projection plane
+    coordinates (xp, yp).
+
+    """
+    # R = 2*sin((90 - theta)/2), i.e., sqrt(2*(1 - sin(theta))) without the
+    # cancellation near the pole
+    np.subtract(np.pi/2, b, out=s1)
+    np.multiply(s1, 0.5, out=s1)
+    np.sin(s1, out=s1)
+    np.multiply(s1, 2.0, out=s1)  # (C&G02 sec.5.1.8)
+    _zenithal_s2x(a, b, s1)
+    return a, b
+
+
+def _stg_x2s(a, b, s1, s2):
+    """STG (stereographic) projection plane coordinates (a, b) to native
+    spherical coordinates (phi, theta).
+
+    """
+    _zenithal_x2s(a, b, s1)
+    np.multiply(s1, 0.5, out=b)
+    np.arctan(b, out=b)
+    np.multiply(b, -2.0, out=b)
+    np.add(b, np.pi/2, out=b)  # (C&G02 sec.5.1.4)
+    return a, b
+
+
+def _stg_s2x(a, b, s1, s2):
+    """Native spherical coordinates (phi, theta) to STG projection plane
+    coordinates (xp, yp).
+
+    """
+    np.subtract(np.pi/2, b, out=s1)
+    np.multiply(s1, 0.5, out=s1)
+    np.tan(s1, out=s1)
+    np.multiply(s1, 2.0, out=s1)  # (C&G02 sec.5.1.4)
+    _zenithal_s2x(a, b, s1)
+    return a, b
+
+
+def _wrap(a, center=0.0):
+    """Normalize angles to (center - pi, center + pi] in place. The
+    non-zenithal projections need native longitude in (-pi, pi], and their
+    celestial longitudes are normalized about the reference point.
+
+    """
+    np.subtract(center + np.pi, a, out=a)
+    np.remainder(a, 2*np.pi, out=a)
+    np.subtract(center + np.pi, a, out=a)
+
+
+def _car_x2s(a, b, s1, s2):
+    """CAR (plate carree) projection plane coordinates (a, b) to native
+    spherical coordinates (phi, theta), which are the same in radians.
+
+    """
+    return a, b  # (C&G02 sec.5.2.3)
+
+
+def _car_s2x(a, b, s1, s2):
+    """Native spherical coordinates (phi, theta) to CAR projection plane
+    coordinates (xp, yp), which are the same in radians.
+
+    """
+    _wrap(a)
+    return a, b  # (C&G02 sec.5.2.3)
+
+
+def _ait_x2s(a, b, s1, s2):
+    """AIT (Hammer-Aitoff) projection plane coordinates (a, b) to native
+    spherical coordinates (phi, theta). Points outside the boundary ellipse
+    are NaN.
+
+    """
+    np.multiply(a, 0.25, out=s1)
+    np.multiply(s1, s1, out=s1)
+    np.multiply(b, 0.5, out=s2)
+    np.multiply(s2, s2, out=s2)
+    np.add(s1, s2, out=s1)
+    np.subtract(1.0, s1, out=s1)  # Z**2; (C&G02 sec.5.3.4)
+    np.multiply(s1, 2.0, out=s2)
+    np.subtract(s2, 1.0, out=s2)  # 2*Z**2 - 1
+    with np.errstate(invalid='ignore'):
+        np.sqrt(s1, out=s1)  # Z
+        np.multiply(b, s1, out=b)
+        np.arcsin(b, out=b)  # theta
+    np.multiply(a, s1, out=a)
+    np.multiply(a, 0.5, out=a)
+    np.arctan2(a, s2, out=a)
+    np.multiply(a, 2.0, out=a)  # phi
+    return a, b
+
+
+def _ait_s2x(a, b, s1, s2):
+    """Native spherical coordinates (phi, theta) to AIT projection plane
+    coordinates (xp, yp).
+
+    """
+    _wrap(a)
+    np.cos(b, out=s1)
+    np.sin(b, out=b)
+    np.multiply(a, 0.5, out=a)
+    np.cos(a, out=s2)
+    np.sin(a, out=a)
+    np.multiply(s2, s1, out=s2)  # cos(theta)*cos(phi/2)
+    np.multiply(a, s1, out=a)  # cos(theta)*sin(phi/2)
+    np.add(s2, 1.0, out=s2)
+    np.divide(2.0, s2, out=s2)
+    np.sqrt(s2, out=s2)  # gamma; (C&G02 sec.5.3.4)
+    np.multiply(a, s2, out=a)
+    np.multiply(a, 2.0, out=a)
+    np.multiply(b, s2, out=b)
+    return a, b
+
+
+# Projection code -> (projection plane to native spherical kernel, native
+# spherical to projection plane kernel, native latitude theta_0 of the
+# reference point in radians). theta_0 sets the default native pole; see
+# `_native_pole`.
+_PROJECTIONS = {
+    'TAN': (_tan_x2s, _tan_s2x, np.pi/2),
+    'SIN': (_sin_x2s, _sin_s2x, np.pi/2),
+    'ARC': (_arc_x2s, _arc_s2x, np.pi/2),
+    'ZEA': (_zea_x2s, _zea_s2x, np.pi/2),
+    'STG': (_stg_x2s, _stg_s2x, np.pi/2),
+    'CAR': (_car_x2s, _car_s2x, 0.0),
+    'AIT': (_ait_x2s, _ait_s2x, 0.0),
+    }
+
+# Projections with dedicated single precision transformations in `WCS`.
+# Single precision transformations for other projections compute in double
+# precision and only store the results in single precision.
+_FLOAT32_PROJECTIONS = ('TAN',)
+
+
+def _get_projection(hdr):
+    """Look up the projection kernels for the projection specified by CTYPE1
+    and CTYPE2.
+
+    """
+    # CTYPE1 and CTYPE2 are assumed to have the same projection
+    projection = parse_ctype(hdr['CTYPE1'])[1]
+    try:
+        x2s, s2x = _PROJECTIONS[projection][:2]
+    except KeyError:
+        raise ValueError('Unsupported projection: {:s}'.format(projection))
+    return projection, x2s, s2x
+
+
+def _native_pole(lon_0, lat_0, theta_0, phi_p=None, lat_pole=None):
+    """Celestial coordinates of the native pole from the celestial
+    coordinates of the reference point.
+
+    All angles are in radians, and `lon_0`, `lat_0`, `phi_p`, and `lat_pole`
+    may be arrays. The reference point is at native longitude 0 and native
+    latitude `theta_0`. `phi_p` (LONPOLE) is the native longitude of the
+    celestial pole; default is 0 if `lat_0` >= `theta_0`, and pi otherwise.
+    `lat_pole` (LATPOLE, default pi/2) selects between the two possible
+    latitudes of the native pole when `theta_0` is not pi/2.
+
+    Returns
+    -------
+    lon_p, lat_p, phi_p : float or array
+        Celestial longitude and latitude of the native pole and native
+        longitude of the celestial pole.
+
+    """
+    lon_0 = np.asarray(lon_0, dtype=float)
+    lat_0 = np.asarray(lat_0, dtype=float)
+    if phi_p is None:
+        phi_p = np.where(lat_0 >= theta_0, 0.0, np.pi)
+    phi_p = np.asarray(phi_p, dtype=float)
+    if lat_pole is None:
+        lat_pole = np.pi/2
+    if theta_0 == np.pi/2:
+        # Zenithal; the native pole is the reference point
+        lon_p, lat_p, phi_p = np.broadcast_arrays(lon_0, lat_0, phi_p)
+        return lon_p[()], lat_p[()], phi_p[()]
+
+    # (C&G02 eq.8/pg.1080/pdf.4)
+    sin_t0, cos_t0 = np.sin(theta_0), np.cos(theta_0)
+    sin_phi_p, cos_phi_p = np.sin(phi_p), np.cos(phi_p)
+    mid = np.arctan2(sin_t0, cos_t0*cos_phi_p)
+    half = np.arccos(np.clip(np.sin(lat_0) /
+                             np.sqrt(1 - (cos_t0*sin_phi_p)**2), -1, 1))
+    lat1 = (mid + half + np.pi) % (2*np.pi) - np.pi
+    lat2 = (mid - half + np.pi) % (2*np.pi) - np.pi
+    ok1 = np.abs(lat1) <= np.pi/2 + 1e-12
+    ok2 = np.abs(lat2) <= np.pi/2 + 1e-12
+    closer = np.abs(lat1 - lat_pole) <= np.abs(lat2 - lat_pole)
+    lat_p = np.clip(np.where(ok1 & (closer | ~ok2), lat1, lat2),
+                    -np.pi/2, np.pi/2)
+
+    # The reference point must rotate onto (lon_0, lat_0) (C&G02
+    # eq.2/pg.1079/pdf.3); this also covers lat_p = +/-pi/2
+    lon_p = lon_0 - np.arctan2(cos_t0*sin_phi_p,
+                               sin_t0*np.cos(lat_p) -
+                               cos_t0*np.sin(lat_p)*cos_phi_p)
+    lon_p, lat_p, phi_p = np.broadcast_arrays(lon_p, lat_p, phi_p)
+    return lon_p[()], lat_p[()], phi_p[()]
+
+
+def _get_pole(hdr):
+    """Celestial longitude and latitude of the native pole and native
+    longitude of the celestial pole, in radians. LONPOLE and LATPOLE are
+    used if present.
+
+    """
+    theta_0 = _PROJECTIONS[_get_projection(hdr)[0]][2]
+    phi_p, lat_pole = hdr.get('LONPOLE'), hdr.get('LATPOLE')
+    return _native_pole(
+        hdr['CRVAL1'] * D2R, hdr['CRVAL2'] * D2R, theta_0,
+        None if phi_p is None else phi_p * D2R,
+        None if lat_pole is None else lat_pole * D2R)
+
+
+def _rotate(a, b, a_p, sin_b_p, cos_b_p, c_p, s1, s2, s3):
+    """Spherical rotation shared by the native -> celestial (C&G02
+    eq.2/pg.1079/pdf.3) and celestial -> native (C&G02 eq.5/pg.1080/pdf.4)
+    transformations.
+
+    For native -> celestial, (a, b) = (phi, theta), a_p = phi_p, b_p =
+    lat_p, and c_p = lon_p; for celestial -> native, (a, b) = (lon, lat),
+    a_p = lon_p, b_p = lat_p, and c_p = phi_p.
+
+    """
+    np.cos(b, out=s1)
+    np.sin(b, out=b)
+    np.subtract(a, a_p, out=a)
+    np.sin(a, out=s2)
+    np.cos(a, out=a)
+    np.multiply(s2, s1, out=s2)
+    np.negative(s2, out=s2)  # -cos(b)*sin(da)
+    np.multiply(s1, a, out=s1)  # cos(b)*cos(da)
+    np.multiply(s1, sin_b_p, out=s3)
+    np.multiply(b, cos_b_p, out=a)
+    np.subtract(a, s3, out=a)
+    np.arctan2(s2, a, out=a)
+    np.add(a, c_p, out=a)
+    np.multiply(b, sin_b_p, out=b)
+    np.multiply(s1, cos_b_p, out=s1)
+    np.add(b, s1, out=b)
+    np.arcsin(b, out=b)
+    return a, b
+
+
+def _natsph2celsph(a, b, lon_p, sin_lat_p, cos_lat_p, phi_p, s1, s2, s3):
+    """Native spherical coordinates (phi, theta) to celestial spherical
+    coordinates (lon, lat).
+
+    """
+    # (C&G02 eq.2/pg.1079/pdf.3)
+    return _rotate(a, b, phi_p, sin_lat_p, cos_lat_p, lon_p, s1, s2, s3)
+
+
+def _celsph2natsph(a, b, lon_p, sin_lat_p, cos_lat_p, phi_p, s1, s2, s3):
+    """Celestial spherical coordinates (lon, lat) to native spherical
+    coordinates (phi, theta).
+
+    """
+    # (C&G02 eq.5/pg.1080/pdf.4)
+    return _rotate(a, b, lon_p, sin_lat_p, cos_lat_p, phi_p, s1, s2, s3)
+
+
+def _rotation_matrix(a_p, sin_b_p, cos_b_p):
+    """Rotation matrix form of `_rotate`.
+
+    Multiplying the unit vector of (a, b) by the matrix gives the unit
+    vector of (c - c_p, d) for the output coordinates (c, d); see
+    `_rotate_matrix`.
+
+    """
+    cos_a_p, sin_a_p = np.cos(a_p), np.sin(a_p)
+    return np.array([[-sin_b_p*cos_a_p, -sin_b_p*sin_a_p, cos_b_p],
+                     [sin_a_p, -cos_a_p, 0.0],
+                     [cos_b_p*cos_a_p, cos_b_p*sin_a_p, sin_b_p]])
+
+
+def _rotate_matrix(a, b, R, c_p, s1, s2, s3, s4):
+    """Spherical rotation by converting to Cartesian unit vectors and
+    multiplying by the rotation matrix `R` from `_rotation_matrix`.
+
+    Equivalent to `_rotate`, but the output latitude is computed with
+    arctan2 instead of arcsin, which keeps full precision near the poles.
+
+    """
+    np.cos(b, out=s1)
+    np.sin(b, out=b)  # z
+    np.cos(a, out=s2)
+    np.multiply(s2, s1, out=s2)  # x
+    np.sin(a, out=s3)
+    np.multiply(s3, s1, out=s3)  # y
+    np.multiply(s2, R[0, 0], out=a)
+    np.multiply(s3, R[0, 1], out=s1)
+    np.add(a, s1, out=a)
+    np.multiply(b, R[0, 2], out=s1)
+    np.add(a, s1, out=a)  # x'
+    np.multiply(s2, R[1, 0], out=s4)
+    np.multiply(s3, R[1, 1], out=s1)
+    np.add(s4, s1, out=s4)
+    np.multiply(b, R[1, 2], out=s1)
+    np.add(s4, s1, out=s4)  # y'
+    np.multiply(s2, R[2, 0], out=s2)
+    np.multiply(s3, R[2, 1], out=s1)
+    np.add(s2, s1, out=s2)
+    np.multiply(b, R[2, 2], out=s1)
+    np.add(s2, s1, out=s2)  # z'
+    np.hypot(a, s4, out=s1)
+    np.arctan2(s4, a, out=a)
+    np.add(a, c_p, out=a)
+    np.arctan2(s2, s1, out=b)
+    return a, b
+
+
+# Formulations of the native <-> celestial rotation available to the fused
+# transforms: 'trig' evaluates the spherical trigonometry of C&G02 eqs. 2
+# and 5 directly, and 'matrix' uses `_rotate_matrix`.
+ENGINES = ('trig', 'matrix')
+
+
+def _work_arrays(u, v, scale, nscratch):
+    """Broadcast `u` and `v` into new float arrays multiplied by `scale`,
+    and allocate `nscratch` scratch arrays of the same shape, for use with
+    the in-place kernels.
+
+    """
+    u, v = np.broadcast_arrays(u, v)
+    a = np.asarray(np.multiply(u, scale, dtype=float))
+    b = np.asarray(np.multiply(v, scale, dtype=float))
+    scratch = [np.empty_like(a) for i in range(nscratch)]
+    return [a, b] + scratch
+
+
+def _result_dtype(u, v, out, dtype):
+    """Floating point type for a fused transformation: `dtype` if given,
+    otherwise single precision if the outputs, or else the inputs, are
+    single precision, and double precision in all other cases.
+
+    """
+    if dtype is None:
+        if out is not None:
+            dtype = np.result_type(*out)
+        else:
+            dtype = np.result_type(*[a if np.isscalar(a) else np.asarray(a)
+                                     for a in (u, v)])
+        if dtype != np.float32:
+            dtype = np.float64
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('dtype must be float32 or float64')
+    return dtype
+
+
+def _blocks(u, v, out, blocksize, dtype=float, out_dtype=None):
+    """Iterate over `u`, `v`, and the output arrays in blocks of at most
+    `blocksize` points.
+
+    Returns an `numpy.nditer` that yields 1d arrays (u, v, p, q) of type
+    `dtype` for each block, where p and q are writable views (or buffers)
+    of the outputs. Output arrays of type `out_dtype` (default `dtype`) are
+    allocated if `out` is None. Any output
+    arrays supported by `numpy.nditer` work, including columns of a
+    structured array. The iterator is ranged, so copies of it can iterate
+    over disjoint parts of the arrays in separate threads.
+
+    """
+    if out is None:
+        if out_dtype is None or np.dtype(out_dtype) == np.dtype(dtype):
+            out = (None, None)
+        else:
+            shape = np.broadcast(u, v).shape
+            out = np.empty(shape, out_dtype), np.empty(shape, out_dtype)
+    op_flags = [['readonly'], ['readonly'],
+                ['writeonly', 'allocate', 'no_broadcast'],
+                ['writeonly', 'allocate', 'no_broadcast']]
+    return np.nditer([u, v, out[0], out[1]],
+                     flags=['external_loop', 'buffered', 'zerosize_ok',
+                            'ranged'],
+                     op_flags=op_flags, op_dtypes=[dtype]*4,
+                     buffersize=blocksize, casting='same_kind')
+
+
+def _poly_terms(degree):
+    """(i, j) exponents of the terms u**i * v**j of a 2d polynomial of total
+    degree `degree`.
+
+    """
+    return [(i, j) for j in range(degree+1) for i in range(degree+1-j)]
+
+
+def _horner2d(c, u, v, out, s1):
+    """Evaluate the 2d polynomial ``sum(c[i, j] * u**i * v**j)`` (i + j <=
+    degree) into `out` with nested Horner's schemes, using `s1` as scratch.
+
+    """
+    degree = c.shape[0] - 1
+    for j in range(degree, -1, -1):
+        # Polynomial in u multiplying v**j
+        s1.fill(c[degree-j, j])
+        for i in range(degree-j-1, -1, -1):
+            np.multiply(s1, u, out=s1)
+            np.add(s1, c[i, j], out=s1)
+        if j == degree:
+            out[...] = s1
+        else:
+            np.multiply(out, v, out=out)
+            np.add(out, s1, out=out)
+
+
+def _poly2d(c, u, v):
+    """Evaluate a 2d polynomial (see `_horner2d`) into a new array."""
+    out, s1 = np.empty_like(u), np.empty_like(u)
+    _horner2d(c, u, v, out, s1)
+    return out
+
+
+def _monomials(u, v, degree):
+    """Array of the monomials ``u**i * v**j`` of a 2d polynomial of total
+    degree `degree`, in the order of `_poly_terms`, for 1d `u` and `v`.
+
+    """
+    terms = _poly_terms(degree)
+    index = dict((term, k) for k, term in enumerate(terms))
+    out = np.empty((len(terms), len(u)))
+    out[0] = 1
+    for k, (i, j) in enumerate(terms[1:], 1):
+        if i > 0:
+            np.multiply(out[index[(i-1, j)]], u, out=out[k])
+        else:
+            np.multiply(out[index[(0, j-1)]], v, out=out[k])
+    return out
+
+
+def _sip_coeffs(hdr, name):
+    """Coefficients of a SIP polynomial (`name` is 'A', 'B', 'AP', or 'BP')
+    as an array c such that the polynomial is ``sum(c[p, q] * u**p *
+    v**q)``, or None if the header does not define it.
+
+    """
+    order = hdr.get('{:s}_ORDER'.format(name))
+    if order is None:
+        return None
+    c = np.zeros((order+1, order+1))
+    for p, q in _poly_terms(order):
+        c[p, q] = hdr.get('{:s}_{:d}_{:d}'.format(name, p, q), 0.0)
+    return c
+
+
+def _poly_derivs(c):
+    """Coefficients of the partial derivatives of a 2d polynomial with
+    respect to u and v.
+
+    """
+    degree = max(c.shape[0] - 2, 0)
+    dc_du, dc_dv = np.zeros((degree+1,)*2), np.zeros((degree+1,)*2)
+    for p, q in _poly_terms(c.shape[0] - 1):
+        if p > 0:
+            dc_du[p-1, q] = p * c[p, q]
+        if q > 0:
+            dc_dv[p, q-1] = q * c[p, q]
+    return dc_du, dc_dv
+
+
+class SIP(object):
+
+    """Simple Imaging Polynomial (SIP) distortion (Shupe et al. 2005).
+
+    The distortion is applied to the pixel offsets from CRPIX, (u, v),
+    before the CD matrix: ``U = u + f(u, v)`` and ``V = v + g(u, v)``,
+    where f and g are the A and B polynomials. The polynomials are
+    evaluated with nested Horner's schemes. The inverse is found with
+    Newton's method, starting from the AP and BP polynomials if they are
+    given. All points are iterated together, and converged points are
+    dropped from the following iterations. In each iteration, the monomials
+    of (u, v) are computed once, and the polynomials and their derivatives
+    are evaluated together as a single matrix product.
+
+    Parameters
+    ----------
+    a, b : array
+        Coefficients of the A and B polynomials, ``a[p, q]`` multiplying
+        ``u**p * v**q``.
+    ap, bp : array, optional
+        Coefficients of the approximate inverse polynomials AP and BP.
+    tol : float, optional
+        Convergence tolerance of the inverse in pixels, as the size of the
+        last Newton step. Default is 1e-10.
+    maxiter : int, optional
+        Maximum number of Newton iterations. Points that have not converged
+        by then are NaN. Default is 20.
+
+    Methods
+    -------
+    from_header(hdr)
+        Class method; the `SIP` defined by a header, or None.
+    distort(u, v)
+        Distorted offsets (U, V).
+    undistort(U, V)
+        Undistorted offsets (u, v).
+
+    """
+
+    def __init__(self, a, b, ap=None, bp=None, tol=1e-10, maxiter=20):
+        self.a, self.b = np.asarray(a, float), np.asarray(b, float)
+        self.ap = None if ap is None else np.asarray(ap, float)
+        self.bp = None if bp is None else np.asarray(bp, float)
+        self.tol, self.maxiter = tol, maxiter
+
+        # f, g, df/du, df/dv, dg/du, and dg/dv as linear combinations of
+        # the monomials of the inverse (see `_monomials`)
+        self._order = max(self.a.shape[0], self.b.shape[0]) - 1
+        terms = _poly_terms(self._order)
+        polys = [self.a, self.b] + list(_poly_derivs(self.a) +
+                                        _poly_derivs(self.b))
+        self._inverse_coeffs = np.array(
+            [[c[i, j] if i < c.shape[0] and j < c.shape[0] else 0.0
+              for i, j in terms] for c in polys])
+
+    @classmethod
+    def from_header(cls, hdr):
+        """The SIP distortion of a header with '-SIP' CTYPEs and A_ORDER,
+        A_p_q, B_ORDER, B_p_q (and optionally AP_ORDER, AP_p_q, BP_ORDER,
+        BP_p_q) keywords, or None if the CTYPEs do not end with '-SIP'.
+
+        """
+        if not hdr['CTYPE1'].endswith('-SIP'):
+            return None
+        a, b = _sip_coeffs(hdr, 'A'), _sip_coeffs(hdr, 'B')
+        if a is None or b is None:
+            raise ValueError('SIP distortion requires A_ORDER and B_ORDER')
+        ap, bp = _sip_coeffs(hdr, 'AP'), _sip_coeffs(hdr, 'BP')
+        if ap is None or bp is None:
+            ap, bp = None, None
+        return cls(a, b, ap, bp)
+
+    def _distortion(self, u, v, f, g, s1):
+        """f(u, v) and g(u, v) of a single block into `f` and `g`."""
+        _horner2d(self.a, u, v, f, s1)
+        _horner2d(self.b, u, v, g, s1)
+
+    def _undistort_block(self, U, V, u, v):
+        """Solve ``U = u + f(u, v)``, ``V = v + g(u, v)`` for a single 1d
+        block, storing the solution in `u` and `v`.
+
+        """
+        if self.ap is not None:
+            np.add(U, _poly2d(self.ap, U, V), out=u)
+            np.add(V, _poly2d(self.bp, U, V), out=v)
+        else:
+            u[...], v[...] = U, V
+
+        active = np.arange(len(U))
+        uu, vv, UU, VV = u, v, U, V
+        for i in range(self.maxiter):
+            # f, g, and their derivatives
+            vals = self._inverse_coeffs.dot(_monomials(uu, vv, self._order))
+            ru = uu + vals[0] - UU
+            rv = vv + vals[1] - VV
+            j11, j12, j21, j22 = 1 + vals[2], vals[3], vals[4], 1 + vals[5]
+            det = j11*j22 - j12*j21
+            du = (j22*ru - j12*rv) / det
+            dv = (j11*rv - j21*ru) / det
+            uu, vv = uu - du, vv - dv
+            u[active], v[active] = uu, vv
+
+            # Keep iterating on the points that have not converged
+            keep = ~(np.abs(du) + np.abs(dv) <= self.tol)
+            if not keep.all():
+                if not keep.any():
+                    break
+                active, uu, vv, UU, VV = (active[keep], uu[keep], vv[keep],
+                                          UU[keep], VV[keep])
+        else:
+            u[active], v[active] = np.nan, np.nan
+
+    def distort(self, u, v):
+        """Distorted pixel offsets ``(u + f(u, v), v + g(u, v))``."""
+        u, v = np.broadcast_arrays(np.asarray(u, float), np.asarray(v, float))
+        f, g, s1 = np.empty_like(u), np.empty_like(u), np.empty_like(u)
+        self._distortion(u, v, f, g, s1)
+        return (u + f)[()], (v + g)[()]
+
+    def undistort(self, U, V):
+        """Undistorted pixel offsets, the inverse of `distort`."""
+        U, V = np.broadcast_arrays(np.asarray(U, float), np.asarray(V, float))
+        u, v = np.empty(U.size), np.empty(U.size)
+        self._undistort_block(U.ravel(), V.ravel(), u, v)
+        return u.reshape(U.shape)[()], v.reshape(U.shape)[()]
+
+
+# Instrumentation of the transformation pipeline. `_profile` is the active
+# `Profile`, or None when profiling is disabled, in which case each stage
+# only costs one extra function call per block.
+_profile = None
+
+# Order of the stages in `Profile.report`
+STAGES = ('header', 'transform', 'pix2proj', 'proj2natsph', 'natsph2celsph',
+          'celsph2natsph', 'natsph2proj', 'proj2pix')
+
+
+class Profile(object):
+
+    """Call counts, point counts, wall time, and memory for each stage of
+    the transformation pipeline, per header.
+
+    Instances are created by `profile`. The stages are,
+
+    - 'header': building a `WCS` from a header.
+    - 'transform': a whole fused transformation (one call of `pix2world`,
+      `world2pix`, or `pix2pix`), including the allocation of the outputs
+      and of the scratch arrays.
+    - 'pix2proj', 'proj2natsph', 'natsph2celsph', and their inverses: the
+      stages of the fused transformations. These are timed block by block,
+      so their call counts are numbers of blocks. With several workers,
+      their times are summed over all threads. The single precision TAN
+      transformations are fused into a single kernel and only show up as
+      'transform'.
+
+    The bytes of 'transform' are those allocated for its outputs (unless
+    they are given with `out`) and scratch arrays. The other stages work in
+    place and allocate nothing, so their bytes are those of the arrays they
+    write, which shows how the memory traffic divides among the stages.
+
+    Attributes
+    ----------
+    stats : dict
+        (stage, header) -> [calls, points, seconds, bytes]. Headers are
+        labeled by projection, CRVAL, CRPIX, and the CD matrix, and a
+        checksum of the SIP coefficients if there are any, e.g., 'TAN
+        10.680000 +41.270000 crpix 256.50 240.20 cd -1.2000e-04 3.0000e-06
+        2.5000e-06 1.2000e-04'.
+
+    Methods
+    -------
+    add(stage, header, points, seconds, nbytes=0)
+        Record one call of a stage.
+    totals(by_header=False)
+        Statistics summed over headers.
+    report(by_header=False)
+        Summary table as a string.
+
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, header, points, seconds, nbytes=0):
+        with self._lock:
+            stat = self.stats.setdefault((stage, header), [0, 0, 0.0, 0])
+            stat[0] += 1
+            stat[1] += points
+            stat[2] += seconds
+            stat[3] += nbytes
+
+    def totals(self, by_header=False):
+        """Statistics per stage, summed over headers unless `by_header`.
+        Returns a dictionary of stage (or (stage, header)) -> [calls,
+        points, seconds, bytes].
+
+        """
+        if by_header:
+            return dict((key, list(stat)) for key, stat in self.stats.items())
+        totals = {}
+        for (stage, header), stat in self.stats.items():
+            total = totals.setdefault(stage, [0, 0, 0.0, 0])
+            for i, val in enumerate(stat):
+                total[i] += val
+        return totals
+
+    def report(self, by_header=False):
+        """Summary table of the statistics, one row per stage (and header
+        if `by_header`), with the throughput of each stage.
+
+        """
+        def rank(stage):
+            return (STAGES.index(stage) if stage in STAGES else len(STAGES),
+                    stage)
+
+        totals = self.totals(by_header)
+        if by_header:
+            headers = sorted(set(header for stage, header in totals))
+            groups = [(header, dict((stage, stat)
+                                    for (stage, h), stat in totals.items()
+                                    if h == header))
+                      for header in headers]
+        else:
+            groups = [(None, totals)]
+
+        fmt = '{:<14s} {:>8s} {:>12s} {:>10s} {:>12s} {:>10s}'
+        lines = [fmt.format('stage', 'calls', 'points', 'time [s]',
+                            'rate [1/s]', 'MB')]
+        for header, stats in groups:
+            if header is not None:
+                lines.append(header)
+            for stage in sorted(stats, key=rank):
+                calls, points, seconds, nbytes = stats[stage]
+                rate = points/seconds if seconds > 0 else 0
+                lines.append(fmt.format(
+                    stage, '{:d}'.format(calls), '{:d}'.format(points),
+                    '{:.4f}'.format(seconds), '{:.3e}'.format(rate),
+                    '{:.1f}'.format(nbytes/2.0**20)))
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profile():
+    """Context manager that records per-stage statistics of all
+    transformations done inside it.
+
+    Yields
+    ------
+    Profile
+        The statistics collected so far. Nested contexts collect their own
+        statistics, which are not added to those of the enclosing context.
+
+    Examples
+    --------
+    >>> with profile() as prof:
+    ...     lon, lat = pix2world(x, y, hdr)
+    >>> print(prof.report())
+
+    """
+    global _profile
+    previous, _profile = _profile, Profile()
+    try:
+        yield _profile
+    finally:
+        _profile = previous
+
+
+def _timed(stage, w, outputs, func, *args):
+    """Call `func(*args)`, recording it as `stage` of the `WCS` `w` if
+    profiling is enabled. `outputs` are the arrays written by the stage;
+    the first one sets the number of points.
+
+    """
+    prof = _profile
+    if prof is None:
+        return func(*args)
+    t0 = time.perf_counter()
+    result = func(*args)
+    prof.add(stage, w._label, np.size(outputs[0]), time.perf_counter() - t0,
+             sum(out.nbytes for out in outputs))
+    return result
+
+
+class WCS(object):
+
+    """World coordinate system transformation precomputed from a FITS
+    header.
+
+    The header is read only once: the CD matrix and its inverse, the
+    reference pixel and reference value, the projection kernels, and the
+    trigonometric terms of the native pole are all stored on the instance.
+    This makes `WCS` much cheaper than the module-level functions when the
+    same header is used for many calls. The module-level `pix2world` and
+    `world2pix` functions accept a `WCS` instance in place of a header.
+
+    The supported projections are TAN, SIN, ARC, ZEA, STG, CAR, and AIT.
 
     Parameters
     ----------
-    x, y : float or array
-        x and y pixel coordinates.
     hdr : astropy.io.fits.Header or dictionary
         A FITS header. Required keywords:
 
+        - CTYPE1, CTYPE2
         - CRPIX1, CRPIX2
+        - CRVAL1, CRVAL2
         - CD1_1, CD1_2, CD2_1, CD2_2
 
         Optional keywords:
 
-        - CUNIT1, CUNIT2: Used for converting the CD matrix into deg/pix.
-          If omitted, the CD matrix is assumed to already have units
-          deg/pix so that no conversion is necessary.
+        - CUNIT1, CUNIT2: Used for converting the CD matrix into deg/pix,
+          CRVAL1 and CRVAL2 into degrees, and celestial longitude and
+          latitude into the proper units. If omitted, everything is assumed
+          to be in degrees (deg/pix for the CD matrix).
+        - LONPOLE, LATPOLE: Native longitude of the celestial pole and
+          celestial latitude of the native pole in degrees. LONPOLE
+          defaults to 0 if CRVAL2 is at or above the native latitude of
+          the reference point (90 for zenithal projections, 0 for CAR and
+          AIT) and 180 otherwise; LATPOLE (default 90) only picks between
+          the two possible native poles of CAR and AIT.
+        - A_ORDER, A_p_q, B_ORDER, B_p_q, AP_ORDER, AP_p_q, BP_ORDER,
+          BP_p_q: SIP distortion, used if the CTYPEs end with '-SIP'; see
+          `SIP`.
+
+    Attributes
+    ----------
+    crpix : array
+        CRPIX1 and CRPIX2.
+    crval : array
+        CRVAL1 and CRVAL2 in degrees.
+    cd : array
+        2x2 CD matrix in deg/pix.
+    cdinv : array
+        Inverse of the CD matrix.
+    coordsys : str
+        Celestial coordinate system from CTYPE1.
+    projection : str
+        Projection code from CTYPE1, e.g., 'TAN'.
+    lon_p, lat_p : float
+        Celestial longitude and latitude of the native pole in radians.
+    phi_p : float
+        Native longitude of the celestial pole in radians.
+    sip : SIP or None
+        SIP distortion, applied to the pixel offsets from CRPIX.
+
+    Methods
+    -------
+    pix2proj, proj2pix, proj2natsph, natsph2proj, natsph2celsph,
+    celsph2natsph, pix2world, world2pix
+        Same as the module-level functions of the same names, but without
+        the `hdr` argument. `pix2world` and `world2pix` also accept the
+        `out`, `blocksize`, `workers`, `engine`, `dtype`, and `relative`
+        keywords.
+
+    """
+
+    def __init__(self, hdr):
+        cunit1, cunit2 = hdr.get('CUNIT1'), hdr.get('CUNIT2')
+        if cunit1 is not None:
+            pass  # Always assume degrees for now
+        if cunit2 is not None:
+            pass  # Always assume degrees for now
+
+        self.crpix = np.array([hdr['CRPIX1'], hdr['CRPIX2']], dtype=float)
+        self.crval = np.array([hdr['CRVAL1'], hdr['CRVAL2']], dtype=float)
+        self.cd = np.array([[hdr['CD1_1'], hdr['CD1_2']],
+                            [hdr['CD2_1'], hdr['CD2_2']]], dtype=float)
+        self.cdinv = np.linalg.inv(self.cd)
+
+        self.coordsys = parse_ctype(hdr['CTYPE1'])[0]
+        self.projection, self._x2s, self._s2x = _get_projection(hdr)
+        self.sip = SIP.from_header(hdr)
+        self._label = ('{:s} {:.6f} {:+.6f} crpix {:.2f} {:.2f} cd {:.4e} '
+                       '{:.4e} {:.4e} {:.4e}'.format(
+                           self.projection, *np.r_[self.crval, self.crpix,
+                                                   self.cd.ravel()]))
+        if self.sip is not None:
+            coeffs = [c for c in (self.sip.a, self.sip.b, self.sip.ap,
+                                  self.sip.bp) if c is not None]
+            self._label += ' SIP {:08x}'.format(
+                zlib.crc32(b''.join(c.tobytes() for c in coeffs)))
+
+        self.lon_p, self.lat_p, self.phi_p = _get_pole(hdr)
+        # Celestial longitude about which the results of non-zenithal
+        # projections are normalized; see `_wrap`
+        self._lon_0 = (None if _PROJECTIONS[self.projection][2] == np.pi/2
+                       else self.crval[0] * D2R)
+        self._pole = (self.lon_p, np.sin(self.lat_p), np.cos(self.lat_p),
+                      self.phi_p)
+        self._n2c_matrix = _rotation_matrix(self.phi_p, *self._pole[1:3])
+        self._c2n_matrix = _rotation_matrix(self.lon_p, *self._pole[1:3])
+
+        # CRVAL in radians, and the CD matrix in rad/pix and its inverse in
+        # pix/rad for the fused transforms
+        self._crval_rad = self.crval * D2R
+        self._cd_rad = self.cd * D2R
+        self._cdinv_rad = self.cdinv * R2D
+
+        # Single precision constants for the float32 transformations
+        f4 = np.float32
+        self._consts32 = {
+            'cd': self._cd_rad.astype(f4), 'cdinv': self._cdinv_rad.astype(f4),
+            'sin_lat_p': f4(self._pole[1]), 'cos_lat_p': f4(self._pole[2]),
+            'D2R': f4(D2R), 'R2D': f4(R2D),
+            }
+
+    def pix2proj(self, x, y):
+        dx, dy = x - self.crpix[0], y - self.crpix[1]
+        if self.sip is not None:
+            dx, dy = self.sip.distort(dx, dy)
+        xp = self.cd[0, 0]*dx + self.cd[0, 1]*dy
+        yp = self.cd[1, 0]*dx + self.cd[1, 1]*dy
+        return xp, yp
+
+    def proj2pix(self, xp, yp):
+        dx = self.cdinv[0, 0]*xp + self.cdinv[0, 1]*yp
+        dy = self.cdinv[1, 0]*xp + self.cdinv[1, 1]*yp
+        if self.sip is not None:
+            dx, dy = self.sip.undistort(dx, dy)
+        return dx + self.crpix[0], dy + self.crpix[1]
+
+    def proj2natsph(self, xp, yp):
+        a, b, s1, s2 = _work_arrays(xp, yp, D2R, 2)
+        self._x2s(a, b, s1, s2)
+        return a[()] * R2D, b[()] * R2D
+
+    def natsph2proj(self, phi, theta):
+        a, b, s1, s2 = _work_arrays(phi, theta, D2R, 2)
+        self._s2x(a, b, s1, s2)
+        return a[()] * R2D, b[()] * R2D
+
+    def natsph2celsph(self, phi, theta):
+        a, b, s1, s2, s3 = _work_arrays(phi, theta, D2R, 3)
+        _natsph2celsph(a, b, *(self._pole + (s1, s2, s3)))
+        if self._lon_0 is not None:
+            _wrap(a, self._lon_0)
+        return a[()] * R2D, b[()] * R2D
+
+    def celsph2natsph(self, lon, lat):
+        a, b, s1, s2, s3 = _work_arrays(lon, lat, D2R, 3)
+        _celsph2natsph(a, b, *(self._pole + (s1, s2, s3)))
+        return a[()] * R2D, b[()] * R2D
+
+    def _n2c(self, a, b, s1, s2, s3, s4, engine):
+        """Native -> celestial rotation in radians with the given engine."""
+        if engine == 'matrix':
+            _rotate_matrix(a, b, self._n2c_matrix, self.lon_p, s1, s2, s3, s4)
+        else:
+            _natsph2celsph(a, b, *(self._pole + (s1, s2, s3)))
+        if self._lon_0 is not None:
+            _wrap(a, self._lon_0)
+
+    def _c2n(self, a, b, s1, s2, s3, s4, engine):
+        """Celestial -> native rotation in radians with the given engine."""
+        if engine == 'matrix':
+            _rotate_matrix(a, b, self._c2n_matrix, self.phi_p, s1, s2, s3, s4)
+        else:
+            _celsph2natsph(a, b, *(self._pole + (s1, s2, s3)))
+
+    def _pix2proj_block(self, x, y, a, b, s1, s2, s3, relative=False):
+        """Pixel -> projection plane (radians) stage of a single block."""
+        cd = self._cd_rad
+        x0, y0 = (0.0, 0.0) if relative else self.crpix
+        np.subtract(x, x0, out=s1)
+        np.subtract(y, y0, out=s2)
+        if self.sip is not None:
+            self.sip._distortion(s1, s2, a, b, s3)
+            np.add(s1, a, out=s1)
+            np.add(s2, b, out=s2)
+        np.multiply(s1, cd[0, 0], out=a)
+        np.multiply(s2, cd[0, 1], out=s3)
+        np.add(a, s3, out=a)
+        np.multiply(s1, cd[1, 0], out=b)
+        np.multiply(s2, cd[1, 1], out=s3)
+        np.add(b, s3, out=b)
+
+    def _proj2pix_block(self, a, b, x, y, s1, s2, relative=False):
+        """Projection plane (radians) -> pixel stage of a single block. `a`
+        and `b` are overwritten.
+
+        """
+        cdinv = self._cdinv_rad
+        x0, y0 = (0.0, 0.0) if relative else self.crpix
+        np.multiply(a, cdinv[0, 0], out=s1)
+        np.multiply(b, cdinv[0, 1], out=s2)
+        np.add(s1, s2, out=s1)
+        np.multiply(a, cdinv[1, 0], out=s2)
+        np.multiply(b, cdinv[1, 1], out=a)
+        np.add(s2, a, out=s2)
+        if self.sip is not None:
+            self.sip._undistort_block(s1, s2, a, b)
+            s1, s2 = a, b
+        np.add(s1, x0, out=x)
+        np.add(s2, y0, out=y)
+
+    def _pix2sph(self, x, y, a, b, s1, s2, s3, s4, engine='trig',
+                 relative=False):
+        """Fused pixel -> celestial transformation of a single block. The
+        result is stored in `a` and `b` in radians; `s1`, `s2`, `s3`, and
+        `s4` are scratch. If `relative`, `x` and `y` are offsets from CRPIX
+        and the results are offsets from CRVAL.
+
+        """
+        _timed('pix2proj', self, (a, b), self._pix2proj_block, x, y, a, b, s1,
+               s2, s3, relative)
+        _timed('proj2natsph', self, (a, b), self._x2s, a, b, s1, s2)
+        _timed('natsph2celsph', self, (a, b), self._n2c, a, b, s1, s2, s3, s4,
+               engine)
+        if relative:
+            np.subtract(a, self._crval_rad[0], out=a)
+            np.subtract(b, self._crval_rad[1], out=b)
+
+    def _sph2pix(self, a, b, x, y, s1, s2, s3, s4, engine='trig',
+                 relative=False):
+        """Fused celestial -> pixel transformation of a single block. The
+        input `a` and `b` are in radians and are overwritten; `s1`, `s2`,
+        `s3`, and `s4` are scratch. If `relative`, `a` and `b` are offsets
+        from CRVAL and the results are offsets from CRPIX.
+
+        """
+        if relative:
+            np.add(a, self._crval_rad[0], out=a)
+            np.add(b, self._crval_rad[1], out=b)
+        _timed('celsph2natsph', self, (a, b), self._c2n, a, b, s1, s2, s3, s4,
+               engine)
+        _timed('natsph2proj', self, (a, b), self._s2x, a, b, s1, s2)
+        _timed('proj2pix', self, (x, y), self._proj2pix_block, a, b, x, y, s1,
+               s2, relative)
+
+    def _pix2world_block(self, x, y, lon, lat, a, b, s1, s2, s3, s4,
+                         engine='trig', relative=False):
+        """Fused pixel -> world transformation of a single block, using
+        `a`, `b`, `s1`, `s2`, `s3`, and `s4` as scratch.
+
+        """
+        self._pix2sph(x, y, a, b, s1, s2, s3, s4, engine, relative)
+        np.multiply(a, R2D, out=lon)
+        np.multiply(b, R2D, out=lat)
+
+    def _world2pix_block(self, lon, lat, x, y, a, b, s1, s2, s3, s4,
+                         engine='trig', relative=False):
+        """Fused world -> pixel transformation of a single block, using
+        `a`, `b`, `s1`, `s2`, `s3`, and `s4` as scratch.
+
+        """
+        np.multiply(lon, D2R, out=a)
+        np.multiply(lat, D2R, out=b)
+        self._sph2pix(a, b, x, y, s1, s2, s3, s4, engine, relative)
+
+    def _pix2world_block32(self, x, y, lon, lat, a, b, s1, s2, s3, s4,
+                           engine='trig', relative=False):
+        """Single precision TAN pixel -> world transformation of a single
+        block.
+
+        The gnomonic projection is inverted in terms of the offsets from the
+        reference point, (dlon, dlat), with every intermediate quantity
+        either of order unity or proportional to the projection plane
+        offsets, so that single precision arithmetic keeps a small relative
+        error. `engine` is ignored.
+
+        """
+        c = self._consts32
+        cd, sin_lat_p, cos_lat_p = c['cd'], c['sin_lat_p'], c['cos_lat_p']
+        x0, y0 = (0, 0) if relative else self.crpix
+        np.subtract(x, x0, out=s1, dtype=np.float64)
+        np.subtract(y, y0, out=s2, dtype=np.float64)
+        np.multiply(s1, cd[0, 0], out=a)
+        np.multiply(s2, cd[0, 1], out=s3)
+        np.add(a, s3, out=a)  # xp
+        np.multiply(s1, cd[1, 0], out=b)
+        np.multiply(s2, cd[1, 1], out=s3)
+        np.add(b, s3, out=b)  # yp
+
+        # dlon = arctan2(xp, E), E = cos(lat_p) - yp*sin(lat_p)
+        np.multiply(b, -sin_lat_p, out=s1)
+        np.add(s1, cos_lat_p, out=s1)  # E
+        np.hypot(a, s1, out=s2)  # D = cos(lat) up to a common factor
+        np.arctan2(a, s1, out=s3)  # dlon
+
+        # dlat = arctan2(yp - sin(lat_p)*(D - E), D*cos(lat_p) +
+        #                (sin(lat_p) + yp*cos(lat_p))*sin(lat_p)),
+        # where D - E = xp**2/(D + E) avoids cancellation for E > 0. E < 0
+        # only in fields containing the pole, where D + E cancels instead.
+        np.subtract(s2, s1, out=s4)  # D - E
+        np.add(s1, s2, out=s1)  # D + E
+        np.multiply(a, a, out=a)
+        np.divide(a, s1, out=s4, where=s1 > s4)
+        np.multiply(s4, -sin_lat_p, out=a)
+        np.add(a, b, out=a)  # numerator
+        np.multiply(b, cos_lat_p*sin_lat_p, out=b)
+        np.add(b, sin_lat_p*sin_lat_p, out=b)
+        np.multiply(s2, cos_lat_p, out=s2)
+        np.add(b, s2, out=b)  # denominator
+        np.arctan2(a, b, out=b)  # dlat
+
+        np.multiply(s3, c['R2D'], out=lon)
+        np.multiply(b, c['R2D'], out=lat)
+        if not relative:
+            # Add CRVAL in double precision so the result is rounded once
+            np.add(lon, self.crval[0], out=lon, dtype=np.float64)
+            np.add(lat, self.crval[1], out=lat, dtype=np.float64)
+
+    def _world2pix_block32(self, lon, lat, x, y, a, b, s1, s2, s3, s4,
+                           engine='trig', relative=False):
+        """Single precision TAN world -> pixel transformation of a single
+        block; see `_pix2world_block32`. `engine` is ignored.
+
+        """
+        c = self._consts32
+        cdinv, sin_lat_p, cos_lat_p = (c['cdinv'], c['sin_lat_p'],
+                                       c['cos_lat_p'])
+        lon0, lat0 = (0, 0) if relative else self.crval
+        np.subtract(lon, lon0, out=a, dtype=np.float64)
+        np.divide(a, 360, out=s1)  # wrap without adding 180 (cancellation)
+        np.rint(s1, out=s1)
+        np.multiply(s1, 360, out=s1)
+        np.subtract(a, s1, out=a)
+        np.multiply(a, c['D2R'], out=a)  # dlon
+        np.subtract(lat, lat0, out=b, dtype=np.float64)
+        np.multiply(b, c['D2R'], out=b)  # dlat
+
+        # cos(lat) = cos(lat_p)*cos(dlat) - sin(lat_p)*sin(dlat)
+        np.sin(b, out=s1)
+        np.cos(b, out=s2)
+        np.multiply(s2, cos_lat_p, out=s3)
+        np.multiply(s1, sin_lat_p, out=s4)
+        np.subtract(s3, s4, out=s3)  # cos(lat)
+
+        # 2*sin(dlon/2)**2 = 1 - cos(dlon)
+        np.multiply(a, 0.5, out=s4)
+        np.sin(s4, out=s4)
+        np.multiply(s4, s4, out=s4)
+        np.multiply(s4, 2, out=s4)
+        np.sin(a, out=a)
+        np.multiply(a, s3, out=a)  # cos(lat)*sin(dlon)
+        np.multiply(s4, s3, out=s3)  # cos(lat)*(1 - cos(dlon))
+
+        # yp*cos(c) = sin(dlat) + cos(lat)*sin(lat_p)*(1 - cos(dlon))
+        # cos(c) = cos(dlat) - cos(lat)*cos(lat_p)*(1 - cos(dlon))
+        np.multiply(s3, sin_lat_p, out=b)
+        np.add(b, s1, out=b)
+        np.multiply(s3, cos_lat_p, out=s3)
+        np.subtract(s2, s3, out=s2)  # cos(c)
+        np.divide(a, s2, out=a)  # xp
+        np.divide(b, s2, out=b)  # yp
+
+        # Add CRPIX in double precision so the result is rounded once
+        x0, y0 = (0, 0) if relative else self.crpix
+        np.multiply(a, cdinv[0, 0], out=s1)
+        np.multiply(b, cdinv[0, 1], out=s2)
+        np.add(s1, s2, out=s1)
+        np.add(s1, x0, out=x, dtype=np.float64)
+        np.multiply(a, cdinv[1, 0], out=s1)
+        np.multiply(b, cdinv[1, 1], out=s2)
+        np.add(s1, s2, out=s1)
+        np.add(s1, y0, out=y, dtype=np.float64)
+
+    def _transform(self, block_func, u, v, out, blocksize, workers,
+                   engine='trig', dtype=None, relative=False,
+                   block_func32=None):
+        """Apply a fused block transformation to all of `u` and `v`,
+        optionally splitting the work across a pool of `workers` threads.
+        `block_func32` is the single precision version of `block_func`, if
+        there is one.
+
+        """
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine: {:s}'.format(engine))
+        if blocksize is None:
+            blocksize = BLOCKSIZE
+        prof, t0 = _profile, time.perf_counter()
+
+        dtype = _result_dtype(u, v, out, dtype)
+        compute_dtype = dtype
+        if dtype == np.float32:
+            # The single precision kernels assume the default native pole
+            if (block_func32 is not None and self.sip is None and
+                    self.projection in _FLOAT32_PROJECTIONS and
+                    self.phi_p == np.pi):
+                block_func = block_func32
+            else:
+                # Single precision I/O, double precision arithmetic
+                compute_dtype = np.dtype(np.float64)
+
+        def run(it):
+            scratch = np.empty((6, blocksize), dtype=compute_dtype)
+            for ub, vb, pb, qb in it:
+                n = len(ub)
+                block_func(ub, vb, pb, qb, *scratch[:, :n], engine=engine,
+                           relative=relative)
+
+        def run_range(iterrange):
+            sub = it.copy()
+            sub.iterrange = iterrange
+            with sub:
+                run(sub)
+
+        it = _blocks(u, v, out, blocksize, dtype=compute_dtype,
+                     out_dtype=dtype)
+        with it:
+            p, q = it.operands[2], it.operands[3]
+            ranges = _split_range(it.itersize, blocksize, workers)
+            if len(ranges) > 1:
+                pool = ThreadPool(workers)
+                try:
+                    pool.map(run_range, ranges)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                run(it)
+
+        if prof is not None:
+            nbytes = 6 * blocksize * compute_dtype.itemsize * len(ranges)
+            if out is None:
+                nbytes += p.nbytes + q.nbytes
+            prof.add('transform', self._label, p.size,
+                     time.perf_counter() - t0, nbytes)
+        if out is None:
+            return p[()], q[()]
+        return out
+
+    def pix2world(self, x, y, out=None, blocksize=None, workers=None,
+                  engine='trig', dtype=None, relative=False):
+        return self._transform(self._pix2world_block, x, y, out, blocksize,
+                               workers, engine, dtype, relative,
+                               block_func32=self._pix2world_block32)
+
+    def world2pix(self, lon, lat, out=None, blocksize=None, workers=None,
+                  engine='trig', dtype=None, relative=False):
+        return self._transform(self._world2pix_block, lon, lat, out,
+                               blocksize, workers, engine, dtype, relative,
+                               block_func32=self._world2pix_block32)
+
+
+class WCSStack(object):
+
+    """Stack of world coordinate systems for transforming points against
+    many headers in one vectorized call.
+
+    The reference pixels, CD matrices, and reference values of all headers
+    are stored in arrays, and each point is transformed with the parameters
+    of the header selected by its index. All headers must use the same
+    projection.
+
+    Parameters
+    ----------
+    crpix : array
+        (n, 2) array of CRPIX1 and CRPIX2 values.
+    cd : array
+        (n, 2, 2) array of CD matrices in deg/pix.
+    crval : array
+        (n, 2) array of CRVAL1 and CRVAL2 values in degrees.
+    projection : str, optional
+        Projection code shared by all headers. Default is 'TAN'.
+    lonpole, latpole : float or array, optional
+        LONPOLE and LATPOLE values in degrees for all or each of the
+        headers. Default is None, the projection's default; see `WCS`.
+
+    Attributes
+    ----------
+    crpix, cd, crval, projection
+        See Parameters.
+    cdinv : array
+        (n, 2, 2) array of the inverse CD matrices.
+
+    Methods
+    -------
+    from_headers
+        Class method. Create a `WCSStack` from a sequence of headers or
+        `WCS` instances.
+    pix2world, world2pix
+        Same as the module-level functions, except that `hdr` is replaced
+        by `index`, an array of header indices that broadcasts against the
+        coordinates.
+    world2proj(lon, lat, index)
+        Projection plane coordinates (xp, yp) in degrees of celestial
+        coordinates, i.e., `world2pix` without the CD matrix and CRPIX.
+
+    """
+
+    def __init__(self, crpix, cd, crval, projection='TAN', lonpole=None,
+                 latpole=None):
+        self.crpix = np.array(crpix, dtype=float).reshape(-1, 2)
+        self.cd = np.array(cd, dtype=float).reshape(-1, 2, 2)
+        self.crval = np.array(crval, dtype=float).reshape(-1, 2)
+        self.cdinv = np.linalg.inv(self.cd)
+        if not len(self.crpix) == len(self.cd) == len(self.crval):
+            raise ValueError('crpix, cd, and crval must have the same length')
+
+        self.projection = projection
+        try:
+            self._x2s, self._s2x, theta_0 = _PROJECTIONS[projection]
+        except KeyError:
+            raise ValueError('Unsupported projection: {:s}'.format(projection))
+
+        lon_p, lat_p, phi_p = _native_pole(
+            self.crval[:, 0] * D2R, self.crval[:, 1] * D2R, theta_0,
+            None if lonpole is None else np.asarray(lonpole) * D2R,
+            None if latpole is None else np.asarray(latpole) * D2R)
+        lon_p, lat_p, phi_p = (np.broadcast_to(p, len(self))
+                               for p in (lon_p, lat_p, phi_p))
+        self._pole = (lon_p, np.sin(lat_p), np.cos(lat_p), phi_p)
+        self._lon_0 = None if theta_0 == np.pi/2 else self.crval[:, 0] * D2R
+        self._cd_rad = self.cd * D2R
+        self._cdinv_rad = self.cdinv * R2D
+
+    @classmethod
+    def from_headers(cls, hdrs):
+        wcs_list = [_get_wcs(hdr) for hdr in hdrs]
+        projections = set(w.projection for w in wcs_list)
+        if len(projections) != 1:
+            raise ValueError('All headers must have the same projection')
+        if any(w.sip is not None for w in wcs_list):
+            raise ValueError('SIP distortion is not supported by WCSStack')
+        # The native pole latitude of each header is its own best LATPOLE
+        return cls([w.crpix for w in wcs_list], [w.cd for w in wcs_list],
+                   [w.crval for w in wcs_list], projection=projections.pop(),
+                   lonpole=[w.phi_p * R2D for w in wcs_list],
+                   latpole=[w.lat_p * R2D for w in wcs_list])
+
+    def __len__(self):
+        return len(self.crpix)
+
+    def _pix2world_block(self, i, x, y, lon, lat, a, b, s1, s2, s3, s4):
+        cd = self._cd_rad[i]
+        np.subtract(x, self.crpix[i, 0], out=s1)
+        np.subtract(y, self.crpix[i, 1], out=s2)
+        np.multiply(s1, cd[:, 0, 0], out=a)
+        np.multiply(s2, cd[:, 0, 1], out=s3)
+        np.add(a, s3, out=a)
+        np.multiply(s1, cd[:, 1, 0], out=b)
+        np.multiply(s2, cd[:, 1, 1], out=s3)
+        np.add(b, s3, out=b)
+        self._x2s(a, b, s1, s2)
+        pole = tuple(p[i] for p in self._pole)
+        _natsph2celsph(a, b, *(pole + (s1, s2, s3)))
+        if self._lon_0 is not None:
+            _wrap(a, self._lon_0[i])
+        np.multiply(a, R2D, out=lon)
+        np.multiply(b, R2D, out=lat)
+
+    def _world2proj_block(self, i, lon, lat, xp, yp, a, b, s1, s2, s3, s4):
+        np.multiply(lon, D2R, out=a)
+        np.multiply(lat, D2R, out=b)
+        pole = tuple(p[i] for p in self._pole)
+        _celsph2natsph(a, b, *(pole + (s1, s2, s3)))
+        self._s2x(a, b, s1, s2)
+        np.multiply(a, R2D, out=xp)
+        np.multiply(b, R2D, out=yp)
+
+    def _world2pix_block(self, i, lon, lat, x, y, a, b, s1, s2, s3, s4):
+        cdinv = self._cdinv_rad[i]
+        np.multiply(lon, D2R, out=a)
+        np.multiply(lat, D2R, out=b)
+        pole = tuple(p[i] for p in self._pole)
+        _celsph2natsph(a, b, *(pole + (s1, s2, s3)))
+        self._s2x(a, b, s1, s2)
+        np.multiply(a, cdinv[:, 0, 0], out=s1)
+        np.multiply(b, cdinv[:, 0, 1], out=s2)
+        np.add(s1, s2, out=s1)
+        np.add(s1, self.crpix[i, 0], out=x)
+        np.multiply(a, cdinv[:, 1, 0], out=s1)
+        np.multiply(b, cdinv[:, 1, 1], out=s2)
+        np.add(s1, s2, out=s1)
+        np.add(s1, self.crpix[i, 1], out=y)
+
+    def _transform(self, block_func, u, v, index, blocksize):
+        if blocksize is None:
+            blocksize = BLOCKSIZE
+        u, v, index = np.broadcast_arrays(u, v, index)
+        shape = u.shape
+        u, v, index = u.ravel(), v.ravel(), index.ravel()
+        if len(index) and (index.min() < 0 or index.max() >= len(self)):
+            raise IndexError('header index out of range')
+        p, q = np.empty(shape), np.empty(shape)
+        pflat, qflat = p.reshape(-1), q.reshape(-1)
+        scratch = np.empty((6, blocksize))
+        for j in range(0, len(u), blocksize):
+            k = min(j+blocksize, len(u))
+            block_func(index[j:k], u[j:k], v[j:k], pflat[j:k], qflat[j:k],
+                       *scratch[:, :k-j])
+        return p[()], q[()]
+
+    def pix2world(self, x, y, index, blocksize=None):
+        return self._transform(self._pix2world_block, x, y, index, blocksize)
+
+    def world2pix(self, lon, lat, index, blocksize=None):
+        return self._transform(self._world2pix_block, lon, lat, index,
+                               blocksize)
+
+    def world2proj(self, lon, lat, index, blocksize=None):
+        return self._transform(self._world2proj_block, lon, lat, index,
+                               blocksize)
+
+
+def _split_range(n, blocksize, workers):
+    """Split `n` points into ranges of whole blocks for `workers` threads.
+
+    A few ranges are made per worker so that the load stays balanced if
+    some ranges finish early. Returns a single range if `workers` is None
+    or 1, or if there is less than one block per worker.
+
+    """
+    if not workers or workers <= 1 or n < 2*blocksize:
+        return [(0, n)]
+    nblocks = -(-n // blocksize)
+    step = max(1, nblocks // (4*workers)) * blocksize
+    return [(i, min(i+step, n)) for i in range(0, n, step)]
+
+
+def _get_wcs(hdr):
+    """Return `hdr` if it is already a `WCS` instance, otherwise build one
+    from it.
+
+    """
+    if isinstance(hdr, WCS):
+        return hdr
+    prof, t0 = _profile, time.perf_counter()
+    w = WCS(hdr)
+    if prof is not None:
+        prof.add('header', w._label, 0, time.perf_counter() - t0)
+    return w
+
+
+def pix2proj(x, y, hdr):
+    """Convert pixel coordinates into projection plane coordinates
+    according to Eq. 3 in Greisen & Calabretta (2002).
+
+    Parameters
+    ----------
+    x, y : float or array
+        x and y pixel coordinates.
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+        Pass a `WCS` instance when calling this repeatedly with the same
+        header to avoid parsing it each time.
 
     Returns
     -------
     float or array
         x and y projection plane coordinates in degrees.
 
-    """
-    cunit1, cunit2 = hdr.get('CUNIT1'), hdr.get('CUNIT2')
-    if cunit1 is not None:
-        pass  # Always assume degrees for now
-    if cunit2 is not None:
-        pass  # Always assume degrees for now
-
-    # (G&C02 eq.3/pg.1063/pdf.3)
-    xp = hdr['CD1_1']*(x-hdr['CRPIX1']) + hdr['CD1_2']*(y-hdr['CRPIX2'])
-    yp = hdr['CD2_1']*(x-hdr['CRPIX1']) + hdr['CD2_2']*(y-hdr['CRPIX2'])
+    Notes
+    -----
+    SIP distortion is applied to the pixel offsets from CRPIX if CTYPE1
+    ends with '-SIP'; see `SIP`.
 
-    return xp, yp
+    """
+    return _get_wcs(hdr).pix2proj(x, y)
 
 
 def proj2pix(xp, yp, hdr):
@@ -58,36 +1559,23 @@ def proj2pix(xp, yp, hdr):
     ----------
     xp, yp : float or array
         x and y projection plane coordinates in degrees.
-    hdr : astropy.io.fits.Header or dictionary
-        A FITS header. Required keywords:
-
-        - CRPIX1, CRPIX2
-        - CD1_1, CD1_2, CD2_1, CD2_2
-
-        Optional keywords:
-
-        - CUNIT1, CUNIT2: Used for converting the CD matrix into deg/pix.
-          If omitted, the CD matrix is assumed to already have units
-          deg/pix so that no conversion is necessary.
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+        Pass a `WCS` instance when calling this repeatedly with the same
+        header to avoid parsing it each time.
 
     Returns
     -------
     float or array
         x and y pixel coordinates.
 
-    """
-    cunit1, cunit2 = hdr.get('CUNIT1'), hdr.get('CUNIT2')
-    if cunit1 is not None:
-        pass  # Always assume degrees for now
-    if cunit2 is not None:
-        pass  # Always assume degrees for now
-
-    # (G&C02 eq.3/pg.1063/pdf.3)
-    c = hdr['CD1_1']*hdr['CD2_2'] - hdr['CD1_2']*hdr['CD2_1']
-    x = (hdr['CD2_2']*xp - hdr['CD1_2']*yp) / c + hdr['CRPIX1']
-    y = (-hdr['CD2_1']*xp + hdr['CD1_1']*yp) / c + hdr['CRPIX2']
+    Notes
+    -----
+    SIP distortion is removed from the pixel offsets from CRPIX if CTYPE1
+    ends with '-SIP'; see `SIP`.
 
-    return x, y
+    """
+    return _get_wcs(hdr).proj2pix(xp, yp)
 
 
 def proj2natsph(xp, yp, hdr):
@@ -99,10 +1587,10 @@ def proj2natsph(xp, yp, hdr):
     ----------
     xp, yp : float or array
         x and y projection plane coordinates in degrees.
-    hdr : astropy.io.fits.Header or dictionary
-        A FITS header. Required keywords:
-
-        - CTYPE1, CTYPE2
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+        Pass a `WCS` instance when calling this repeatedly with the same
+        header to avoid parsing it each time.
 
     Returns
     -------
@@ -111,27 +1599,7 @@ def proj2natsph(xp, yp, hdr):
         for the projection specified by CTYPE1 and CTYPE2.
 
     """
-    # Degrees to radians
-    xp = xp * np.pi/180
-    yp = yp * np.pi/180
-
-    projection1 = parse_ctype(hdr['CTYPE1'])[1]
-    projection2 = parse_ctype(hdr['CTYPE2'])[1]
-    projection = projection1  # Always assume projection1 and projection2 are the same?
-
-    if projection == 'TAN':
-        phi = np.arctan2(xp, -yp)  # (C&G02 eq.14/pg.1085/pdf.9)
-        r = np.sqrt(xp**2 + yp**2)  # (C&G02 eq.15/pg.1085/pdf.9)
-        theta = np.arctan(1/r)  # (C&G02 eq.55/pg.1088/pdf.12)
-    else:
-        # Raise an error?
-        phi, theta = None, None
-
-    # Radians to degrees
-    phi *= 180/np.pi
-    theta *= 180/np.pi
-
-    return phi, theta
+    return _get_wcs(hdr).proj2natsph(xp, yp)
 
 
 def natsph2proj(phi, theta, hdr):
@@ -144,10 +1612,10 @@ def natsph2proj(phi, theta, hdr):
     phi, theta : float or array
         Native spherical longitude (phi) and latitude (theta) in degrees
         for the projection specified by CTYPE1 and CTYPE2.
-    hdr : astropy.io.fits.Header or dictionary
-        A FITS header. Required keywords:
-
-        - CTYPE1, CTYPE2
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+        Pass a `WCS` instance when calling this repeatedly with the same
+        header to avoid parsing it each time.
 
     Returns
     -------
@@ -155,27 +1623,7 @@ def natsph2proj(phi, theta, hdr):
         x and y projection plane coordinates in degrees.
 
     """
-    # Degrees to radians
-    phi = phi * np.pi/180
-    theta = theta * np.pi/180
-
-    projection1 = parse_ctype(hdr['CTYPE1'])[1]
-    projection2 = parse_ctype(hdr['CTYPE2'])[1]
-    projection = projection1  # Always assume projection1 and projection2 are the same?
-
-    if projection == 'TAN':
-        r = 1/np.tan(theta)  # (C&G02 eq.54/pg.1088/pdf.12)
-        xp = r*np.sin(phi)  # (C&G02 eq.12/pg.1085/pdf.9)
-        yp = -r*np.cos(phi)  # (C&G02 eq.13/pg.1085/pdf.9)
-    else:
-        # Raise and error?
-        xp, yp = None, None
-
-    # Radians to degrees
-    xp *= 180/np.pi
-    yp *= 180/np.pi
-
-    return xp, yp
+    return _get_wcs(hdr).natsph2proj(phi, theta)
 
 
 def natsph2celsph(phi, theta, hdr):
@@ -188,18 +1636,10 @@ def natsph2celsph(phi, theta, hdr):
     phi, theta : float or array
         Native spherical longitude (phi) and latitude (theta) in degrees
         for the projection specified by CTYPE1 and CTYPE2.
-    hdr : astropy.io.fits.Header or dictionary
-        A FITS header. Required keywords:
-
-        - CTYPE1, CTYPE2
-        - CRVAL1, CRVAL2
-
-        Optional keywords:
-
-        - CUNIT1, CUNIT2: Used for converting CRVAL1 and CRVAL2 into
-          degrees and converting celestial longitude and latitude into the
-          proper units. If omitted, the everything is assumed to be in
-          degrees.
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+        Pass a `WCS` instance when calling this repeatedly with the same
+        header to avoid parsing it each time.
 
     Returns
     -------
@@ -208,41 +1648,7 @@ def natsph2celsph(phi, theta, hdr):
         celestial coordinate system specified by CTYPE1 and CTYPE2.
 
     """
-    cunit1, cunit2 = hdr.get('CUNIT1'), hdr.get('CUNIT2')
-    if cunit1 is not None:
-        pass  # Always assume CRVAL1 and longitude are in degrees for now
-    if cunit2 is not None:
-        pass  # Always assume CRVAL2 and latitude are in degrees for now
-
-    # Degrees to radians
-    phi = phi * np.pi/180
-    theta = theta * np.pi/180
-
-    coordsys1, projection1 = parse_ctype(hdr['CTYPE1'])
-    coordsys2, projection2 = parse_ctype(hdr['CTYPE2'])
-    projection = projection1  # Always assume projection1 and projection2 are the same?
-
-    if projection == 'TAN':
-        lon_p = hdr['CRVAL1'] * np.pi/180
-        lat_p = hdr['CRVAL2'] * np.pi/180
-        phi_p = 180.0 * np.pi/180
-    else:
-        # Raise an error?
-        lon_p, lat_p, phi_p = None, None, None
-
-    # (C&G02 eq.2/pg.1079/pdf.3)
-    dphi = phi - phi_p
-    lon = lon_p + np.arctan2(-np.cos(theta) * np.sin(dphi),
-                             np.sin(theta) * np.cos(lat_p) -
-                             np.cos(theta) * np.sin(lat_p) * np.cos(dphi))
-    lat = np.arcsin(np.sin(theta) * np.sin(lat_p) +
-                    np.cos(theta) * np.cos(lat_p) * np.cos(dphi))
-
-    # Radians to degrees
-    lon *= 180/np.pi
-    lat *= 180/np.pi
-
-    return (lon, lat)
+    return _get_wcs(hdr).natsph2celsph(phi, theta)
 
 
 def celsph2natsph(lon, lat, hdr):
@@ -255,17 +1661,10 @@ def celsph2natsph(lon, lat, hdr):
     lon, lat : float or array
         Celestial spherical longitude (lon) and latitude (lat) for the
         celestial coordinate system specified by CTYPE1 and CTYPE2.
-    hdr : astropy.io.fits.Header or dictionary
-        A FITS header. Required keywords:
-
-        - CTYPE1, CTYPE2
-        - CRVAL1, CRVAL2
-
-        Optional keywords:
-
-        - CUNIT1, CUNIT2: Used for converting CRVAL1, CRVAL2, and celestial
-          longitude and latitude into degrees. If omitted, the everything
-          is assumed to be in degrees.
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+        Pass a `WCS` instance when calling this repeatedly with the same
+        header to avoid parsing it each time.
 
     Returns
     -------
@@ -274,44 +1673,11 @@ def celsph2natsph(lon, lat, hdr):
         for the projection specified by CTYPE1 and CTYPE2.
 
     """
-    cunit1, cunit2 = hdr.get('CUNIT1'), hdr.get('CUNIT2')
-    if cunit1 is not None:
-        pass  # Always assume CRVAL1 and longitude are in degrees for now
-    if cunit2 is not None:
-        pass  # Always assume CRVAL2 and latitude are in degrees for now
-
-    # Degrees to radians
-    lon = lon * np.pi/180
-    lat = lat * np.pi/180
-
-    coordsys1, projection1 = parse_ctype(hdr['CTYPE1'])
-    coordsys2, projection2 = parse_ctype(hdr['CTYPE2'])
-    projection = projection1  # Always assume projection1 and projection2 are the same?
+    return _get_wcs(hdr).celsph2natsph(lon, lat)
 
-    if projection == 'TAN':
-        lon_p = hdr['CRVAL1'] * np.pi/180
-        lat_p = hdr['CRVAL2'] * np.pi/180
-        phi_p = 180.0 * np.pi/180
-    else:
-        # Raise an error?
-        lon_p, lat_p, phi_p = None, None, None
 
-    # (C&G02 eq.5/pg.1080/pdf.4)
-    dlon = lon - lon_p
-    phi = phi_p + np.arctan2(-np.cos(lat) * np.sin(dlon),
-                             np.sin(lat) * np.cos(lat_p) -
-                             np.cos(lat) * np.sin(lat_p) * np.cos(dlon))
-    theta = np.arcsin(np.sin(lat) * np.sin(lat_p) +
-                      np.cos(lat) * np.cos(lat_p) * np.cos(dlon))
-
-    # Radians to degrees
-    phi *= 180/np.pi
-    theta *= 180/np.pi
-
-    return phi, theta
-
-
-def pix2world(x, y, hdr):
+def pix2world(x, y, hdr, out=None, blocksize=None, workers=None,
+              engine='trig', dtype=None, relative=False):
     """Convert pixel coordinates into celestial coordinates accoring to
     Calabretta & Greisen (2002).
 
@@ -322,8 +1688,8 @@ def pix2world(x, y, hdr):
     ----------
     x, y : float or array
         x and y pixel coordinates.
-    hdr : astropy.io.fits.Header or dictionary
-        A FITS header. Required keywords:
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance. Required keywords:
 
         - CTYPE1, CTYPE2
         - CRPIX1, CRPIX2
@@ -336,21 +1702,75 @@ def pix2world(x, y, hdr):
           CRVAL1 and CRVAL2 into degrees, and celestial longitude and
           latitude into the proper units. If omitted, everything is assumed
           to be in degrees (deg/pix for the CD matrix).
+        - LONPOLE, LATPOLE: Native longitude of the celestial pole and
+          celestial latitude of the native pole in degrees; see `WCS`.
+    out : tuple of arrays, optional
+        Arrays (lon, lat) in which to store the result, e.g., two columns
+        of a structured array. They must have the broadcast shape of `x`
+        and `y`. If None (default), new arrays are allocated.
+    blocksize : int, optional
+        Number of points transformed at a time. Default is `BLOCKSIZE`.
+    workers : int, optional
+        Number of threads to split the blocks across. The NumPy ufuncs
+        used by the transformation release the GIL, so this scales with
+        the number of cores for large inputs. Default is None (no threads).
+    engine : {'trig', 'matrix'}, optional
+        Formulation of the rotation between native and celestial spherical
+        coordinates. 'trig' (default) evaluates Eqs. 2 and 5 of Calabretta &
+        Greisen (2002) directly. 'matrix' converts to Cartesian unit
+        vectors and applies a precomputed 3x3 rotation matrix. It takes
+        about the same time for `pix2world` and up to ~1.4 times as long
+        for `world2pix`, but it avoids the loss of precision of arcsin near
+        the poles, including the native pole at the reference point of
+        zenithal projections. The difference only matters for fine pixel
+        scales: for a 4096x4096 TAN image, pix2world/world2pix round trips
+        agree to ~1e-6 ('trig') and ~1e-10 pixels ('matrix') at 0.86
+        arcsec/pixel, ~2e-3 and ~1e-9 pixels at 0.1 arcsec/pixel, and
+        better than 1e-7 pixels with both engines at 3.6 arcsec/pixel.
+    dtype : {None, float32, float64}, optional
+        Floating point type of the result and of the arithmetic. If None
+        (default), single precision is used if `out` is single precision
+        or if `x` and `y` are single precision arrays, and double precision
+        otherwise. See Notes for the accuracy of single precision.
+    relative : bool, optional
+        If True, `x` and `y` are offsets from CRPIX1 and CRPIX2, and `lon`
+        and `lat` are returned as offsets from CRVAL1 and CRVAL2 (`lon`
+        wrapped into [-180, 180]). Single precision offsets are much more
+        precise than absolute single precision coordinates. Default is
+        False.
 
     Returns
     -------
     float or array
         Celestial spherical longitude (lon) and latitude (lat) for the
-        celestial coordinate system specified by CTYPE1 and CTYPE2.
+        celestial coordinate system specified by CTYPE1 and CTYPE2. If
+        `out` is given, it is returned.
+
+    Notes
+    -----
+    The transformation is fused: all intermediate quantities are kept in
+    radians in a few block-sized scratch arrays, so the only full-size
+    arrays are the inputs and the outputs.
+
+    In single precision, TAN projections use a dedicated formulation in
+    terms of the offsets from the reference point that avoids cancellation,
+    and run several times faster than double precision while using half the
+    memory. Relative to the double precision result, the error in the
+    offsets from CRVAL is within 1e-6 times the offset, i.e., a few mas
+    over a 1 degree field. CRVAL is added to the offsets in double
+    precision, so absolute single precision coordinates are only further
+    limited by their final rounding, up to half a unit in the last place
+    (e.g., 7.6e-6 deg = 27 mas at 255 degrees). Other projections compute
+    in double precision and only round the results to single precision.
 
     """
-    xp, yp = pix2proj(x, y, hdr)
-    phi, theta = proj2natsph(xp, yp, hdr)
-    lon, lat = natsph2celsph(phi, theta, hdr)
-    return lon, lat
+    return _get_wcs(hdr).pix2world(x, y, out=out, blocksize=blocksize,
+                                   workers=workers, engine=engine,
+                                   dtype=dtype, relative=relative)
 
 
-def world2pix(lon, lat, hdr):
+def world2pix(lon, lat, hdr, out=None, blocksize=None, workers=None,
+              engine='trig', dtype=None, relative=False):
     """Convert celestial coordinates into pixel coordinates accoring to
     Calabretta & Greisen (2002).
 
@@ -362,8 +1782,8 @@ def world2pix(lon, lat, hdr):
     lon, lat : float or array
         Celestial spherical longitude (lon) and latitude (lat) for the
         celestial coordinate system specified by CTYPE1 and CTYPE2.
-    hdr : astropy.io.fits.Header or dictionary
-        A FITS header. Required keywords:
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance. Required keywords:
 
         - CTYPE1, CTYPE2
         - CRPIX1, CRPIX2
@@ -376,14 +1796,728 @@ def world2pix(lon, lat, hdr):
           and CRVAL1, CRVAL2, and celestial longitude and latitude into
           degrees. If omitted, everything is assumed to be in degrees
           (deg/pix for the CD matrix).
+        - LONPOLE, LATPOLE: Native longitude of the celestial pole and
+          celestial latitude of the native pole in degrees; see `WCS`.
+    out : tuple of arrays, optional
+        Arrays (x, y) in which to store the result, e.g., two columns of a
+        structured array. They must have the broadcast shape of `lon` and
+        `lat`. If None (default), new arrays are allocated.
+    blocksize : int, optional
+        Number of points transformed at a time. Default is `BLOCKSIZE`.
+    workers : int, optional
+        Number of threads to split the blocks across; see `pix2world`.
+        Default is None (no threads).
+    engine : {'trig', 'matrix'}, optional
+        Formulation of the spherical rotation; see `pix2world`. Default is
+        'trig'.
+    dtype : {None, float32, float64}, optional
+        Floating point type of the result and of the arithmetic; see
+        `pix2world`. Default is None.
+    relative : bool, optional
+        If True, `lon` and `lat` are offsets from CRVAL1 and CRVAL2 and `x`
+        and `y` are returned as offsets from CRPIX1 and CRPIX2. Default is
+        False.
 
     Returns
     -------
     float or array
-        x and y pixel coordinates.
+        x and y pixel coordinates. If `out` is given, it is returned.
+
+    Notes
+    -----
+    The transformation is fused; see `pix2world`.
+
+    In single precision, TAN projections use a dedicated formulation like
+    `pix2world`. Relative to the double precision result for the same
+    input, the error in each pixel coordinate is within 1e-6 times the
+    distance from CRPIX, e.g., 2e-3 pixels at 2048 pixels, plus the
+    rounding of the result to single precision, up to half a unit in the
+    last place (1.2e-4 pixels between 1024 and 2048). CRPIX is added in
+    double precision, so it is not rounded separately.
+
+    """
+    return _get_wcs(hdr).world2pix(lon, lat, out=out, blocksize=blocksize,
+                                   workers=workers, engine=engine,
+                                   dtype=dtype, relative=relative)
+
+
+def pix2pix(x, y, hdr1, hdr2, out=None, blocksize=None, workers=None,
+            engine='trig', dtype=None):
+    """Convert pixel coordinates in one image into pixel coordinates in
+    another image.
+
+    This is equivalent to ``world2pix(*pix2world(x, y, hdr1), hdr2)``, but
+    the whole chain is fused so that celestial coordinates are never
+    materialized.
+
+    Parameters
+    ----------
+    x, y : float or array
+        x and y pixel coordinates in the first image.
+    hdr1, hdr2 : astropy.io.fits.Header, dictionary, or WCS
+        FITS headers or precomputed `WCS` instances of the first and second
+        images; see `pix2world`.
+    out, blocksize, workers, engine : optional
+        See `pix2world`.
+    dtype : {None, float32, float64}, optional
+        Floating point type of the result; see `pix2world`. The arithmetic
+        is always done in double precision.
+
+    Returns
+    -------
+    float or array
+        x and y pixel coordinates in the second image. If `out` is given,
+        it is returned.
+
+    """
+    w1, w2 = _get_wcs(hdr1), _get_wcs(hdr2)
+
+    def block_func(x1, y1, x2, y2, a, b, s1, s2, s3, s4, engine,
+                   relative=False):
+        w1._pix2sph(x1, y1, a, b, s1, s2, s3, s4, engine)
+        w2._sph2pix(a, b, x2, y2, s1, s2, s3, s4, engine)
+
+    return w1._transform(block_func, x, y, out, blocksize, workers, engine,
+                         dtype)
+
+
+# Default number of points per chunk for the streaming transforms
+CHUNKSIZE = 2**20
+
+
+def iter_chunks(u, v, chunksize=None):
+    """Split a pair of (possibly memory-mapped) 1d arrays into chunks.
+
+    Parameters
+    ----------
+    u, v : array
+        Input arrays of the same length, e.g., x and y pixel coordinates.
+        Only one chunk of each is read into memory at a time.
+    chunksize : int, optional
+        Number of points per chunk. Default is `CHUNKSIZE`.
+
+    Yields
+    ------
+    tuple
+        Successive (u, v) chunks. Chunks are views of the input arrays.
+
+    """
+    if chunksize is None:
+        chunksize = CHUNKSIZE
+    n = len(u)
+    if len(v) != n:
+        raise ValueError('u and v must have the same length')
+    for i in range(0, n, chunksize):
+        yield u[i:i+chunksize], v[i:i+chunksize]
+
+
+def _iter_transform(func, chunks, hdr, blocksize):
+    w = _get_wcs(hdr)
+    for u, v in chunks:
+        yield getattr(w, func)(u, v, blocksize=blocksize)
+
+
+def iter_pix2world(chunks, hdr, blocksize=None):
+    """Convert pixel coordinates into celestial coordinates one chunk at a
+    time.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Iterable of (x, y) pairs of x and y pixel coordinate arrays, e.g.,
+        from a generator or from `iter_chunks`.
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+    blocksize : int, optional
+        Number of points transformed at a time within each chunk. Default
+        is `BLOCKSIZE`.
+
+    Yields
+    ------
+    tuple
+        (lon, lat) arrays for each chunk.
 
     """
-    phi, theta = celsph2natsph(lon, lat, hdr)
-    xp, yp = natsph2proj(phi, theta, hdr)
-    x, y = proj2pix(xp, yp, hdr)
-    return x, y
+    return _iter_transform('pix2world', chunks, hdr, blocksize)
+
+
+def iter_world2pix(chunks, hdr, blocksize=None):
+    """Convert celestial coordinates into pixel coordinates one chunk at a
+    time.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Iterable of (lon, lat) pairs of celestial longitude and latitude
+        arrays, e.g., from a generator or from `iter_chunks`.
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `world2pix`.
+    blocksize : int, optional
+        Number of points transformed at a time within each chunk. Default
+        is `BLOCKSIZE`.
+
+    Yields
+    ------
+    tuple
+        (x, y) arrays for each chunk.
+
+    """
+    return _iter_transform('world2pix', chunks, hdr, blocksize)
+
+
+def open_column(filename, dtype=None, mode='r', shape=None):
+    """Memory-map a column file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file. Files with a ".npy" extension are treated as
+        NumPy binary files; anything else is treated as a raw binary file.
+    dtype : data-type, optional
+        Data type of a raw binary file. Ignored for existing ".npy" files.
+        Default is float64.
+    mode : {'r', 'r+', 'w+'}, optional
+        Access mode; see `numpy.memmap`. Default is 'r'.
+    shape : int or tuple, optional
+        Shape of the array. Required with mode 'w+'.
+
+    Returns
+    -------
+    numpy.memmap
+
+    """
+    if dtype is None:
+        dtype = float
+    if filename.endswith('.npy'):
+        if mode == 'w+':
+            return np.lib.format.open_memmap(filename, mode=mode, dtype=dtype,
+                                             shape=shape)
+        return np.load(filename, mmap_mode=mode)
+    return np.memmap(filename, dtype=dtype, mode=mode, shape=shape)
+
+
+def _file_transform(func, infiles, outfiles, hdr, dtype, out_dtype,
+                    chunksize, blocksize):
+    if chunksize is None:
+        chunksize = CHUNKSIZE
+    w = _get_wcs(hdr)
+    u, v = [open_column(f, dtype=dtype) for f in infiles]
+    if u.shape != v.shape:
+        raise ValueError('input columns must have the same shape')
+    p, q = [open_column(f, dtype=out_dtype, mode='w+', shape=u.shape)
+            for f in outfiles]
+    u, v, p, q = [a.reshape(-1) for a in (u, v, p, q)]
+    for i in range(0, len(u), chunksize):
+        j = i + chunksize
+        getattr(w, func)(u[i:j], v[i:j], out=(p[i:j], q[i:j]),
+                         blocksize=blocksize)
+    p.flush()
+    q.flush()
+    return p, q
+
+
+def pix2world_file(xfile, yfile, lonfile, latfile, hdr, dtype=None,
+                   out_dtype=None, chunksize=None, blocksize=None):
+    """Convert pixel coordinates stored in column files into celestial
+    coordinates, writing the results to memory-mapped column files.
+
+    Peak memory is bounded by `chunksize` regardless of the number of
+    points in the files.
+
+    Parameters
+    ----------
+    xfile, yfile : str
+        Input files containing the x and y pixel coordinates; see
+        `open_column`.
+    lonfile, latfile : str
+        Output files for the celestial longitude and latitude. Overwritten
+        if they exist.
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+    dtype : data-type, optional
+        Data type of raw binary input files. Default is float64.
+    out_dtype : data-type, optional
+        Data type of the output files. Default is float64.
+    chunksize : int, optional
+        Number of points per chunk. Default is `CHUNKSIZE`.
+    blocksize : int, optional
+        Number of points transformed at a time within each chunk. Default
+        is `BLOCKSIZE`.
+
+    Returns
+    -------
+    tuple
+        (lon, lat) `numpy.memmap` arrays of the output files.
+
+    """
+    return _file_transform('pix2world', (xfile, yfile), (lonfile, latfile),
+                           hdr, dtype, out_dtype, chunksize, blocksize)
+
+
+def world2pix_file(lonfile, latfile, xfile, yfile, hdr, dtype=None,
+                   out_dtype=None, chunksize=None, blocksize=None):
+    """Convert celestial coordinates stored in column files into pixel
+    coordinates, writing the results to memory-mapped column files.
+
+    Peak memory is bounded by `chunksize` regardless of the number of
+    points in the files.
+
+    Parameters
+    ----------
+    lonfile, latfile : str
+        Input files containing the celestial longitude and latitude; see
+        `open_column`.
+    xfile, yfile : str
+        Output files for the x and y pixel coordinates. Overwritten if
+        they exist.
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `world2pix`.
+    dtype : data-type, optional
+        Data type of raw binary input files. Default is float64.
+    out_dtype : data-type, optional
+        Data type of the output files. Default is float64.
+    chunksize : int, optional
+        Number of points per chunk. Default is `CHUNKSIZE`.
+    blocksize : int, optional
+        Number of points transformed at a time within each chunk. Default
+        is `BLOCKSIZE`.
+
+    Returns
+    -------
+    tuple
+        (x, y) `numpy.memmap` arrays of the output files.
+
+    """
+    return _file_transform('world2pix', (lonfile, latfile), (xfile, yfile),
+                           hdr, dtype, out_dtype, chunksize, blocksize)
+
+
+def _grid_nodes(start, stop, step):
+    """Coarse grid node positions from `start` to `stop` inclusive, spaced
+    by `step` except for the last interval.
+
+    """
+    nodes = np.arange(start, stop, step, dtype=float)
+    if not len(nodes) or nodes[-1] != stop:
+        nodes = np.append(nodes, stop)
+    return nodes
+
+
+def _interp_weights(nodes, points):
+    """Indices of the bracketing nodes and the linear interpolation weight
+    of the upper node for each point.
+
+    """
+    k0 = np.searchsorted(nodes, points, side='right') - 1
+    k0 = np.clip(k0, 0, len(nodes)-1)
+    k1 = np.minimum(k0+1, len(nodes)-1)
+    dnode = nodes[k1] - nodes[k0]
+    dnode[dnode == 0] = np.inf  # Weight is 0 past the last node
+    t = (points - nodes[k0]) / dnode
+    return k0, k1, t
+
+
+def _interp_grid(grid, yweights, xweights, out=None):
+    """Bilinearly interpolate a 2d coarse grid at the points specified by
+    `yweights` and `xweights` (see `_interp_weights`), optionally storing
+    the result in `out`.
+
+    """
+    kx0, kx1, tx = xweights
+    ky0, ky1, ty = yweights
+    h = grid[:, kx0]*(1-tx) + grid[:, kx1]*tx
+    # Interpolate along y from the differences between grid rows, so only
+    # one full-size temporary is needed. ky1 == ky0 only where ty == 0.
+    dh = np.zeros_like(h)
+    dh[:-1] = np.diff(h, axis=0)
+    if out is None:
+        out = np.empty((len(ky0), h.shape[1]))
+    np.take(dh, ky0, axis=0, out=out)
+    out *= ty[:, None]
+    out += h[ky0]
+    return out
+
+
+def _angular_error(lon1, lat1, lon2, lat2):
+    """Small-angle separation between two sets of celestial coordinates, all
+    in degrees.
+
+    """
+    dlon = (lon1 - lon2 + 180) % 360 - 180
+    dlat = lat1 - lat2
+    return np.hypot(dlon*np.cos(lat1*D2R), dlat)
+
+
+def world_map_tile(rows, cols, hdr, maxerr=1e-7, step=32, out=None):
+    """Celestial coordinates of every pixel in a rectangular section of an
+    image, interpolated from a coarse grid.
+
+    The exact transformation is evaluated on a coarse grid of pixels with
+    spacing `step`, and the coordinates of the other pixels in each grid
+    cell are bilinearly interpolated from its corners. The interpolation
+    error is verified at the center and edge midpoints of each cell. Only
+    the cells where it exceeds `maxerr` are refined, down to exact
+    evaluation of their pixels.
+
+    Parameters
+    ----------
+    rows, cols : tuple
+        (start, stop) array indices of the section along the first (y) and
+        second (x) axes. Array index i corresponds to pixel coordinate
+        i + 1 (FITS convention).
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+    maxerr : float, optional
+        Maximum allowed interpolation error in degrees. Default is 1e-7
+        (0.36 mas).
+    step : int, optional
+        Initial spacing of the coarse grid in pixels. Default is 32.
+    out : tuple of arrays, optional
+        2d arrays (lon, lat) with the shape of the section in which to
+        store the result, e.g., views of the full-image arrays. If None
+        (default), new arrays are allocated.
+
+    Returns
+    -------
+    tuple
+        2d (lon, lat) arrays for the section. If `out` is given, it is
+        returned.
+
+    Notes
+    -----
+    The interpolation error scales as the square of the grid spacing, so a
+    cell with error ``err`` is refined directly to the spacing expected to
+    meet `maxerr`, ``step/2**ceil(log2(err/maxerr)/2)``, rather than by
+    successive halving. The refined cells are verified again, and refined
+    further if needed. At each level, the exact transformation is evaluated
+    once on the lattice of nodes and cell midpoints covering the cells being
+    tried, so neighboring cells share their nodes and edge midpoints.
+
+    """
+    w = _get_wcs(hdr)
+    (r0, r1), (c0, c1) = rows, cols
+    x = np.arange(c0, c1) + 1.0
+    y = np.arange(r0, r1) + 1.0
+    if out is None:
+        out = np.empty((len(y), len(x))), np.empty((len(y), len(x)))
+    lon, lat = out
+    # Sections of up to a few grid cells are faster to transform exactly
+    if len(x) < 2 or len(y) < 2 or len(x)*len(y) <= (2*step)**2:
+        return w.pix2world(x[None, :], y[:, None], out=out)
+
+    pending = np.ones(lon.shape, dtype=bool)  # Pixels not yet computed
+    level = np.zeros(lon.shape, dtype=np.int8)  # Next level to try
+    k = 0
+    while step >> k > 1:
+        xnodes = _grid_nodes(x[0], x[-1], step >> k)
+        ynodes = _grid_nodes(y[0], y[-1], step >> k)
+        # Cell i spans pixels [start[i], start[i+1]); the last cell also
+        # includes the last pixel
+        xstart = (xnodes[:-1] - x[0]).astype(int)
+        ystart = (ynodes[:-1] - y[0]).astype(int)
+        cx = np.repeat(np.arange(len(xstart)), np.diff(np.r_[xstart, len(x)]))
+        cy = np.repeat(np.arange(len(ystart)), np.diff(np.r_[ystart, len(y)]))
+        trying = pending & (level == k) if k else pending
+        active = np.logical_or.reduceat(
+            np.logical_or.reduceat(trying, ystart, axis=0), xstart, axis=1)
+
+        # Exact coordinates on the lattice of nodes (even indices) and cell
+        # midpoints of the active cells
+        xlat = np.empty(2*len(xnodes) - 1)
+        xlat[::2], xlat[1::2] = xnodes, (xnodes[:-1] + xnodes[1:])/2
+        ylat = np.empty(2*len(ynodes) - 1)
+        ylat[::2], ylat[1::2] = ynodes, (ynodes[:-1] + ynodes[1:])/2
+        need = np.zeros((len(ylat), len(xlat)), dtype=bool)
+        for dy in range(3):
+            for dx in range(3):
+                need[dy:len(ylat)-2+dy:2, dx:len(xlat)-2+dx:2] |= active
+        j, i = np.nonzero(need)
+        llon, llat = np.zeros(need.shape), np.zeros(need.shape)
+        llon[j, i], llat[j, i] = w.pix2world(xlat[i], ylat[j])
+        glon, glat = llon[::2, ::2], llat[::2, ::2]
+
+        # Interpolation error at the midpoints, from the mean of the
+        # bracketing nodes; the error of a cell is the largest on its center
+        # and edges
+        err = np.zeros(need.shape)
+        mid = need & ((np.arange(len(ylat)) % 2 == 1)[:, None] |
+                      (np.arange(len(xlat)) % 2 == 1)[None, :])
+        j, i = np.nonzero(mid)
+        j0, j1 = j - j % 2, j + j % 2
+        i0, i1 = i - i % 2, i + i % 2
+        ilon = (llon[j0, i0] + llon[j0, i1] + llon[j1, i0] + llon[j1, i1])/4
+        ilat = (llat[j0, i0] + llat[j0, i1] + llat[j1, i0] + llat[j1, i1])/4
+        err[j, i] = _angular_error(llon[j, i], llat[j, i], ilon, ilat)
+        cellerr = np.maximum.reduce([err[1::2, 1::2], err[:-1:2, 1::2],
+                                     err[2::2, 1::2], err[1::2, :-1:2],
+                                     err[1::2, 2::2]])
+        bad = active & ~(cellerr <= maxerr)  # Non-finite errors fail too
+
+        if not k and not bad.any():  # Whole tile passed
+            yweights = _interp_weights(ynodes, y)
+            xweights = _interp_weights(xnodes, x)
+            return (_interp_grid(glon, yweights, xweights, out=lon),
+                    _interp_grid(glat, yweights, xweights, out=lat))
+
+        # Interpolate the pixels of the cells that passed, over the bounding
+        # box of those pixels
+        badpix = bad[cy[:, None], cx[None, :]]
+        done = trying & ~badpix
+        j, i = np.flatnonzero(done.any(axis=1)), np.flatnonzero(done.any(0))
+        if len(j):
+            box = slice(j[0], j[-1]+1), slice(i[0], i[-1]+1)
+            yweights = _interp_weights(ynodes, y[box[0]])
+            xweights = _interp_weights(xnodes, x[box[1]])
+            np.copyto(lon[box], _interp_grid(glon, yweights, xweights),
+                      where=done[box])
+            np.copyto(lat[box], _interp_grid(glat, yweights, xweights),
+                      where=done[box])
+            pending &= ~done
+
+        # Levels at which to try the failed cells next
+        if bad.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                halvings = np.ceil(np.log2(cellerr[bad]/maxerr)/2)
+            halvings = np.nan_to_num(halvings, nan=64)
+            nextlevel = np.zeros(bad.shape, dtype=np.int8)
+            nextlevel[bad] = k + np.clip(halvings, 1, 64 - k)
+            np.maximum(level, nextlevel[cy[:, None], cx[None, :]], out=level)
+        if not pending.any():
+            break
+        k = level[pending].min()
+
+    j, i = np.nonzero(pending)
+    lon[j, i], lat[j, i] = w.pix2world(x[i], y[j])
+    return lon, lat
+
+
+def _tiles(shape, tilesize):
+    """(rows, cols) slices of the square tiles covering an image."""
+    ny, nx = shape
+    for r0 in range(0, ny, tilesize):
+        for c0 in range(0, nx, tilesize):
+            yield (slice(r0, min(r0+tilesize, ny)),
+                   slice(c0, min(c0+tilesize, nx)))
+
+
+def iter_world_map(shape, hdr, maxerr=1e-7, step=32, tilesize=512):
+    """Lazily generate the celestial coordinates of every pixel in an image
+    tile by tile.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the image, (ny, nx).
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+    maxerr, step : optional
+        See `world_map_tile`.
+    tilesize : int, optional
+        Size of the (square) tiles in pixels. Default is 512.
+
+    Yields
+    ------
+    tuple
+        (rows, cols, lon, lat) for each tile, where `rows` and `cols` are
+        slices of the image and `lon` and `lat` are the coordinates of the
+        pixels in ``image[rows, cols]``.
+
+    """
+    w = _get_wcs(hdr)
+    for rows, cols in _tiles(shape, tilesize):
+        lon, lat = world_map_tile((rows.start, rows.stop),
+                                  (cols.start, cols.stop), w, maxerr=maxerr,
+                                  step=step)
+        yield rows, cols, lon, lat
+
+
+def world_map(shape, hdr, maxerr=1e-7, step=32, tilesize=512):
+    """Celestial coordinates of every pixel in an image.
+
+    The coordinates are interpolated from a coarse grid; see
+    `world_map_tile` for how the error is controlled. At the default
+    `maxerr` and `step`, this is about 2-3 times faster than calling
+    `pix2world` on the full grid of pixels for images from 128x128 to
+    4096x4096 pixels, as long as the interpolation rarely needs refining.
+    Images of up to (2*`step`)**2 pixels are transformed exactly, which is
+    faster for them.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the image, (ny, nx). Array index i corresponds to pixel
+        coordinate i + 1 (FITS convention).
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+    maxerr, step : optional
+        See `world_map_tile`.
+    tilesize : int, optional
+        See `iter_world_map`.
+
+    Returns
+    -------
+    tuple
+        2d (lon, lat) arrays with the given shape.
+
+    """
+    w = _get_wcs(hdr)
+    lon, lat = np.empty(shape), np.empty(shape)
+    for rows, cols in _tiles(shape, tilesize):
+        world_map_tile((rows.start, rows.stop), (cols.start, cols.stop), w,
+                       maxerr=maxerr, step=step,
+                       out=(lon[rows, cols], lat[rows, cols]))
+    return lon, lat
+
+
+class PolyPix2World(object):
+
+    """Fast approximate pixel -> world transformation over a rectangular
+    region of pixels, using fitted 2d polynomials.
+
+    The exact transformation is evaluated on a grid spanning the region,
+    and polynomials in the normalized pixel coordinates are fit by least
+    squares to the longitude and latitude offsets from the center of the
+    region. The fit is then checked against the exact transformation on a
+    validation grid offset from the fitting grid. If the error exceeds
+    `maxerr`, higher degrees are tried up to `maxdegree`; if none of them
+    is accurate enough, the exact transformation is used instead.
+
+    Evaluating the polynomials takes about degree**2 multiply-adds per
+    point, much less than the trigonometry of the exact transformation.
+    Points outside the region always use the exact transformation.
+
+    Parameters
+    ----------
+    hdr : astropy.io.fits.Header, dictionary, or WCS
+        A FITS header or a precomputed `WCS` instance; see `pix2world`.
+    xlim, ylim : tuple
+        (min, max) x and y pixel coordinates of the region.
+    maxerr : float, optional
+        Maximum allowed error in degrees. Default is 1e-7 (0.36 mas).
+    degree : int, optional
+        Degree of the polynomials. If None (default), the lowest degree
+        meeting `maxerr` is used.
+    maxdegree : int, optional
+        Highest degree tried if `degree` is None. Default is 7.
+
+    Attributes
+    ----------
+    wcs : WCS
+        The exact transformation.
+    degree : int or None
+        Degree of the polynomials, or None if the exact transformation is
+        used.
+    error : float
+        Maximum error of the polynomials on the validation grid in degrees.
+    exact : bool
+        True if no polynomial met `maxerr` and the exact transformation is
+        used.
+
+    Methods
+    -------
+    pix2world(x, y, out=None, blocksize=None)
+        Same as `WCS.pix2world`, but approximate inside the region.
+
+    """
+
+    def __init__(self, hdr, xlim, ylim, maxerr=1e-7, degree=None,
+                 maxdegree=7):
+        self.wcs = _get_wcs(hdr)
+        self.xlim, self.ylim = tuple(xlim), tuple(ylim)
+        self._center = np.array([np.mean(xlim), np.mean(ylim)])
+        self._halfwidth = np.array([max(xlim[1]-xlim[0], 1e-9)/2.0,
+                                    max(ylim[1]-ylim[0], 1e-9)/2.0])
+        self._lonlat0 = self.wcs.pix2world(*self._center)
+
+        degrees = range(1, maxdegree+1) if degree is None else [degree]
+        ngrid = 2*max(degrees) + 3
+
+        # Fitting grid with nodes at the edges of the region, and a
+        # validation grid halfway between the nodes, plus the edges
+        ufit = np.linspace(-1, 1, ngrid)
+        uval = np.r_[-1, (ufit[:-1] + ufit[1:])/2, 1]
+        fit = self._exact_offsets(ufit)
+        val = self._exact_offsets(uval)
+
+        self.degree, self.error, self._coeffs = None, np.inf, None
+        for deg in degrees:
+            coeffs = self._fit(deg, *fit)
+            error = self._check(coeffs, *val)
+            if error <= maxerr:
+                self.degree, self.error, self._coeffs = deg, error, coeffs
+                break
+            self.error = min(self.error, error)
+        self.exact = self._coeffs is None
+
+    def _exact_offsets(self, u1d):
+        """Normalized pixel coordinates of a grid and the exact longitude
+        and latitude offsets from the center of the region in degrees.
+
+        """
+        u, v = np.meshgrid(u1d, u1d)
+        u, v = u.ravel(), v.ravel()
+        x, y = self._center[:, None] + self._halfwidth[:, None]*[u, v]
+        lon, lat = self.wcs.pix2world(x, y)
+        dlon = (lon - self._lonlat0[0] + 180) % 360 - 180
+        return u, v, dlon, lat - self._lonlat0[1]
+
+    def _fit(self, degree, u, v, dlon, dlat):
+        """Least squares polynomial coefficients, (2, degree+1, degree+1)."""
+        terms = _poly_terms(degree)
+        design = np.column_stack([u**i * v**j for i, j in terms])
+        sol = np.linalg.lstsq(design, np.column_stack([dlon, dlat]),
+                              rcond=None)[0]
+        coeffs = np.zeros((2, degree+1, degree+1))
+        for k, (i, j) in enumerate(terms):
+            coeffs[:, i, j] = sol[k]
+        return coeffs
+
+    def _check(self, coeffs, u, v, dlon, dlat):
+        """Maximum angular error of the polynomials in degrees."""
+        plon, plat, s1 = np.empty_like(u), np.empty_like(u), np.empty_like(u)
+        _horner2d(coeffs[0], u, v, plon, s1)
+        _horner2d(coeffs[1], u, v, plat, s1)
+        lon0, lat0 = self._lonlat0
+        return _angular_error(dlon + lon0, dlat + lat0, plon + lon0,
+                              plat + lat0).max()
+
+    def _pix2world_block(self, x, y, lon, lat, u, v, s1):
+        """Approximate pixel -> world transformation of a single block."""
+        np.subtract(x, self._center[0], out=u)
+        np.divide(u, self._halfwidth[0], out=u)
+        np.subtract(y, self._center[1], out=v)
+        np.divide(v, self._halfwidth[1], out=v)
+        _horner2d(self._coeffs[0], u, v, lon, s1)
+        _horner2d(self._coeffs[1], u, v, lat, s1)
+        np.add(lon, self._lonlat0[0], out=lon)
+        np.add(lat, self._lonlat0[1], out=lat)
+
+        outside = ((x < self.xlim[0]) | (x > self.xlim[1]) |
+                   (y < self.ylim[0]) | (y > self.ylim[1]))
+        if outside.any():
+            lon[outside], lat[outside] = self.wcs.pix2world(x[outside],
+                                                            y[outside])
+
+    def pix2world(self, x, y, out=None, blocksize=None):
+        """Approximate celestial coordinates of pixels; see `pix2world`.
+
+        Within the region, the error is at most `maxerr` (as verified on
+        the validation grid). Points outside the region, or all points if
+        `exact` is True, use the exact transformation.
+
+        """
+        if self.exact:
+            return self.wcs.pix2world(x, y, out=out, blocksize=blocksize)
+        if blocksize is None:
+            blocksize = BLOCKSIZE
+
+        it = _blocks(x, y, out, blocksize)
+        with it:
+            lon, lat = it.operands[2], it.operands[3]
+            scratch = np.empty((3, blocksize))
+            for xb, yb, lonb, latb in it:
+                self._pix2world_block(xb, yb, lonb, latb,
+                                      *scratch[:, :len(xb)])
+        if out is None:
+            return lon[()], lat[()]
+        return out
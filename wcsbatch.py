@@ -0,0 +1,429 @@
+"""
+Batch conversion of catalog files between pixel and celestial coordinates.
+
+Catalogs are streamed in chunks of rows, so the memory used per file is
+bounded by the chunk size regardless of the size of the file, and files are
+distributed across a pool of worker processes. Each output file is written
+under a temporary name in the destination directory and renamed when
+complete, so an output file either does not exist or is complete.
+
+Supported catalog formats, chosen by file extension:
+
+- ".csv", ".txt": delimited text with a header line of column names. The
+  output has all of the input columns followed by the two new columns.
+- ".npy": NumPy binary file with a 2d array of shape (nrows, ncols) or a
+  1d structured array. The output is the input array with two more
+  columns (or fields). The new fields are float64, and a 2d array is
+  promoted to at least float64, so that integer pixel coordinates give
+  floating point results.
+- Anything else: raw binary rows of `ncols` values of type `dtype`. The
+  output has rows of ``ncols + 2`` values of `dtype` promoted to at least
+  float64.
+
+Headers are read from FITS files (requires astropy), JSON files of keyword
+-> value, or text files of "KEYWORD = value / comment" cards. Either one
+header is used for all catalogs, or one header is given per catalog.
+
+Run as a script, e.g.::
+
+  python wcsbatch.py -H image.fits -c x y cat1.csv cat2.csv
+  python wcsbatch.py -H image1.fits -H image2.fits cat1.csv cat2.csv
+  python wcsbatch.py -d world2pix -H hdr.json -c 0 1 -w 8 *.npy
+
+The input columns default to x and y for pix2world and to lon and lat for
+world2pix.
+
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+
+import wcs
+
+
+# Default number of catalog rows per chunk
+CHUNKSIZE = 2**18
+
+# Default names of the input and output columns for each direction
+INPUT_COLUMNS = {
+    'pix2world': ('x', 'y'),
+    'world2pix': ('lon', 'lat'),
+    }
+OUTPUT_COLUMNS = {
+    'pix2world': ('lon', 'lat'),
+    'world2pix': ('x', 'y'),
+    }
+
+
+def _parse_card_value(value):
+    """Python value of a FITS header card value string."""
+    value = value.strip()
+    if value.startswith("'"):
+        return value[1:value.rindex("'")].rstrip()
+    value = value.split('/')[0].strip()
+    if value in ('T', 'F'):
+        return value == 'T'
+    for func in (int, float):
+        try:
+            return func(value)
+        except ValueError:
+            pass
+    return value
+
+
+def read_header(filename):
+    """Read a FITS header into a dictionary.
+
+    Parameters
+    ----------
+    filename : str
+        A FITS file (".fits", ".fit", ".fts", optionally gzipped; the
+        primary header is used), a JSON file of keyword -> value, or a text
+        file with one "KEYWORD = value / comment" card per line.
+
+    Returns
+    -------
+    dictionary or astropy.io.fits.Header
+
+    """
+    name = filename[:-3] if filename.endswith('.gz') else filename
+    if os.path.splitext(name)[1].lower() in ('.fits', '.fit', '.fts'):
+        from astropy.io import fits
+        return fits.getheader(filename)
+    if filename.endswith('.json'):
+        with open(filename) as f:
+            return json.load(f)
+    hdr = {}
+    with open(filename) as f:
+        for line in f:
+            if '=' not in line[:10]:
+                continue  # COMMENT, HISTORY, END, blank
+            key, value = line.split('=', 1)
+            hdr[key.strip()] = _parse_card_value(value)
+    return hdr
+
+
+def _catalog_format(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.csv', '.txt'):
+        return 'csv'
+    if ext == '.npy':
+        return 'npy'
+    return 'raw'
+
+
+def _column_index(column, names):
+    """Index of a column given by name or by (string) index."""
+    try:
+        return int(column)
+    except ValueError:
+        pass
+    try:
+        return names.index(column)
+    except ValueError:
+        raise ValueError('Unknown column: {:s}'.format(column))
+
+
+def _transform_csv(func, fin, fout, columns, out_columns, chunksize,
+                   delimiter, fmt):
+    names = fin.readline().rstrip('\r\n')
+    fout.write(delimiter.join([names] + list(out_columns)) + '\n')
+    names = [name.strip() for name in names.split(delimiter)]
+    usecols = [_column_index(c, names) for c in columns]
+
+    nrows = 0
+    while True:
+        lines = [line.rstrip('\r\n') for line in islice(fin, chunksize)]
+        lines = [line for line in lines if line]
+        if not lines:
+            break
+        u, v = np.loadtxt(lines, delimiter=delimiter, usecols=usecols,
+                          ndmin=2, unpack=True)
+        p, q = func(u, v)
+        for line, pi, qi in zip(lines, p, q):
+            fout.write(delimiter.join((line, fmt % pi, fmt % qi)) + '\n')
+        nrows += len(lines)
+    return nrows
+
+
+def _transform_array(func, data, out, columns, chunksize):
+    """Transform a 2d or structured (possibly memory-mapped) array into an
+    output array with two more columns.
+
+    """
+    names = data.dtype.names
+    if names is None:
+        usecols = [_column_index(c, []) for c in columns]
+        ncols = data.shape[1]
+    else:
+        usecols = [names[_column_index(c, list(names))] for c in columns]
+    for i in range(0, len(data), chunksize):
+        chunk, outchunk = data[i:i+chunksize], out[i:i+chunksize]
+        if names is None:
+            outchunk[:, :ncols] = chunk
+            u, v = chunk[:, usecols[0]], chunk[:, usecols[1]]
+            p, q = outchunk[:, ncols], outchunk[:, ncols+1]
+        else:
+            for name in names:
+                outchunk[name] = chunk[name]
+            u, v = chunk[usecols[0]], chunk[usecols[1]]
+            p, q = outchunk[out.dtype.names[-2]], outchunk[out.dtype.names[-1]]
+        func(u, v, out=(p, q))
+    return len(data)
+
+
+def _atomic_output(outfile):
+    """Temporary file next to `outfile`, with the permissions of a newly
+    created file (`tempfile.mkstemp` makes it private).
+
+    """
+    dirname, basename = os.path.split(os.path.abspath(outfile))
+    fd, tmpfile = tempfile.mkstemp(prefix='.' + basename + '.', suffix='.tmp',
+                                   dir=dirname)
+    os.close(fd)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmpfile, 0o666 & ~umask)
+    return tmpfile
+
+
+def transform_file(infile, outfile, hdr, direction='pix2world',
+                   columns=None, out_columns=None, chunksize=None,
+                   delimiter=',', fmt='%.10f', ncols=None, dtype=None,
+                   blocksize=None):
+    """Convert the coordinates in a catalog file.
+
+    Parameters
+    ----------
+    infile, outfile : str
+        Input and output catalog files; see the module documentation for
+        the formats. `outfile` has the same format as `infile` and is
+        written atomically.
+    hdr : astropy.io.fits.Header, dictionary, or wcs.WCS
+        A FITS header or a precomputed `wcs.WCS` instance.
+    direction : {'pix2world', 'world2pix'}, optional
+        Conversion to do. Default is 'pix2world'.
+    columns : tuple, optional
+        Names or indices of the two input columns, (x, y) or (lon, lat).
+        Default is ('x', 'y') for 'pix2world' and ('lon', 'lat') for
+        'world2pix'.
+    out_columns : tuple, optional
+        Names of the two output columns. Default is ('lon', 'lat') for
+        'pix2world' and ('x', 'y') for 'world2pix'.
+    chunksize : int, optional
+        Number of rows per chunk. Default is `CHUNKSIZE`.
+    delimiter, fmt : str, optional
+        Delimiter and value format of text catalogs. Default is ',' and
+        '%.10f'.
+    ncols : int, optional
+        Number of values per row of raw binary catalogs.
+    dtype : data-type, optional
+        Data type of raw binary catalogs. Default is float64.
+    blocksize : int, optional
+        See `wcs.pix2world`.
+
+    Returns
+    -------
+    int
+        Number of rows converted.
+
+    """
+    if direction not in OUTPUT_COLUMNS:
+        raise ValueError('Unknown direction: {:s}'.format(direction))
+    if columns is None:
+        columns = INPUT_COLUMNS[direction]
+    if out_columns is None:
+        out_columns = OUTPUT_COLUMNS[direction]
+    if chunksize is None:
+        chunksize = CHUNKSIZE
+    w = wcs._get_wcs(hdr)
+    transform = getattr(w, direction)
+
+    def func(u, v, out=None):
+        return transform(u, v, out=out, blocksize=blocksize)
+
+    catalog_format = _catalog_format(infile)
+    tmpfile = _atomic_output(outfile)
+    try:
+        if catalog_format == 'csv':
+            with open(infile) as fin, open(tmpfile, 'w') as fout:
+                nrows = _transform_csv(func, fin, fout, columns, out_columns,
+                                       chunksize, delimiter, fmt)
+        elif catalog_format == 'npy':
+            data = np.load(infile, mmap_mode='r')
+            if data.dtype.names is None:
+                shape = (len(data), data.shape[1] + 2)
+                out_dtype = np.promote_types(data.dtype, float)
+            else:
+                shape = data.shape
+                out_dtype = np.dtype(
+                    [(name, data.dtype[name]) for name in data.dtype.names] +
+                    [(name, float) for name in out_columns])
+            out = np.lib.format.open_memmap(tmpfile, mode='w+',
+                                            dtype=out_dtype, shape=shape)
+            nrows = _transform_array(func, data, out, columns, chunksize)
+            out.flush()
+            del out
+        else:
+            if ncols is None:
+                raise ValueError('ncols is required for raw binary catalogs')
+            data = wcs.open_column(infile, dtype=dtype).reshape(-1, ncols)
+            out = np.memmap(tmpfile, mode='w+',
+                            dtype=np.promote_types(data.dtype, float),
+                            shape=(len(data), ncols + 2))
+            nrows = _transform_array(func, data, out, columns, chunksize)
+            out.flush()
+            del out
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+    return nrows
+
+
+def output_filename(infile, outdir=None, suffix='_wcs'):
+    """Output file name for a catalog: `suffix` is inserted before the
+    extension, in `outdir` if given or else next to `infile`.
+
+    """
+    base, ext = os.path.splitext(os.path.basename(infile))
+    dirname = os.path.dirname(infile) if outdir is None else outdir
+    return os.path.join(dirname, base + suffix + ext)
+
+
+# Headers already read by a worker process, by file name
+_header_cache = {}
+
+
+def _run_task(task):
+    """Convert one catalog in a worker process. Returns (infile, outfile,
+    nrows, seconds, error message or None).
+
+    """
+    infile, outfile, hdrfile, kwargs = task
+    t0 = time.time()
+    try:
+        if hdrfile not in _header_cache:
+            _header_cache[hdrfile] = wcs.WCS(read_header(hdrfile))
+        nrows = transform_file(infile, outfile, _header_cache[hdrfile],
+                               **kwargs)
+    except Exception as e:
+        return infile, outfile, 0, time.time() - t0, str(e)
+    return infile, outfile, nrows, time.time() - t0, None
+
+
+def run(infiles, hdrfiles, outdir=None, suffix='_wcs', workers=None,
+        **kwargs):
+    """Convert many catalogs, distributing the files across a pool of
+    processes.
+
+    Each worker converts one file at a time in chunks of rows (see
+    `transform_file`), so at most `workers` chunks are in memory at once.
+
+    Parameters
+    ----------
+    infiles : list
+        Input catalog files.
+    hdrfiles : list
+        Header files (see `read_header`), either one for all catalogs or
+        one per catalog.
+    outdir, suffix : str, optional
+        See `output_filename`.
+    workers : int, optional
+        Number of worker processes. Default is the number of CPUs. If 1,
+        the files are converted in this process.
+    kwargs
+        Keyword arguments for `transform_file`.
+
+    Yields
+    ------
+    tuple
+        (infile, outfile, nrows, seconds, error) for each file as it
+        completes, where `error` is None or an error message.
+
+    """
+    if len(hdrfiles) == 1:
+        hdrfiles = list(hdrfiles) * len(infiles)
+    if len(hdrfiles) != len(infiles):
+        raise ValueError('Give one header, or one header per catalog')
+    tasks = [(infile, output_filename(infile, outdir, suffix), hdrfile,
+              kwargs) for infile, hdrfile in zip(infiles, hdrfiles)]
+    if workers == 1:
+        for task in tasks:
+            yield _run_task(task)
+        return
+    pool = Pool(workers)
+    try:
+        for result in pool.imap_unordered(_run_task, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert catalog files between pixel and celestial '
+        'coordinates.')
+    parser.add_argument('catalogs', nargs='+', help='input catalog files')
+    parser.add_argument('-H', '--header', action='append', required=True,
+                        dest='headers', help='header file for all catalogs; '
+                        'repeat to give one per catalog')
+    parser.add_argument('-d', '--direction', choices=sorted(OUTPUT_COLUMNS),
+                        default='pix2world', help='default pix2world')
+    parser.add_argument('-c', '--columns', nargs=2,
+                        help='input column names or indices (default x y '
+                        'or lon lat)')
+    parser.add_argument('-o', '--output-columns', nargs=2,
+                        dest='out_columns', help='output column names '
+                        '(default lon lat or x y)')
+    parser.add_argument('--outdir', help='output directory (default: next '
+                        'to each catalog)')
+    parser.add_argument('--suffix', default='_wcs',
+                        help='output file name suffix (default _wcs)')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='worker processes (default: number of CPUs)')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE,
+                        help='rows per chunk (default {:d})'.format(CHUNKSIZE))
+    parser.add_argument('--delimiter', default=',',
+                        help='text catalog delimiter (default ,)')
+    parser.add_argument('--fmt', default='%.10f',
+                        help='text catalog output format (default %%.10f)')
+    parser.add_argument('--ncols', type=int,
+                        help='values per row of raw binary catalogs')
+    parser.add_argument('--dtype', default='f8',
+                        help='raw binary catalog data type (default f8)')
+    args = parser.parse_args(argv)
+
+    columns = None if args.columns is None else tuple(args.columns)
+    kwargs = dict(direction=args.direction, columns=columns,
+                  out_columns=args.out_columns, chunksize=args.chunksize,
+                  delimiter=args.delimiter, fmt=args.fmt, ncols=args.ncols,
+                  dtype=np.dtype(args.dtype))
+    nfailed, ntotal, t0 = 0, 0, time.time()
+    for infile, outfile, nrows, seconds, error in run(
+            args.catalogs, args.headers, outdir=args.outdir,
+            suffix=args.suffix, workers=args.workers, **kwargs):
+        if error is not None:
+            nfailed += 1
+            print('{:s}: FAILED: {:s}'.format(infile, error))
+            continue
+        ntotal += nrows
+        print('{:s} -> {:s}: {:d} rows in {:.2f} s ({:.3e} rows/s)'.format(
+            infile, outfile, nrows, seconds, nrows/max(seconds, 1e-9)))
+    seconds = time.time() - t0
+    print('{:d} files, {:d} rows in {:.2f} s ({:.3e} rows/s), {:d} '
+          'failed'.format(len(args.catalogs), ntotal, seconds,
+                          ntotal/max(seconds, 1e-9), nfailed))
+    return 1 if nfailed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())